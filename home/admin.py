@@ -1,35 +1,112 @@
 from django.contrib import admin
-from .models import ProductMaster, StockMain, StockDetail
+from .models import ProductMaster, Location, StockMain, StockDetail, CountSession, CountLine, Reservation
+from .valuation import deferred_revaluation
+
+class StockStatusListFilter(admin.SimpleListFilter):
+    """Filter products by stock status using the annotated stock level"""
+    title = 'stock status'
+    parameter_name = 'stock_status'
+    
+    def lookups(self, request, model_admin):
+        return [
+            ('in', 'In Stock'),
+            ('low', 'Low Stock'),
+            ('out', 'Out of Stock'),
+        ]
+    
+    def queryset(self, request, queryset):
+        if self.value() == 'in':
+            return queryset.filter(current_stock__gt=5)
+        if self.value() == 'low':
+            return queryset.filter(current_stock__gt=0, current_stock__lte=5)
+        if self.value() == 'out':
+            return queryset.filter(current_stock__lte=0)
+        return queryset
 
 @admin.register(ProductMaster)
 class ProductMasterAdmin(admin.ModelAdmin):
     list_display = ['name', 'sku', 'get_current_stock', 'created_at']
-    list_filter = ['created_at']
+    list_filter = [StockStatusListFilter, 'stats__abc_class', 'created_at']
     search_fields = ['name', 'sku', 'description']
     readonly_fields = ['created_at', 'updated_at']
     
+    def get_queryset(self, request):
+        # Stock is computed for the whole page in the changelist query
+        return super().get_queryset(request).with_current_stock()
+    
     def get_current_stock(self, obj):
         return obj.get_current_stock()
     get_current_stock.short_description = 'Current Stock'
+    get_current_stock.admin_order_field = 'current_stock'
+
+@admin.register(Location)
+class LocationAdmin(admin.ModelAdmin):
+    list_display = ['code', 'name', 'created_at']
+    search_fields = ['code', 'name']
+    readonly_fields = ['created_at']
 
 class StockDetailInline(admin.TabularInline):
     model = StockDetail
     extra = 1
 
+class LedgerAdminMixin:
+    """Edits and deletes of posted lines replay each affected product once, in the same transaction"""
+    
+    def changeform_view(self, *args, **kwargs):
+        with deferred_revaluation():
+            return super().changeform_view(*args, **kwargs)
+    
+    def delete_view(self, *args, **kwargs):
+        with deferred_revaluation():
+            return super().delete_view(*args, **kwargs)
+    
+    def delete_queryset(self, request, queryset):
+        with deferred_revaluation():
+            super().delete_queryset(request, queryset)
+
 @admin.register(StockMain)
-class StockMainAdmin(admin.ModelAdmin):
+class StockMainAdmin(LedgerAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'type', 'date', 'get_total_items', 'created_at']
     list_filter = ['type', 'date', 'created_at']
     search_fields = ['remarks']
     readonly_fields = ['created_at']
+    raw_id_fields = ['reversal_of']
     inlines = [StockDetailInline]
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_total_items()
+    
     def get_total_items(self, obj):
         return obj.get_total_items()
     get_total_items.short_description = 'Total Items'
+    get_total_items.admin_order_field = 'total_items'
 
 @admin.register(StockDetail)
-class StockDetailAdmin(admin.ModelAdmin):
-    list_display = ['transaction', 'product', 'quantity']
-    list_filter = ['transaction__type', 'product']
+class StockDetailAdmin(LedgerAdminMixin, admin.ModelAdmin):
+    list_display = ['transaction', 'product', 'location', 'quantity']
+    list_filter = ['transaction__type', 'location', 'product']
+    list_select_related = ['transaction', 'product', 'location']
     search_fields = ['product__name', 'transaction__remarks']
+
+class CountLineInline(admin.TabularInline):
+    model = CountLine
+    extra = 0
+    raw_id_fields = ['product']
+    readonly_fields = ['system_quantity']
+
+@admin.register(CountSession)
+class CountSessionAdmin(admin.ModelAdmin):
+    list_display = ['id', 'status', 'created_at', 'posted_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['remarks']
+    readonly_fields = ['status', 'created_at', 'posted_at', 'adjustment_in', 'adjustment_out']
+    inlines = [CountLineInline]
+
+@admin.register(Reservation)
+class ReservationAdmin(admin.ModelAdmin):
+    list_display = ['product', 'quantity', 'reference', 'expires_at', 'created_at']
+    list_filter = ['expires_at']
+    list_select_related = ['product']
+    search_fields = ['reference', 'product__sku']
+    raw_id_fields = ['product']
+    readonly_fields = ['created_at']
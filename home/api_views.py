@@ -1,20 +1,185 @@
-from rest_framework import viewsets, status
+from rest_framework import mixins, permissions, viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.settings import api_settings
+from django.db.models import Count, F, Prefetch, ProtectedError, Q
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_date
+from django.utils.text import compress_string
+from django_filters import rest_framework as django_filters
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
-from drf_yasg.utils import swagger_auto_schema
-from drf_yasg import openapi
-from .models import ProductMaster, StockMain, StockDetail
+from .models import ProductMaster, ProductStats, Location, StockMain, StockDetail, CountSession, MonthlyMovement, Reservation
+from .bulk import bulk_upsert_products
+from .caching import product_cache
+from .changefeed import changes_after, head_cursor
+from .counting import CountSessionClosed, count_variances, post_count_session, record_counts
+from .drafts import DraftError, DraftNotFound, add_scan, commit_draft, create_draft, discard_draft, get_draft, remove_line
+from .ledger import ReversalError, TransferError, post_reversal, post_transfer
+from .locations import location_stock
+from .movements import monthly_totals
+from .reservations import ReservationError, active_reservations, reserve
+from .valuation import cost_of_goods, deferred_revaluation, inventory_valuation
+from .forecasting import reorder_suggestions
+from .parsers import CSVParser, read_csv_rows
+from .throttling import ConcurrencyLimitMixin
+from .renderers import ColumnarJSONRenderer, MessagePackRenderer
 from .serializers import (
     ProductMasterSerializer, 
     StockMainSerializer, 
     StockDetailSerializer,
     StockTransactionCreateSerializer,
-    InventoryReportSerializer
+    ProductMasterValuesSerializer,
+    InventoryReportValuesSerializer,
+    CountSessionSerializer,
+    CountVarianceValuesSerializer,
+    ProductValuationValuesSerializer,
+    CostOfGoodsValuesSerializer,
+    ReorderParamsSerializer,
+    ScanDraftSerializer,
+    ScanSerializer,
+    ChangeFeedParamsSerializer,
+    MovementReportParamsSerializer,
+    MonthlyMovementValuesSerializer,
+    LedgerChangeSerializer,
+    TransferSerializer,
+    LocationSerializer,
+    LocationStockValuesSerializer,
+    ReservationSerializer,
+    AvailableToPromiseValuesSerializer,
+    decimal_total,
+    low_stock_status,
+    out_of_stock_status,
 )
 
-class ProductMasterViewSet(viewsets.ModelViewSet):
+def accepts_gzip(accept_encoding):
+    """
+    Whether an Accept-Encoding header allows gzip: listed with a non-zero
+    q-value, or covered by ``*`` when gzip itself is not listed.
+    """
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    return qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0))) > 0
+
+
+class MachineFormatsMixin:
+    """
+    Adds compact formats for high-volume machine clients.
+
+    Besides the default JSON, clients may ask for MessagePack
+    (``application/msgpack`` or ``?format=msgpack``) or columnar JSON
+    (``application/vnd.columnar+json`` or ``?format=columnar``). Those
+    responses are gzip-compressed when the client's Accept-Encoding allows
+    gzip (``gzip;q=0`` refuses it). Browsers keep getting JSON or the
+    browsable API, and HTML is never compressed here.
+    """
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + [
+        ColumnarJSONRenderer,
+        MessagePackRenderer,
+    ]
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        patch_vary_headers(response, ['Accept'])
+        renderer = getattr(response, 'accepted_renderer', None)
+        if getattr(renderer, 'compressible', False) and hasattr(response, 'add_post_render_callback'):
+            patch_vary_headers(response, ['Accept-Encoding'])
+            if accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+                response.add_post_render_callback(self._gzip_rendered_response)
+        return response
+
+    @staticmethod
+    def _gzip_rendered_response(response):
+        response.content = compress_string(response.content)
+        response['Content-Encoding'] = 'gzip'
+        response['Content-Length'] = str(len(response.content))
+
+class SparseFieldsetMixin:
+    """
+    Sparse fieldsets on list and retrieve.
+    
+    ``?fields=id,date`` returns only those fields; nested fields named in
+    ``expandable_fields`` are then left out unless also asked for, e.g.
+    with ``?expand=details``. Without ``?fields=``, or with an empty one,
+    every field is returned. get_queryset() checks wants_field() so columns,
+    annotations, joins and prefetches for fields nobody asked for are never
+    queried.
+    """
+    expandable_fields = ()
+    sparse_actions = ('list', 'retrieve')
+    
+    def requested_fields(self):
+        """Names of the fields to serialize, or None for all of them"""
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = self._parse_requested_fields()
+        return self._requested_fields
+    
+    def _parse_requested_fields(self):
+        if self.action not in self.sparse_actions or self.request is None:
+            return None
+        params = self.request.query_params
+        
+        def names(param):
+            return {name.strip() for name in params.get(param, '').split(',') if name.strip()}
+        
+        available = set(self.get_serializer_class()().fields)
+        errors = {}
+        fields, expand = names('fields'), names('expand')
+        if fields - available:
+            errors['fields'] = [f"Unknown fields: {', '.join(sorted(fields - available))}. "
+                                f"Available: {', '.join(sorted(available))}."]
+        if expand - set(self.expandable_fields):
+            errors['expand'] = [f"Cannot expand: {', '.join(sorted(expand - set(self.expandable_fields)))}. "
+                                f"Expandable: {', '.join(self.expandable_fields) or 'none'}."]
+        if errors:
+            raise ValidationError(errors)
+        if not fields:
+            # An absent or empty ?fields= asks for everything
+            return None
+        return fields | expand
+    
+    def wants_field(self, name):
+        fields = self.requested_fields()
+        return fields is None or name in fields
+    
+    def narrow_columns(self, queryset, *related):
+        """Defer the model columns no requested field reads; ``related`` are extra only() paths"""
+        if self.requested_fields() is None:
+            return queryset
+        columns = [
+            field.name for field in queryset.model._meta.concrete_fields
+            if field.primary_key or self.wants_field(field.name)
+        ]
+        return queryset.only(*columns, *related)
+    
+    def get_serializer(self, *args, **kwargs):
+        if self.action in self.sparse_actions:
+            kwargs.setdefault('fields', self.requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+class ProductMasterFilter(django_filters.FilterSet):
+    """Product filters, including the batch-computed velocity stats"""
+    abc_class = django_filters.ChoiceFilter(field_name='stats__abc_class', choices=ProductStats.ABC_CLASSES)
+    min_out_30d = django_filters.NumberFilter(field_name='stats__out_30d', lookup_expr='gte')
+    min_out_90d = django_filters.NumberFilter(field_name='stats__out_90d', lookup_expr='gte')
+
+    class Meta:
+        model = ProductMaster
+        fields = ['sku']
+
+class ProductMasterViewSet(SparseFieldsetMixin, MachineFormatsMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing products in the warehouse inventory system.
     
@@ -23,14 +188,42 @@ class ProductMasterViewSet(viewsets.ModelViewSet):
     - Create new products with validation
     - Retrieve, update, delete individual products
     - Get current stock level for a specific product
+    - Bulk create/update products by SKU from JSON or CSV
+    - Resolve a scanned SKU to its product and stock level, through the product cache
+    - Report the product cache's hit/miss counters to staff
+    - Filter and sort by velocity and ABC class (see compute_product_stats)
+    - Return only some fields with ?fields=
     """
     queryset = ProductMaster.objects.all()
     serializer_class = ProductMasterSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
-    filterset_fields = ['sku']
+    filterset_class = ProductMasterFilter
     search_fields = ['name', 'sku', 'description']
-    ordering_fields = ['name', 'sku', 'created_at']
+    ordering_fields = ['name', 'sku', 'created_at', 'out_30d', 'out_90d', 'turnover']
     ordering = ['name']
+    # Tokens per request; other actions cost one
+    throttle_costs = {'list': 5, 'bulk_upsert': 10}
+    
+    def get_queryset(self):
+        # Stats columns are indexed, so ?abc_class=A&ordering=-out_90d reads prodstats by index
+        queryset = ProductMaster.objects.alias(
+            out_30d=F('stats__out_30d'),
+            out_90d=F('stats__out_90d'),
+            turnover=F('stats__turnover'),
+        )
+        if self.wants_field('current_stock'):
+            queryset = queryset.with_current_stock()
+        return self.narrow_columns(queryset)
+    
+    def list(self, request, *args, **kwargs):
+        """List products through the values() fast path instead of per-row serializers"""
+        fast_serializer = ProductMasterValuesSerializer(
+            self.filter_queryset(self.get_queryset()), fields=self.requested_fields()
+        )
+        page = self.paginate_queryset(fast_serializer.rows())
+        if page is not None:
+            return self.get_paginated_response(fast_serializer.to_representation(page))
+        return Response(fast_serializer.data)
     
     @action(detail=True, methods=['get'])
     def current_stock(self, request, pk=None):
@@ -41,8 +234,37 @@ class ProductMasterViewSet(viewsets.ModelViewSet):
             'product_name': product.name,
             'sku': product.sku
         })
+    
+    @action(detail=False, methods=['get'], url_path=r'lookup/(?P<sku>[^/]+)')
+    def lookup(self, request, sku=None):
+        """Resolve a scanned SKU to its product and current stock in a single query"""
+        # A cached product only needs its balance read; a miss reads both at once
+        product = product_cache.get_by_sku(sku, queryset=ProductMaster.objects.with_current_stock())
+        if product is None:
+            return Response({'detail': 'No product with this SKU.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(ProductMasterSerializer(product).data)
+    
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request):
+        """Hit/miss counters of the product cache in the worker serving this request"""
+        return Response(product_cache.stats())
+    
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, CSVParser, MultiPartParser])
+    def bulk_upsert(self, request):
+        """Create or update products by SKU from a JSON array, a text/csv body or a CSV file upload"""
+        if isinstance(request.data, list):
+            rows = request.data
+        elif 'file' in request.FILES:
+            rows = read_csv_rows(request.FILES['file'].read())
+        else:
+            return Response(
+                {'detail': 'Send a JSON array of products, a text/csv body, or a CSV file in the "file" field.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(bulk_upsert_products(rows))
 
-class StockMainViewSet(viewsets.ModelViewSet):
+class StockMainViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing stock transactions.
     
@@ -51,6 +273,9 @@ class StockMainViewSet(viewsets.ModelViewSet):
     - Create new transactions with product details
     - Retrieve transaction details
     - Filter by transaction type (IN/OUT)
+    - Reverse a transaction with a linked offsetting one
+    - Transfer stock between locations
+    - Return only some fields with ?fields=, adding lines with ?expand=details
     """
     queryset = StockMain.objects.all()
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
@@ -58,6 +283,23 @@ class StockMainViewSet(viewsets.ModelViewSet):
     search_fields = ['remarks']
     ordering_fields = ['date', 'created_at']
     ordering = ['-date']
+    expandable_fields = ('details',)
+    
+    def get_queryset(self):
+        queryset = StockMain.objects.all()
+        if self.action not in self.sparse_actions:
+            return queryset
+        if self.wants_field('total_items'):
+            queryset = queryset.with_total_items()
+        if self.wants_field('details'):
+            queryset = queryset.prefetch_related(
+                Prefetch('details', queryset=StockDetail.objects.select_related('product', 'location'))
+            )
+        if self.wants_field('to_location'):
+            queryset = queryset.select_related('to_location')
+            if self.requested_fields() is not None:
+                return self.narrow_columns(queryset, 'to_location__code')
+        return self.narrow_columns(queryset)
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -70,15 +312,297 @@ class StockMainViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
         instance = serializer.save()
         
-        # Return full transaction data
+        # Return full transaction data, its lines read in one query
+        instance = StockMain.objects.with_total_items().select_related('to_location').prefetch_related(
+            Prefetch('details', queryset=StockDetail.objects.select_related('product', 'location'))
+        ).get(pk=instance.pk)
         return_serializer = StockMainSerializer(instance)
         return Response(return_serializer.data, status=status.HTTP_201_CREATED)
+    
+    def destroy(self, request, *args, **kwargs):
+        try:
+            # The lines' products are revalued once each, with the delete
+            with deferred_revaluation():
+                return super().destroy(request, *args, **kwargs)
+        except ProtectedError:
+            return Response(
+                {'detail': 'This transaction has been reversed; delete the reversal first.'},
+                status=status.HTTP_409_CONFLICT
+            )
+    
+    @action(detail=True, methods=['post'])
+    def reverse(self, request, pk=None):
+        """Post an offsetting transaction linked to this one"""
+        stock_main = self.get_object()
+        try:
+            reversal = post_reversal(stock_main.pk, remarks=request.data.get('remarks'))
+        except ReversalError as e:
+            return Response({'detail': str(e), 'shortages': e.shortages}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(StockMainSerializer(reversal).data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['post'])
+    def transfer(self, request):
+        """Move stock of several products from one location to another as one TRF transaction"""
+        params = TransferSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+        try:
+            transfer = post_transfer(
+                data['from_location'], data['to_location'],
+                {line['product'].pk: line['quantity'] for line in data['details']},
+                remarks=data['remarks'],
+            )
+        except TransferError as e:
+            return Response({'detail': str(e), 'shortages': e.shortages}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(StockMainSerializer(transfer).data, status=status.HTTP_201_CREATED)
+
+class LocationViewSet(viewsets.ModelViewSet):
+    """
+    ViewSet for storage locations, addressed by code.
+    
+    Provides operations for:
+    - List, create, rename and delete locations
+    - Stock held at a location, one row per product
+    """
+    queryset = Location.objects.all()
+    serializer_class = LocationSerializer
+    lookup_field = 'code'
+    filter_backends = [SearchFilter]
+    search_fields = ['code', 'name']
+    
+    def destroy(self, request, *args, **kwargs):
+        try:
+            return super().destroy(request, *args, **kwargs)
+        except ProtectedError:
+            return Response(
+                {'detail': 'Stock has been posted at this location; it cannot be deleted.'},
+                status=status.HTTP_409_CONFLICT
+            )
+    
+    @action(detail=True, methods=['get'])
+    def stock(self, request, code=None):
+        """Stock on hand at this location"""
+        location = self.get_object()
+        return Response({
+            'location': location.code,
+            'products': LocationStockValuesSerializer(location_stock(location)).data,
+        })
 
-class StockDetailViewSet(viewsets.ReadOnlyModelViewSet):
+class ReservationViewSet(mixins.CreateModelMixin,
+                         mixins.RetrieveModelMixin,
+                         mixins.ListModelMixin,
+                         mixins.DestroyModelMixin,
+                         viewsets.GenericViewSet):
+    """
+    ViewSet for stock reservations.
+    
+    Provides operations for:
+    - Hold stock of a product for an order (``reference``) until ``expires_at``
+      (RESERVATION_TTL seconds from now by default), refused beyond the
+      stock available to promise
+    - List active reservations, filtered by product or reference
+    - Release a reservation by deleting it
+    
+    An issue posted with ``reservation=<reference>`` ships the order and
+    releases its holds; expired holds stop counting at once and are deleted
+    by the sweep_reservations command.
+    """
+    serializer_class = ReservationSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['product', 'reference']
+    
+    def get_queryset(self):
+        return active_reservations().select_related('product')
+    
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        try:
+            reservation, = reserve({data['product'].pk: data['quantity']}, data.get('expires_at'), data.get('reference'))
+        except ReservationError as e:
+            return Response({'detail': str(e), 'shortages': e.shortages}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(ReservationSerializer(reservation).data, status=status.HTTP_201_CREATED)
+
+class CountSessionViewSet(MachineFormatsMixin,
+                          mixins.CreateModelMixin,
+                          mixins.RetrieveModelMixin,
+                          mixins.ListModelMixin,
+                          viewsets.GenericViewSet):
+    """
+    ViewSet for physical stock counts.
+    
+    Provides operations for:
+    - Open a count session and list past sessions
+    - Upload counted quantities by SKU from JSON or CSV
+    - Review variances against system stock
+    - Post all variances as one IN and one OUT adjustment
+    """
+    queryset = CountSession.objects.all()
+    serializer_class = CountSessionSerializer
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_fields = ['status']
+    ordering_fields = ['created_at', 'posted_at']
+    ordering = ['-created_at']
+    
+    def get_queryset(self):
+        return CountSession.objects.annotate(line_count=Count('lines'))
+    
+    @action(detail=True, methods=['post'], parser_classes=[JSONParser, CSVParser, MultiPartParser])
+    def counts(self, request, pk=None):
+        """Record counted quantities by SKU from a JSON array, a text/csv body or a CSV file upload"""
+        session = self.get_object()
+        if isinstance(request.data, list):
+            rows = request.data
+        elif 'file' in request.FILES:
+            rows = read_csv_rows(request.FILES['file'].read())
+        else:
+            return Response(
+                {'detail': 'Send a JSON array of counts, a text/csv body, or a CSV file in the "file" field.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            return Response(record_counts(session, rows))
+        except CountSessionClosed as e:
+            return Response({'detail': str(e)}, status=status.HTTP_409_CONFLICT)
+    
+    @action(detail=True, methods=['get'])
+    def variances(self, request, pk=None):
+        """Counted quantity, system stock and variance for every counted product"""
+        session = self.get_object()
+        rows = CountVarianceValuesSerializer(count_variances(session)).data
+        return Response({
+            'session': session.pk,
+            'status': session.status,
+            'total_surplus': sum(row['variance'] for row in rows if row['variance'] > 0),
+            'total_shortage': -sum(row['variance'] for row in rows if row['variance'] < 0),
+            'lines': rows,
+        })
+    
+    @action(detail=True, methods=['post'], url_path='post')
+    def post_adjustments(self, request, pk=None):
+        """Post the session's variances as stock adjustments"""
+        session = self.get_object()
+        try:
+            session = post_count_session(session.pk)
+        except CountSessionClosed as e:
+            return Response({'detail': str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response(CountSessionSerializer(session).data)
+
+class ScanDraftViewSet(viewsets.ViewSet):
+    """
+    ViewSet for barcode scan drafts, kept in the cache until committed.
+    
+    Provides operations for:
+    - Open a draft for an IN or OUT transaction
+    - Add scans by SKU; scanning a SKU again adds to its line
+    - Review a draft, remove a line or discard the draft
+    - Commit the draft as one transaction with all its lines
+    """
+    lookup_value_regex = '[0-9a-f]{32}'
+    
+    def draft_data(self, draft):
+        return {
+            'id': draft['id'],
+            'type': draft['type'],
+            'remarks': draft['remarks'],
+            'total_items': sum(line['quantity'] for line in draft['lines'].values()),
+            'lines': list(draft['lines'].values()),
+            'created_at': draft['created_at'],
+            'updated_at': draft['updated_at'],
+        }
+    
+    def not_found(self, error):
+        return Response({'detail': str(error)}, status=status.HTTP_404_NOT_FOUND)
+    
+    def create(self, request):
+        """Open an empty draft"""
+        serializer = ScanDraftSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        draft = create_draft(serializer.validated_data['type'], serializer.validated_data['remarks'], user=request.user)
+        return Response(self.draft_data(draft), status=status.HTTP_201_CREATED)
+    
+    def retrieve(self, request, pk=None):
+        try:
+            return Response(self.draft_data(get_draft(pk, request.user)))
+        except DraftNotFound as e:
+            return self.not_found(e)
+    
+    def destroy(self, request, pk=None):
+        """Discard a draft without posting it"""
+        try:
+            discard_draft(pk, request.user)
+        except DraftNotFound as e:
+            return self.not_found(e)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    @action(detail=True, methods=['post'])
+    def scans(self, request, pk=None):
+        """Add a scanned SKU, by default one unit; returns the product's line"""
+        serializer = ScanSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            line = add_scan(pk, serializer.validated_data['sku'], serializer.validated_data['quantity'], user=request.user)
+        except DraftNotFound as e:
+            return self.not_found(e)
+        except DraftError as e:
+            return Response({'sku': [str(e)]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(line)
+    
+    @action(detail=True, methods=['delete'], url_path=r'lines/(?P<product_id>[0-9]+)')
+    def remove_line(self, request, pk=None, product_id=None):
+        """Remove a product's line from the draft"""
+        try:
+            draft = remove_line(pk, int(product_id), user=request.user)
+        except DraftNotFound as e:
+            return self.not_found(e)
+        except DraftError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self.draft_data(draft))
+    
+    @action(detail=True, methods=['post'])
+    def commit(self, request, pk=None):
+        """Validate the whole draft and post it as one transaction"""
+        try:
+            stock_main = commit_draft(pk, user=request.user)
+        except DraftNotFound as e:
+            return self.not_found(e)
+        except DraftError as e:
+            return Response({'detail': str(e), 'shortages': e.shortages}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(StockMainSerializer(stock_main).data, status=status.HTTP_201_CREATED)
+
+class LedgerChangeViewSet(viewsets.ViewSet):
+    """
+    Change feed of the stock ledger for downstream sync.
+    
+    Lists inserts, updates and deletes of transactions and their lines after
+    ?after=<cursor>, oldest first, ?limit= at a time; follow ``next`` while
+    ``has_more``. To start, read ``head/`` for the current cursor, pull the
+    transactions once in full, then apply the changes after that cursor.
+    """
+    
+    def list(self, request):
+        params = ChangeFeedParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        rows, has_more = changes_after(params.validated_data['after'], params.validated_data['limit'])
+        return Response({
+            'changes': LedgerChangeSerializer(rows, many=True).data,
+            'next': rows[-1]['id'] if rows else params.validated_data['after'],
+            'has_more': has_more,
+        })
+    
+    @action(detail=False, methods=['get'])
+    def head(self, request):
+        """Cursor of the latest change"""
+        return Response({'cursor': head_cursor()})
+
+class StockDetailViewSet(SparseFieldsetMixin, MachineFormatsMixin, viewsets.ReadOnlyModelViewSet):
     """
     ViewSet for viewing stock transaction details.
     
-    Provides read-only access to individual product movements.
+    Provides read-only access to individual product movements, optionally
+    narrowed to some fields with ?fields=.
     """
     queryset = StockDetail.objects.all()
     serializer_class = StockDetailSerializer
@@ -86,8 +610,21 @@ class StockDetailViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_fields = ['transaction__type', 'product']
     ordering_fields = ['transaction__date']
     ordering = ['-transaction__date']
+    
+    def get_queryset(self):
+        queryset = StockDetail.objects.all()
+        # Product name and SKU come from one join rather than a query per line
+        related = [f'product__{name}' for name in ('name', 'sku') if self.wants_field(f'product_{name}')]
+        if related:
+            queryset = queryset.select_related('product')
+            if self.requested_fields() is not None:
+                related.append('product')
+        if self.wants_field('location'):
+            queryset = queryset.select_related('location')
+            related.append('location__code')
+        return self.narrow_columns(queryset, *related)
 
-class InventoryReportViewSet(viewsets.ViewSet):
+class InventoryReportViewSet(ConcurrencyLimitMixin, MachineFormatsMixin, viewsets.ViewSet):
     """
     ViewSet for generating inventory reports.
     
@@ -95,71 +632,144 @@ class InventoryReportViewSet(viewsets.ViewSet):
     - Complete inventory status
     - Low stock alerts
     - Out of stock items
+    - Inventory valuation (FIFO and weighted average)
+    - Cost of goods sold for a date range
+    - Demand forecast and reorder suggestions
+    - Monthly movements and closing stock
+    - Stock available to promise after reservations
+    
+    Reports scan the whole catalog, so they have their own rate limit, cost
+    more tokens than lookups and are capped in concurrency.
     """
+    throttle_scope = 'reports'
+    concurrency_scope = 'reports'
+    throttle_costs = {
+        'current_inventory': 10,
+        'low_stock': 5,
+        'out_of_stock': 5,
+        'valuation': 10,
+        'cogs': 10,
+        'reorder': 20,
+        'movements': 10,
+        'available': 10,
+    }
     
     @action(detail=False, methods=['get'])
     def current_inventory(self, request):
         """Get complete current inventory status"""
-        products = ProductMaster.objects.all()
-        inventory_data = []
-        
-        for product in products:
-            current_stock = product.get_current_stock()
-            status_text = 'Low Stock' if current_stock <= 5 else 'In Stock' if current_stock > 0 else 'Out of Stock'
-            
-            inventory_data.append({
-                'product_id': product.id,
-                'product_name': product.name,
-                'product_sku': product.sku,
-                'product_description': product.description or '',
-                'current_stock': current_stock,
-                'status': status_text,
-                'created_at': product.created_at
-            })
-        
-        serializer = InventoryReportSerializer(inventory_data, many=True)
-        return Response(serializer.data)
+        products = ProductMaster.objects.with_current_stock().order_by('id')
+        return Response(InventoryReportValuesSerializer(products).data)
     
     @action(detail=False, methods=['get'])
     def low_stock(self, request):
         """Get products with low stock (≤ 5 units)"""
-        products = ProductMaster.objects.all()
-        low_stock_products = []
-        
-        for product in products:
-            current_stock = product.get_current_stock()
-            if current_stock <= 5:
-                low_stock_products.append({
-                    'product_id': product.id,
-                    'product_name': product.name,
-                    'product_sku': product.sku,
-                    'product_description': product.description or '',
-                    'current_stock': current_stock,
-                    'status': 'Low Stock' if current_stock > 0 else 'Out of Stock',
-                    'created_at': product.created_at
-                })
-        
-        serializer = InventoryReportSerializer(low_stock_products, many=True)
-        return Response(serializer.data)
+        products = ProductMaster.objects.with_current_stock().filter(current_stock__lte=5).order_by('id')
+        return Response(InventoryReportValuesSerializer(products, status=low_stock_status).data)
     
     @action(detail=False, methods=['get'])
     def out_of_stock(self, request):
         """Get products that are out of stock"""
-        products = ProductMaster.objects.all()
-        out_of_stock_products = []
+        products = ProductMaster.objects.with_current_stock().filter(current_stock__lte=0).order_by('id')
+        return Response(InventoryReportValuesSerializer(products, status=out_of_stock_status).data)
+    
+    @action(detail=False, methods=['get'])
+    def valuation(self, request):
+        """Get the FIFO and weighted-average value of stock on hand per product"""
+        products = ProductValuationValuesSerializer(inventory_valuation()).data
+        return Response({
+            'total_fifo_value': decimal_total(products, 'fifo_value'),
+            'total_average_value': decimal_total(products, 'average_value'),
+            'products': products,
+        })
+    
+    @action(detail=False, methods=['get'])
+    def cogs(self, request):
+        """Get cost of goods sold per product, optionally between ?start= and ?end= dates"""
+        start, end = request.query_params.get('start'), request.query_params.get('end')
+        for param, value in (('start', start), ('end', end)):
+            if value and parse_date(value) is None:
+                return Response({param: ['Use the YYYY-MM-DD format.']}, status=status.HTTP_400_BAD_REQUEST)
+        
+        products = CostOfGoodsValuesSerializer(
+            cost_of_goods(start=start and parse_date(start), end=end and parse_date(end))
+        ).data
+        return Response({
+            'start': start,
+            'end': end,
+            'total_fifo_cogs': decimal_total(products, 'fifo_cogs'),
+            'total_average_cogs': decimal_total(products, 'average_cogs'),
+            'products': products,
+        })
+    
+    @action(detail=False, methods=['get'])
+    def reorder(self, request):
+        """Get demand forecasts and suggested reorder quantities, most urgent first"""
+        params = ReorderParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        options = dict(params.validated_data)
+        suggested_only = options.pop('suggested_only')
+        
+        rows = reorder_suggestions(**options)
+        
+        if suggested_only:
+            rows = [row for row in rows if row['suggested_quantity'] > 0]
+        rows.sort(key=lambda row: (row['days_of_cover'] is None, row['days_of_cover'] or 0))
+        return Response(rows)
+    
+    @action(detail=False, methods=['get'])
+    def movements(self, request):
+        """
+        Get IN/OUT quantities and closing stock per month from the monthly summary.
         
-        for product in products:
-            current_stock = product.get_current_stock()
-            if current_stock <= 0:
-                out_of_stock_products.append({
-                    'product_id': product.id,
-                    'product_name': product.name,
-                    'product_sku': product.sku,
-                    'product_description': product.description or '',
-                    'current_stock': current_stock,
-                    'status': 'Out of Stock',
-                    'created_at': product.created_at
-                })
+        ?by=month (default) totals every month from ?start= to ?end= (YYYY-MM,
+        the last 12 months by default); ?by=product lists the summary rows
+        of each product with movement, ?limit= rows at a time by product and
+        month: pass ``next`` as ?after= while ``has_more``. ?product= narrows
+        either to one SKU.
+        """
+        params = MovementReportParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        start, end, product = (params.validated_data.get(name) for name in ('start', 'end', 'product'))
+        report = {'start': start.strftime('%Y-%m'), 'end': end.strftime('%Y-%m')}
         
-        serializer = InventoryReportSerializer(out_of_stock_products, many=True)
-        return Response(serializer.data)
+        if params.validated_data['by'] == 'month':
+            rows = monthly_totals(start, end, product_ids=product and [product.pk])
+            for row in rows:
+                row['month'] = row['month'].strftime('%Y-%m')
+            return Response({**report, 'rows': rows})
+        
+        summary = MonthlyMovement.objects.filter(month__range=(start, end))
+        if product:
+            summary = summary.filter(product=product)
+        after, limit = params.validated_data.get('after'), params.validated_data['limit']
+        if after:
+            # A range of the (product, month) unique index
+            product_id, month = after
+            summary = summary.filter(Q(product_id__gt=product_id) | Q(product_id=product_id, month__gt=month))
+        rows = MonthlyMovementValuesSerializer(summary.order_by('product_id', 'month')[:limit + 1]).data
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return Response({
+            **report,
+            'rows': rows,
+            'next': f"{rows[-1]['product_id']}:{rows[-1]['month']}" if rows else request.query_params.get('after'),
+            'has_more': has_more,
+        })
+    
+    @action(detail=False, methods=['get'])
+    def available(self, request):
+        """
+        Get on-hand stock, active reservations and stock available to promise per product.
+        
+        One grouped query over the balances and the active reservations;
+        ?product= narrows it to one SKU.
+        """
+        products = ProductMaster.objects.all()
+        sku = request.query_params.get('product')
+        if sku:
+            product = product_cache.get_by_sku(sku)
+            if product is None:
+                return Response({'product': ["No product with this SKU."]}, status=status.HTTP_400_BAD_REQUEST)
+            products = products.filter(pk=product.pk)
+        products = products.with_available_to_promise().order_by('id')
+        return Response(AvailableToPromiseValuesSerializer(products).data)
@@ -0,0 +1,173 @@
+from django.db import connection, transaction
+
+from .caching import bump_inventory_version, product_cache
+from .models import ProductMaster, normalize_sku, sku_format_error
+
+# Rows validated against the database and written per round trip
+BULK_CHUNK_SIZE = 1000
+
+# Rows changed per keyed CASE UPDATE statement
+UPDATE_CHUNK_SIZE = 500
+
+NAME_MAX_LENGTH = ProductMaster._meta.get_field('name').max_length
+SKU_MAX_LENGTH = ProductMaster._meta.get_field('sku').max_length
+
+
+def _clean_product_row(row):
+    """Normalize one incoming row, returning (sku, name, description, errors)"""
+    if not isinstance(row, dict):
+        return None, None, None, {'non_field_errors': ["Expected an object with sku, name and description."]}
+
+    errors = {}
+    sku = normalize_sku(str(row.get('sku') or ''))
+    name = str(row.get('name') or '').strip()
+    description = row.get('description')
+    description = str(description) if description not in (None, '') else None
+
+    if not sku:
+        errors['sku'] = ["SKU is required."]
+    elif len(sku) > SKU_MAX_LENGTH:
+        errors['sku'] = [f"SKU cannot exceed {SKU_MAX_LENGTH} characters."]
+    else:
+        error = sku_format_error(sku)
+        if error:
+            errors['sku'] = [error]
+
+    if len(name) < 2:
+        errors['name'] = ["Product name must be at least 2 characters long."]
+    elif len(name) > NAME_MAX_LENGTH:
+        errors['name'] = [f"Product name cannot exceed {NAME_MAX_LENGTH} characters."]
+
+    return sku, name, description, errors
+
+
+def bulk_upsert_products(rows, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Create or update products keyed by SKU.
+
+    Rows are validated in Python, then each chunk costs one ``IN`` query to
+    find the SKUs that already exist and one multi-row upsert. Returns a
+    summary with one result per input row, in input order.
+    """
+    results = [None] * len(rows)
+    first_seen = {}
+    pending = []
+
+    for index, row in enumerate(rows):
+        sku, name, description, errors = _clean_product_row(row)
+        if not errors and sku in first_seen:
+            errors = {'sku': [f"Duplicate SKU in this request (first seen in row {first_seen[sku]})."]}
+        if errors:
+            results[index] = {'row': index, 'sku': sku, 'status': 'error', 'errors': errors}
+            continue
+        first_seen[sku] = index
+        pending.append((index, ProductMaster(sku=sku, name=name, description=description)))
+
+    # MySQL upserts on any unique key and rejects an explicit conflict target
+    unique_fields = ['sku'] if connection.features.supports_update_conflicts_with_target else None
+
+    with transaction.atomic():
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            existing = set(
+                ProductMaster.objects.filter(sku__in=[product.sku for _, product in chunk])
+                .values_list('sku', flat=True)
+            )
+            ProductMaster.objects.bulk_create(
+                [product for _, product in chunk],
+                update_conflicts=True,
+                unique_fields=unique_fields,
+                update_fields=['name', 'description', 'updated_at'],
+            )
+            for index, product in chunk:
+                results[index] = {
+                    'row': index,
+                    'sku': product.sku,
+                    'status': 'updated' if product.sku in existing else 'created',
+                }
+        
+        # bulk_create() sends no post_save signals
+        if pending:
+            bump_inventory_version()
+            product_cache.invalidate()
+
+    summary = {'created': 0, 'updated': 0, 'error': 0}
+    for result in results:
+        summary[result['status']] += 1
+
+    return {
+        'created': summary['created'],
+        'updated': summary['updated'],
+        'errors': summary['error'],
+        'results': results,
+    }
+
+
+def update_by_pk(model, field_names, rows, relative=False, constants=None, chunk_size=UPDATE_CHUNK_SIZE):
+    """
+    Write per-row values to many rows with one UPDATE per chunk.
+
+    ``rows`` maps primary key to a tuple of values, one per field name; with
+    ``relative`` the values are added to the stored ones instead. Each field
+    becomes a simple ``CASE pk WHEN ... END`` and ``constants`` are set on
+    every row. Built as SQL because resolving hundreds of When() clauses
+    costs far more than the statement itself.
+    """
+    qn = connection.ops.quote_name
+    opts = model._meta
+    pk_column = qn(opts.pk.column)
+    fields = [opts.get_field(name) for name in field_names]
+    constants = [(opts.get_field(name), value) for name, value in (constants or {}).items()]
+    pks = sorted(rows)
+
+    with connection.cursor() as cursor:
+        # Resolve the connection proxy once rather than for every prepared value
+        db = cursor.db
+        for start in range(0, len(pks), chunk_size):
+            chunk = pks[start:start + chunk_size]
+            whens = ' '.join(['WHEN %s THEN %s'] * len(chunk))
+            assignments, params = [], []
+            for position, field in enumerate(fields):
+                column = qn(field.column)
+                case = f'CASE {pk_column} {whens} ELSE {"0" if relative else column} END'
+                assignments.append(f'{column} = {column} + {case}' if relative else f'{column} = {case}')
+                for pk in chunk:
+                    params.extend((pk, field.get_db_prep_save(rows[pk][position], db)))
+            for field, value in constants:
+                assignments.append(f'{qn(field.column)} = %s')
+                params.append(field.get_db_prep_save(value, db))
+            params.extend(chunk)
+            cursor.execute(
+                f'UPDATE {qn(opts.db_table)} SET {", ".join(assignments)} '
+                f'WHERE {pk_column} IN ({", ".join(["%s"] * len(chunk))})',
+                params,
+            )
+
+
+def insert_rows(model, field_names, rows, chunk_size=UPDATE_CHUNK_SIZE):
+    """
+    Insert plain value tuples, one multi-row INSERT per chunk.
+
+    For derived tables rebuilt in batch, where building a model instance per
+    row costs more than the insert. No defaults, signals or conflict
+    handling are applied; ``rows`` must hold a value for every field name.
+    """
+    qn = connection.ops.quote_name
+    opts = model._meta
+    fields = [opts.get_field(name) for name in field_names]
+    columns = ', '.join(qn(field.column) for field in fields)
+    placeholder = f'({", ".join(["%s"] * len(fields))})'
+
+    with connection.cursor() as cursor:
+        db = cursor.db
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            params = [
+                field.get_db_prep_save(value, db)
+                for row in chunk
+                for field, value in zip(fields, row)
+            ]
+            cursor.execute(
+                f'INSERT INTO {qn(opts.db_table)} ({columns}) VALUES {", ".join([placeholder] * len(chunk))}',
+                params,
+            )
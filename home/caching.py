@@ -0,0 +1,220 @@
+import contextlib
+import copy
+import functools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import ProductMaster, normalize_sku
+
+# Bumped on every product or ledger write; versions cached page fragments
+INVENTORY_VERSION_KEY = 'home:inventory-version'
+
+# Bumped on every product write; workers drop their cached products when it moves
+PRODUCT_CACHE_VERSION_KEY = 'home:product-cache-version'
+
+PRODUCT_FIELDS = [field.attname for field in ProductMaster._meta.concrete_fields]
+
+
+def _fresh_version():
+    # Seed from the clock so an evicted counter never reuses an old version
+    return int(time.time() * 1000)
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _fresh_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _incr_version(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, _fresh_version(), timeout=None)
+        return cache.get(key)
+
+
+def get_inventory_version():
+    """Current inventory version stamp, shared by all workers through the cache"""
+    return _get_version(INVENTORY_VERSION_KEY)
+
+
+def bump_inventory_version():
+    """Invalidate version-keyed fragments once the current DB transaction commits"""
+    transaction.on_commit(_incr_inventory_version)
+
+
+def _incr_inventory_version():
+    _incr_version(INVENTORY_VERSION_KEY)
+
+
+class LockBusy(Exception):
+    """Raised when a cache lock is held by someone else"""
+
+
+@contextlib.contextmanager
+def cache_lock(lock_cache, key, timeout):
+    """
+    Hold ``key`` in ``lock_cache`` as a lock for the duration of the block.
+
+    Taken with one atomic cache.add() and never waited for: a lock held
+    elsewhere raises LockBusy at once, so callers ask the client to retry
+    instead of parking a worker. The lock expires after ``timeout`` seconds
+    in case its holder dies, so work that must not run twice needs its own
+    guard as well, such as a unique index.
+    """
+    token = uuid.uuid4().hex
+    if not lock_cache.add(key, token, timeout=timeout):
+        raise LockBusy(key)
+    try:
+        yield
+    finally:
+        # Only a holder that outlived its timeout can find someone else's lock here
+        if lock_cache.get(key) == token:
+            lock_cache.delete(key)
+
+
+class ProductCache:
+    """
+    Bounded LRU of ProductMaster records by id and normalized SKU, per process.
+
+    Products are resolved on every scan, form and serializer validation but
+    almost never change. Product writes bump a version in the shared cache;
+    each worker compares it with the version its entries were loaded under
+    at most every ``PRODUCT_CACHE_CHECK_INTERVAL`` seconds and starts over
+    when it moved. Writes in this process clear it at once, and rows read
+    inside a transaction are only kept once it commits. Callers get copies,
+    so they may annotate or modify them freely. Misses are not cached: a
+    product created elsewhere is found on first use.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._products = OrderedDict()  # id -> product, least recently used first
+        self._skus = {}  # normalized SKU -> id
+        self._version = None
+        self._checked_at = None
+        # Bumped on every clear, so a load racing an invalidation is not stored
+        self._generation = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    @property
+    def maxsize(self):
+        return getattr(settings, 'PRODUCT_CACHE_SIZE', 10000)
+
+    def get(self, pk, queryset=None):
+        """
+        The product with this id, or None.
+
+        ``queryset`` is read on a miss, e.g. to annotate the stock in the
+        same query; annotations are returned but not cached.
+        """
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError):
+            return None
+        return self._get(pk, None, queryset)
+
+    def get_by_sku(self, sku, queryset=None):
+        """The product with this SKU (in any case), or None; ``queryset`` as for get()"""
+        sku = normalize_sku(sku)
+        return self._get(None, sku, queryset) if sku else None
+
+    def _get(self, pk, sku, queryset):
+        self._check_version()
+        with self._lock:
+            cached_pk = self._skus.get(sku) if sku is not None else pk
+            product = self._products.get(cached_pk)
+            if product is not None:
+                self._products.move_to_end(cached_pk)
+                self.hits += 1
+                return copy.copy(product)
+            self.misses += 1
+            generation = self._generation
+
+        queryset = ProductMaster.objects.all() if queryset is None else queryset
+        try:
+            product = queryset.get(**({'sku': sku} if sku is not None else {'pk': pk}))
+        except ProductMaster.DoesNotExist:
+            return None
+        if transaction.get_connection().in_atomic_block:
+            # Keep what this transaction read only once it is committed
+            transaction.on_commit(functools.partial(self._store, product, generation))
+        else:
+            self._store(product, generation)
+        return product
+
+    def _store(self, product, generation):
+        # A bare copy: no annotations, and independent of the caller's instance
+        values = [getattr(product, name) for name in PRODUCT_FIELDS]
+        product = ProductMaster.from_db(product._state.db, PRODUCT_FIELDS, values)
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._products[product.pk] = product
+            self._products.move_to_end(product.pk)
+            self._skus[product.sku] = product.pk
+            while len(self._products) > self.maxsize:
+                _, evicted = self._products.popitem(last=False)
+                self._skus.pop(evicted.sku, None)
+                self.evictions += 1
+
+    def _check_version(self):
+        now = time.monotonic()
+        interval = getattr(settings, 'PRODUCT_CACHE_CHECK_INTERVAL', 1)
+        if self._checked_at is not None and now - self._checked_at < interval:
+            return
+        self._checked_at = now
+        version = _get_version(PRODUCT_CACHE_VERSION_KEY)
+        if version != self._version:
+            if self._version is not None:
+                self.clear()
+            self._version = version
+
+    def clear(self):
+        """Drop every cached product in this process"""
+        with self._lock:
+            self._products.clear()
+            self._skus.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def invalidate(self):
+        """
+        Drop cached products in every worker after a product write.
+
+        This process is cleared at once, and again when the current DB
+        transaction commits, together with bumping the shared version, so
+        rows read before the commit are not kept.
+        """
+        self.clear()
+        transaction.on_commit(self._invalidate_everywhere)
+
+    def _invalidate_everywhere(self):
+        self.clear()
+        # Our own bump needs no second clear on the next version check
+        self._version = _incr_version(PRODUCT_CACHE_VERSION_KEY)
+
+    def stats(self):
+        """Hit/miss counters and size of this process's cache"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'size': len(self._products),
+            'maxsize': self.maxsize,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+product_cache = ProductCache()
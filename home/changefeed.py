@@ -0,0 +1,74 @@
+# Change feed over the stock ledger. Every insert, update and delete of a
+# StockMain or StockDetail appends a LedgerChange row in the same database
+# transaction: single-row writes through signals.py, bulk posts from
+# post_transaction(). Downstream systems read the log after a cursor instead
+# of re-reading the whole ledger. Cost amounts are derived by the valuation
+# and are left out, so revaluations add no changes.
+import datetime
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from .bulk import insert_rows
+from .models import LedgerChange, StockDetail, StockMain
+
+# (key in the change data, model attribute) per entity
+FEED_FIELDS = {
+    'transaction': (('date', 'date'), ('type', 'type'), ('remarks', 'remarks'), ('reversal_of', 'reversal_of_id'),
+                    ('to_location', 'to_location_id')),
+    'transaction_detail': (('transaction', 'transaction_id'), ('product', 'product_id'), ('quantity', 'quantity'),
+                           ('unit_cost', 'unit_cost'), ('location', 'location_id')),
+}
+
+ENTITIES = {StockMain: 'transaction', StockDetail: 'transaction_detail'}
+
+CHANGE_FIELDS = ['entity', 'entity_id', 'action', 'data', 'changed_at']
+
+# Seconds new changes are held back when settings.LEDGER_FEED_LAG is not set
+DEFAULT_FEED_LAG = 5
+
+
+def _change_row(instance, action, changed_at):
+    entity = ENTITIES[type(instance)]
+    data = {key: getattr(instance, attname) for key, attname in FEED_FIELDS[entity]}
+    return entity, instance.pk, action, data, changed_at
+
+
+def log_changes(instances, action):
+    """Append one change per StockMain or StockDetail instance, with one INSERT per chunk"""
+    now = timezone.now()
+    insert_rows(LedgerChange, CHANGE_FIELDS, [_change_row(instance, action, now) for instance in instances])
+
+
+def head_cursor():
+    """Cursor of the latest change; reading after it returns only later changes"""
+    return LedgerChange.objects.aggregate(head=Max('id'))['head'] or 0
+
+
+def changes_after(cursor, limit):
+    """
+    Up to ``limit`` changes after ``cursor`` in id order, and whether more follow.
+
+    One range scan of the primary key, so a sync costs the number of changes
+    rather than the size of the ledger. ``LEDGER_FEED_LAG`` seconds (5 by
+    default) hold back the newest changes: where writers run concurrently a
+    transaction can commit an id lower than one already visible, and the
+    lag gives it time to commit before readers pass it. The lag counts from
+    ``changed_at``, stamped when the change is written rather than at
+    commit, so a transaction still open ``LEDGER_FEED_LAG`` seconds after
+    logging a change can commit it behind a cursor readers have passed.
+    The lag must therefore exceed the longest ledger-writing transaction.
+    """
+    rows = list(
+        LedgerChange.objects.filter(id__gt=cursor).order_by('id')
+        .values('id', 'entity', 'entity_id', 'action', 'data', 'changed_at')[:limit + 1]
+    )
+    lag = getattr(settings, 'LEDGER_FEED_LAG', DEFAULT_FEED_LAG)
+    if lag:
+        settled_before = timezone.now() - datetime.timedelta(seconds=lag)
+        for index, row in enumerate(rows):
+            if row['changed_at'] > settled_before:
+                # Stop at the first unsettled change so none is skipped
+                return rows[:index], False
+    return rows[:limit], len(rows) > limit
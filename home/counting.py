@@ -0,0 +1,141 @@
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .bulk import BULK_CHUNK_SIZE
+from .ledger import post_transaction
+from .models import CountLine, CountSession, ProductMaster, StockBalance, normalize_sku
+
+
+class CountSessionClosed(Exception):
+    """Raised when counts are recorded on, or a post is repeated for, a posted session"""
+
+
+def _clean_count_row(row):
+    """Normalize one counted row, returning (sku, counted_quantity, errors)"""
+    if not isinstance(row, dict):
+        return None, None, {'non_field_errors': ["Expected an object with sku and counted_quantity."]}
+
+    errors = {}
+    sku = normalize_sku(str(row.get('sku') or ''))
+    if not sku:
+        errors['sku'] = ["SKU is required."]
+
+    counted = row.get('counted_quantity')
+    try:
+        counted = int(str(counted).strip())
+    except (TypeError, ValueError):
+        errors['counted_quantity'] = ["A whole number is required."]
+    else:
+        if counted < 0:
+            errors['counted_quantity'] = ["Counted quantity cannot be negative."]
+
+    return sku, counted, errors
+
+
+def record_counts(session, rows, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Record counted quantities on an open session, keyed by SKU.
+
+    Each chunk costs one ``IN`` query to resolve the SKUs and one multi-row
+    upsert, so recounting a product replaces its earlier count. Returns a
+    summary with one result per input row, in input order.
+    """
+    if session.status != 'OPEN':
+        raise CountSessionClosed("This count session has already been posted.")
+
+    results = [None] * len(rows)
+    first_seen = {}
+    pending = []
+
+    for index, row in enumerate(rows):
+        sku, counted, errors = _clean_count_row(row)
+        if not errors and sku in first_seen:
+            errors = {'sku': [f"Duplicate SKU in this request (first seen in row {first_seen[sku]})."]}
+        if errors:
+            results[index] = {'row': index, 'sku': sku, 'status': 'error', 'errors': errors}
+            continue
+        first_seen[sku] = index
+        pending.append((index, sku, counted))
+
+    # MySQL upserts on any unique key and rejects an explicit conflict target
+    unique_fields = ['session', 'product'] if connection.features.supports_update_conflicts_with_target else None
+
+    with transaction.atomic():
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            product_ids = dict(
+                ProductMaster.objects.filter(sku__in=[sku for _, sku, _ in chunk]).values_list('sku', 'id')
+            )
+            lines = []
+            for index, sku, counted in chunk:
+                if sku not in product_ids:
+                    results[index] = {'row': index, 'sku': sku, 'status': 'error',
+                                      'errors': {'sku': ["No product with this SKU."]}}
+                    continue
+                lines.append(CountLine(session=session, product_id=product_ids[sku], counted_quantity=counted))
+                results[index] = {'row': index, 'sku': sku, 'status': 'recorded'}
+            CountLine.objects.bulk_create(
+                lines,
+                update_conflicts=True,
+                unique_fields=unique_fields,
+                update_fields=['counted_quantity'],
+            )
+
+    errors = sum(1 for result in results if result['status'] == 'error')
+    return {
+        'recorded': len(results) - errors,
+        'errors': errors,
+        'results': results,
+    }
+
+
+def count_variances(session):
+    """
+    Count lines annotated with system stock and variance, in one query.
+
+    Open sessions compare against the live balances; posted sessions use the
+    system quantities snapshotted when they were posted.
+    """
+    lines = session.lines.all()
+    if session.status == 'OPEN':
+        lines = lines.annotate(system=Coalesce('product__balance__quantity', 0))
+    else:
+        lines = lines.annotate(system=Coalesce('system_quantity', 0))
+    return lines.annotate(variance=F('counted_quantity') - F('system')).order_by('product_id')
+
+
+def post_count_session(session_id):
+    """
+    Post the variances of an open session as one IN and one OUT adjustment.
+
+    System stock is snapshotted onto every line with a single UPDATE, then
+    the surpluses and shortages are each recorded through post_transaction().
+    Products whose count matches are left untouched. Returns the session.
+    """
+    with transaction.atomic():
+        session = CountSession.objects.select_for_update().get(pk=session_id)
+        if session.status != 'OPEN':
+            raise CountSessionClosed("This count session has already been posted.")
+
+        balance = StockBalance.objects.filter(product_id=OuterRef('product_id')).values('quantity')[:1]
+        session.lines.update(system_quantity=Coalesce(Subquery(balance), Value(0)))
+
+        surplus, shortage = {}, {}
+        for product_id, counted, system in session.lines.values_list('product_id', 'counted_quantity', 'system_quantity'):
+            if counted > system:
+                surplus[product_id] = counted - system
+            elif counted < system:
+                shortage[product_id] = system - counted
+
+        remarks = f"Cycle count #{session.pk} adjustment"
+        if surplus:
+            session.adjustment_in = post_transaction('IN', surplus, remarks=remarks)
+        if shortage:
+            session.adjustment_out = post_transaction('OUT', shortage, remarks=remarks)
+
+        session.status = 'POSTED'
+        session.posted_at = timezone.now()
+        session.save(update_fields=['status', 'posted_at', 'adjustment_in', 'adjustment_out'])
+    return session
@@ -0,0 +1,173 @@
+# Barcode scan drafts. Scans are accumulated in the shared cache, one entry
+# per draft, so scanning an item costs a product cache lookup and a cache
+# write: no ledger rows and no balance updates. Committing a draft posts it
+# as one transaction through post_transaction(), which records the draft's id
+# on the StockMain so a draft is never posted twice. Drafts are shared between
+# workers only when the default cache is (Redis in production, see
+# settings.CACHES).
+import contextlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .caching import LockBusy, cache_lock, product_cache
+from .ledger import post_transaction
+from .models import ProductMaster, StockMain
+from .reservations import available_to_promise, lock_balances
+
+DRAFT_KEY_PREFIX = 'home:scan-draft'
+
+# Seconds an unused draft is kept; every scan extends it
+DRAFT_TIMEOUT = 12 * 3600
+
+# A draft is locked while a scan or commit changes it
+LOCK_TIMEOUT = 30
+
+
+class DraftNotFound(Exception):
+    """Raised for a draft that does not exist, expired, was committed or belongs to someone else"""
+
+
+class DraftError(Exception):
+    """Raised when a scan or commit is refused; ``shortages`` lists products short of stock"""
+
+    def __init__(self, message, shortages=()):
+        super().__init__(message)
+        self.shortages = list(shortages)
+
+
+def _key(draft_id):
+    return f'{DRAFT_KEY_PREFIX}:{draft_id}'
+
+
+def _timeout():
+    return getattr(settings, 'SCAN_DRAFT_TIMEOUT', DRAFT_TIMEOUT)
+
+
+def _owner(user):
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+@contextlib.contextmanager
+def _locked(draft_id):
+    """Serialize changes to one draft across threads and workers; a busy draft is refused at once"""
+    try:
+        with cache_lock(cache, f'{_key(draft_id)}:lock', LOCK_TIMEOUT):
+            yield
+    except LockBusy:
+        raise DraftError("The draft is busy; retry the scan.")
+
+
+def create_draft(transaction_type, remarks=None, user=None):
+    """Open an empty draft; returns it"""
+    now = timezone.now()
+    draft = {
+        'id': uuid.uuid4().hex,
+        'type': transaction_type,
+        'remarks': remarks,
+        'owner': _owner(user),
+        'lines': {},
+        'created_at': now,
+        'updated_at': now,
+    }
+    cache.set(_key(draft['id']), draft, timeout=_timeout())
+    return draft
+
+
+def get_draft(draft_id, user=None):
+    """The draft, as long as it belongs to ``user``"""
+    draft = cache.get(_key(draft_id))
+    if draft is None or draft['owner'] != _owner(user):
+        raise DraftNotFound("No open draft with this id.")
+    return draft
+
+
+def add_scan(draft_id, sku, quantity=1, user=None):
+    """
+    Add a scanned SKU to a draft, adding to the line when it was scanned before.
+
+    The product is resolved through the per-worker product cache. Returns
+    the draft's line for the product.
+    """
+    product = product_cache.get_by_sku(sku)
+    if product is None:
+        raise DraftError("No product with this SKU.")
+
+    with _locked(draft_id):
+        draft = get_draft(draft_id, user)
+        line = draft['lines'].setdefault(
+            product.pk, {'product': product.pk, 'sku': product.sku, 'name': product.name, 'quantity': 0}
+        )
+        line['quantity'] += quantity
+        draft['updated_at'] = timezone.now()
+        cache.set(_key(draft_id), draft, timeout=_timeout())
+    return line
+
+
+def remove_line(draft_id, product_id, user=None):
+    """Drop a product's line from a draft"""
+    with _locked(draft_id):
+        draft = get_draft(draft_id, user)
+        if draft['lines'].pop(product_id, None) is None:
+            raise DraftError("The draft has no line for this product.")
+        draft['updated_at'] = timezone.now()
+        cache.set(_key(draft_id), draft, timeout=_timeout())
+    return draft
+
+
+def discard_draft(draft_id, user=None):
+    with _locked(draft_id):
+        get_draft(draft_id, user)
+        cache.delete(_key(draft_id))
+
+
+def commit_draft(draft_id, user=None):
+    """
+    Post a draft as one transaction and delete it.
+
+    All lines are validated together: products deleted since they were
+    scanned, and for an OUT draft shortages of stock available to promise,
+    are checked with one query against the maintained balances, locked
+    until the transaction is posted. The lines are then inserted with
+    post_transaction(). The StockMain records the draft, and its unique
+    index refuses a second commit, even one racing the first or retried
+    after a crash left the draft behind. Returns the StockMain.
+    """
+    with _locked(draft_id):
+        draft = get_draft(draft_id, user)
+        posted = StockMain.objects.filter(draft_id=draft_id).values_list('pk', flat=True).first()
+        if posted is not None:
+            cache.delete(_key(draft_id))
+            raise DraftError(f"This draft was already committed as transaction #{posted}.")
+        quantities = {product_id: line['quantity'] for product_id, line in draft['lines'].items()}
+        if not quantities:
+            raise DraftError("The draft has no scanned items.")
+
+        with transaction.atomic():
+            existing = set(ProductMaster.objects.filter(pk__in=quantities).values_list('pk', flat=True))
+            missing = [draft['lines'][product_id]['sku'] for product_id in quantities if product_id not in existing]
+            if missing:
+                raise DraftError(f"Products no longer exist: {', '.join(missing)}.")
+
+            if draft['type'] == 'OUT':
+                # Stock held by reservations cannot be scanned out
+                lock_balances(quantities)
+                available = {product_id: figures[2] for product_id, figures in available_to_promise(list(quantities)).items()}
+                shortages = [
+                    {'product': product_id, 'sku': draft['lines'][product_id]['sku'],
+                     'quantity': quantity, 'available': available[product_id]}
+                    for product_id, quantity in quantities.items() if quantity > available[product_id]
+                ]
+                if shortages:
+                    raise DraftError("Not enough stock to post this draft.", shortages)
+
+            try:
+                stock_main = post_transaction(draft['type'], quantities, remarks=draft['remarks'], draft_id=draft_id)
+            except IntegrityError:
+                # Another commit of this draft got there first; the transaction rolls back
+                raise DraftError("This draft was already committed.")
+        cache.delete(_key(draft_id))
+    return stock_main
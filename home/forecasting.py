@@ -0,0 +1,124 @@
+import datetime
+import math
+
+import numpy as np
+from django.db import connection
+from django.utils import timezone
+
+from .models import ProductMaster, StockMain, StockDetail
+
+DEFAULTS = {
+    'history_days': 365,
+    'window': 28,
+    'alpha': 0.3,
+    'lead_time': 7,
+    'cover_days': 14,
+    'service_z': 1.65,
+}
+
+
+def daily_demand(start, end):
+    """
+    Issued quantities from ``start`` to ``end`` as (product id, day index, quantity) arrays.
+
+    Issues are a small set of transactions, so their dates are turned into
+    day indexes in Python and the lines are read as raw integer triplets,
+    leaving the per-day totals to np.bincount(). Reversed issues and the
+    reversals themselves are not demand.
+    """
+    tz = timezone.get_current_timezone()
+    issues = StockMain.objects.filter(
+        type='OUT',
+        date__gte=datetime.datetime.combine(start, datetime.time.min, tzinfo=tz),
+        date__lt=datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min, tzinfo=tz),
+        reversal_of__isnull=True,
+        reversed_by__isnull=True,
+    )
+    start_ordinal = start.toordinal()
+    issue_days = sorted(
+        (pk, timezone.localtime(date, tz).date().toordinal() - start_ordinal)
+        for pk, date in issues.values_list('pk', 'date')
+    )
+    if not issue_days:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty.astype(np.float64)
+    issue_ids = np.array([pk for pk, _ in issue_days], dtype=np.int64)
+    days_by_issue = np.array([day for _, day in issue_days], dtype=np.int64)
+
+    lines = StockDetail.objects.filter(transaction__in=issues).values_list('product_id', 'transaction_id', 'quantity')
+    sql, params = lines.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        triplets = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 3)
+
+    days = days_by_issue[np.searchsorted(issue_ids, triplets[:, 1])]
+    return triplets[:, 0], days, triplets[:, 2].astype(np.float64)
+
+
+def reorder_suggestions(history_days=DEFAULTS['history_days'], window=DEFAULTS['window'],
+                        alpha=DEFAULTS['alpha'], lead_time=DEFAULTS['lead_time'],
+                        cover_days=DEFAULTS['cover_days'], service_z=DEFAULTS['service_z'], today=None):
+    """
+    Demand forecast and reorder suggestion for every product.
+
+    Demand is the moving average over the last ``window`` days and simple
+    exponential smoothing over the whole history. Smoothing is evaluated in
+    closed form, as a weighted sum with weight ``alpha * (1 - alpha) ** age``
+    per day, so every statistic is a single bincount over the sparse
+    (product, day, quantity) triplets instead of a loop per product. Stock
+    is reordered up to ``lead_time + cover_days`` days of smoothed demand
+    plus ``service_z`` standard deviations of lead-time demand.
+    """
+    today = today or timezone.localdate()
+    start = today - datetime.timedelta(days=history_days - 1)
+
+    products = list(ProductMaster.objects.with_current_stock().order_by('id').values_list('id', 'sku', 'name', 'current_stock'))
+    ids = np.array([row[0] for row in products], dtype=np.int64)
+    stock = np.array([row[3] for row in products], dtype=np.float64)
+
+    product_ids, days, quantities = daily_demand(start, today)
+    index = np.searchsorted(ids, product_ids)
+    size = len(ids)
+
+    recent = days >= history_days - window
+    moving_average = np.bincount(index[recent], weights=quantities[recent], minlength=size) / window
+
+    total = np.bincount(index, weights=quantities, minlength=size)
+    mean = total / history_days
+    variance = np.bincount(index, weights=quantities ** 2, minlength=size) / history_days - mean ** 2
+    deviation = np.sqrt(np.clip(variance, 0, None))
+
+    # Level after the last day, starting from the history mean
+    ages = (history_days - 1) - days
+    smoothed = (
+        np.bincount(index, weights=quantities * alpha * (1 - alpha) ** ages, minlength=size)
+        + mean * (1 - alpha) ** history_days
+    )
+
+    safety_stock = service_z * deviation * math.sqrt(lead_time)
+    reorder_point = smoothed * lead_time + safety_stock
+    target = smoothed * (lead_time + cover_days) + safety_stock
+    suggested = np.where(stock <= reorder_point, np.ceil(np.clip(target - stock, 0, None)), 0)
+    days_of_cover = np.divide(stock, smoothed, out=np.full(size, np.nan), where=smoothed > 0)
+
+    columns = zip(
+        np.round(moving_average, 2).tolist(),
+        np.round(smoothed, 2).tolist(),
+        np.round(days_of_cover, 1).tolist(),
+        np.ceil(reorder_point).astype(np.int64).tolist(),
+        suggested.astype(np.int64).tolist(),
+    )
+    return [
+        {
+            'product_id': product_id,
+            'product_sku': sku,
+            'product_name': name,
+            'current_stock': current_stock,
+            'moving_average': moving,
+            'smoothed_demand': level,
+            'days_of_cover': None if math.isnan(cover) else cover,
+            'reorder_point': point,
+            'suggested_quantity': quantity,
+        }
+        for (product_id, sku, name, current_stock), (moving, level, cover, point, quantity) in zip(products, columns)
+    ]
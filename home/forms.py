@@ -1,18 +1,45 @@
 from django import forms
 from django.forms import formset_factory, inlineformset_factory
 from django.core.exceptions import ValidationError
-from .models import ProductMaster, StockMain, StockDetail
+from .caching import product_cache
+from .models import ProductMaster, StockMain, StockDetail, normalize_sku, sku_format_error
+from .reservations import available_to_promise, lock_balances
+
+class ProductChoiceField(forms.ModelChoiceField):
+    """Product select whose submitted id is resolved through the product cache"""
+    
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if isinstance(value, ProductMaster):
+            value = value.pk
+        product = product_cache.get(value)
+        if product is None:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice', params={'value': value})
+        return product
 
 class ProductForm(forms.ModelForm):
+    # Declared outside Meta.fields so model validation runs no uniqueness
+    # queries for it: the Upper('sku') unique index rejects duplicates and the
+    # view turns the IntegrityError into a SKU error
+    sku = forms.CharField(
+        max_length=ProductMaster._meta.get_field('sku').max_length,
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Enter unique SKU', 'required': True}),
+    )
+    
     class Meta:
         model = ProductMaster
-        fields = ['name', 'description', 'sku']
+        fields = ['name', 'description']
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Enter product name', 'required': True}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 3, 'placeholder': 'Enter product description (optional)'}),
-            'sku': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Enter unique SKU', 'required': True}),
         }
     
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.initial.setdefault('sku', self.instance.sku)
+    
     def clean_name(self):
         name = self.cleaned_data.get('name')
         if not name or len(name.strip()) < 2:
@@ -24,25 +51,18 @@ class ProductForm(forms.ModelForm):
         if not sku:
             raise ValidationError("SKU is required.")
         
-        sku = sku.strip().upper()
-        
-        # Check if SKU already exists (excluding current instance if editing)
-        existing_product = ProductMaster.objects.filter(sku=sku)
-        if self.instance and self.instance.pk:
-            existing_product = existing_product.exclude(pk=self.instance.pk)
-        
-        if existing_product.exists():
-            raise ValidationError("A product with this SKU already exists.")
+        sku = normalize_sku(sku)
         
         # Validate SKU format (alphanumeric with hyphens allowed)
-        import re
-        if not re.match(r'^[A-Z0-9\-]+$', sku):
-            raise ValidationError("SKU can only contain uppercase letters, numbers, and hyphens.")
-        
-        if len(sku) < 3:
-            raise ValidationError("SKU must be at least 3 characters long.")
+        error = sku_format_error(sku)
+        if error:
+            raise ValidationError(error)
         
         return sku
+    
+    def save(self, commit=True):
+        self.instance.sku = self.cleaned_data['sku']
+        return super().save(commit)
 
 class StockMainForm(forms.ModelForm):
     class Meta:
@@ -53,19 +73,54 @@ class StockMainForm(forms.ModelForm):
             'remarks': forms.Textarea(attrs={'class': 'form-control', 'rows': 3, 'placeholder': 'Enter remarks (optional)'}),
         }
     
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Transfers between locations are posted through the API
+        self.fields['type'].choices = [choice for choice in self.fields['type'].choices if choice[0] != 'TRF']
+    
     def clean_type(self):
         transaction_type = self.cleaned_data.get('type')
         if transaction_type not in ['IN', 'OUT']:
             raise ValidationError("Invalid transaction type. Must be 'IN' or 'OUT'.")
         return transaction_type
 
+class TransactionFilterForm(forms.Form):
+    """Filters of the transaction list; every field is optional"""
+    type = forms.ChoiceField(
+        required=False,
+        choices=[('', 'All types')] + StockMain.TRANSACTION_TYPES,
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+    date_from = forms.DateField(required=False, widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}))
+    date_to = forms.DateField(required=False, widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}))
+    product = forms.CharField(
+        required=False,
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Product SKU'}),
+    )
+
+    def clean_product(self):
+        return normalize_sku(self.cleaned_data.get('product'))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from = cleaned_data.get('date_from')
+        date_to = cleaned_data.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            raise ValidationError("The start date must not be after the end date.")
+        return cleaned_data
+
 class StockDetailForm(forms.ModelForm):
+    product = ProductChoiceField(
+        queryset=ProductMaster.objects.all(),
+        widget=forms.Select(attrs={'class': 'form-control', 'required': True}),
+    )
+    
     class Meta:
         model = StockDetail
-        fields = ['product', 'quantity']
+        fields = ['product', 'quantity', 'unit_cost']
         widgets = {
-            'product': forms.Select(attrs={'class': 'form-control', 'required': True}),
             'quantity': forms.NumberInput(attrs={'class': 'form-control', 'min': '1', 'placeholder': 'Enter quantity', 'required': True}),
+            'unit_cost': forms.NumberInput(attrs={'class': 'form-control', 'min': '0', 'step': '0.0001', 'placeholder': 'Optional'}),
         }
 
     def __init__(self, *args, **kwargs):
@@ -95,6 +150,12 @@ class StockDetailForm(forms.ModelForm):
             raise ValidationError("Quantity cannot exceed 10,000 units.")
         return quantity
 
+    def clean_unit_cost(self):
+        unit_cost = self.cleaned_data.get('unit_cost')
+        if unit_cost is not None and unit_cost < 0:
+            raise ValidationError("Unit cost cannot be negative.")
+        return unit_cost
+
     def clean(self):
         cleaned_data = super().clean()
         product = cleaned_data.get('product')
@@ -107,14 +168,10 @@ class StockDetailForm(forms.ModelForm):
             # Try to get from the main form in the context
             transaction_type = getattr(self, '_transaction_type', None)
         
-        if product and quantity and transaction_type == 'OUT':
-            current_stock = product.get_current_stock()
-            if quantity > current_stock:
-                raise ValidationError(
-                    f"Cannot remove {quantity} units of {product.name}. "
-                    f"Only {current_stock} units available in stock."
-                )
+        if cleaned_data.get('unit_cost') is not None and transaction_type == 'OUT':
+            self.add_error('unit_cost', "Unit cost only applies to stock in.")
         
+        # Stock out is checked against the stock available to promise by the formset, for all lines at once
         return cleaned_data
 
 # Enhanced formset with custom validation
@@ -162,3 +219,16 @@ class CustomStockDetailFormSet(StockDetailFormSet):
         
         if total_quantity <= 0:
             raise ValidationError("Total quantity must be greater than 0.")
+        
+        if self.transaction_type == 'OUT':
+            # One grouped query for every line instead of a stock lookup per line; inside the posting
+            # transaction the balance rows are locked first, so the figures hold until the lines are posted
+            lock_balances([product.pk for product in products])
+            available = available_to_promise([product.pk for product in products])
+            for form in self.forms:
+                if not form.cleaned_data or form.cleaned_data.get('DELETE', False):
+                    continue
+                product, quantity = form.cleaned_data['product'], form.cleaned_data['quantity']
+                if quantity > available[product.pk][2]:
+                    form.add_error(None, f"Cannot remove {quantity} units of {product.name}. "
+                                         f"Only {available[product.pk][2]} units available to promise.")
@@ -0,0 +1,252 @@
+# StockDetail lines are the source of truth; StockBalance holds the current
+# stock per product so reads never aggregate the ledger. Single-row writes are
+# applied through signals.py, bulk writes call apply_stock_deltas() directly,
+# and the reconcile_ledger command verifies and repairs the balances.
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .bulk import update_by_pk
+from .caching import bump_inventory_version
+from .changefeed import log_changes
+from .locations import apply_location_deltas, location_deltas, location_shortages
+from .models import Location, LocationBalance, StockBalance, StockMain, StockDetail
+from .movements import add_movements, apply_movements, movements
+from .valuation import value_lines
+
+# Effect of one unit on a line of each transaction type on the product's stock
+STOCK_SIGNS = {'IN': 1, 'OUT': -1}
+
+# Type of the offsetting transaction posted by a reversal; a transfer is reversed by a transfer back
+REVERSAL_TYPES = {'IN': 'OUT', 'OUT': 'IN', 'TRF': 'TRF'}
+
+# Balance rows updated per UPDATE statement
+DELTA_CHUNK_SIZE = 500
+
+
+class ReversalError(Exception):
+    """Raised when a transaction cannot be reversed; ``shortages`` lists blocking products"""
+
+    def __init__(self, message, shortages=()):
+        super().__init__(message)
+        self.shortages = list(shortages)
+
+
+class TransferError(Exception):
+    """Raised when stock cannot be transferred; ``shortages`` lists the products short at the source"""
+
+    def __init__(self, message, shortages=()):
+        super().__init__(message)
+        self.shortages = list(shortages)
+
+
+def stock_sign(transaction_type):
+    return STOCK_SIGNS.get(transaction_type, 0)
+
+
+def apply_stock_deltas(deltas):
+    """
+    Add signed quantities to the maintained balances.
+
+    ``deltas`` maps product id to the change in stock. Per chunk of products,
+    missing balance rows are created first, then all of them are adjusted
+    with a single relative UPDATE, so concurrent writers never overwrite
+    each other.
+    """
+    deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    product_ids = sorted(deltas)
+    for start in range(0, len(product_ids), DELTA_CHUNK_SIZE):
+        chunk = product_ids[start:start + DELTA_CHUNK_SIZE]
+        missing = set(chunk).difference(
+            StockBalance.objects.filter(product_id__in=chunk).values_list('product_id', flat=True)
+        )
+        if missing:
+            StockBalance.objects.bulk_create(
+                [StockBalance(product_id=product_id, quantity=0) for product_id in missing],
+                ignore_conflicts=True,
+            )
+        update_by_pk(
+            StockBalance,
+            ['quantity'],
+            {product_id: (deltas[product_id],) for product_id in chunk},
+            relative=True,
+            constants={'updated_at': timezone.now()},
+        )
+
+
+def post_transaction(transaction_type, quantities, remarks=None, date=None, reversal_of=None, amounts=None,
+                     locations=None, to_location=None, draft_id=None, unit_costs=None):
+    """
+    Record one transaction with a line per product in a constant number of queries.
+
+    ``quantities`` maps product id to a positive quantity. ``amounts``
+    optionally maps product id to the (FIFO, average) cost an IN line
+    carries over, as when an issue is reversed, and ``unit_costs`` the
+    price an IN line is received at. ``locations`` optionally
+    maps product id to the id of the location the line is received at or
+    issued (for a transfer: taken) from, and ``to_location`` is a
+    transfer's destination; ``draft_id`` names the scan draft posted. The
+    header is saved normally, the lines are costed and inserted with
+    bulk_create(), and the balances, location balances and monthly
+    movements are adjusted in the same database transaction. Stock availability is the caller's responsibility.
+    Returns the StockMain.
+    """
+    header = {'type': transaction_type, 'remarks': remarks, 'reversal_of': reversal_of, 'to_location': to_location,
+              'draft_id': draft_id}
+    if date is not None:
+        header['date'] = date
+    sign = stock_sign(transaction_type)
+    amounts = amounts or {}
+    locations = locations or {}
+    unit_costs = unit_costs or {}
+
+    with transaction.atomic():
+        stock_main = StockMain.objects.create(**header)
+        lines = [
+            StockDetail(transaction=stock_main, product_id=product_id, quantity=quantity,
+                        location_id=locations.get(product_id), unit_cost=unit_costs.get(product_id),
+                        fifo_amount=amounts.get(product_id, (None, None))[0],
+                        average_amount=amounts.get(product_id, (None, None))[1])
+            for product_id, quantity in quantities.items()
+        ]
+        value_lines(transaction_type, stock_main.pk, lines)
+        StockDetail.objects.bulk_create(lines, batch_size=DELTA_CHUNK_SIZE)
+        # bulk_create() sends no post_save signals
+        apply_stock_deltas({product_id: sign * quantity for product_id, quantity in quantities.items()})
+        apply_location_deltas(location_deltas(
+            Counter(), transaction_type, stock_main.to_location_id,
+            [(line.location_id, line.product_id, line.quantity) for line in lines],
+        ))
+        apply_movements(add_movements(movements(), transaction_type, stock_main.date, quantities))
+        log_changes(lines, 'create')
+        bump_inventory_version()
+    return stock_main
+
+
+def post_transfer(from_location, to_location, quantities, remarks=None, date=None, reversal_of=None):
+    """
+    Move stock of several products from one location to another as one TRF
+    transaction; product totals are unchanged.
+
+    The source's balance rows are locked and checked in one query, so
+    concurrent transfers cannot take the same stock twice; a shortage
+    raises TransferError listing every product short.
+    """
+    if from_location.pk == to_location.pk:
+        raise TransferError("Stock can only be transferred between two different locations.")
+    with transaction.atomic():
+        shortages = location_shortages(from_location.pk, quantities, lock=True)
+        if shortages:
+            raise TransferError(f"Not enough stock at {from_location.code}.", shortages)
+        return post_transaction(
+            'TRF', quantities, remarks=remarks, date=date, reversal_of=reversal_of,
+            locations={product_id: from_location.pk for product_id in quantities}, to_location=to_location,
+        )
+
+
+def post_reversal(transaction_id, remarks=None):
+    """
+    Post the offsetting transaction of an existing one and link it to the original.
+
+    The original's lines are copied with the opposite type through
+    post_transaction(), so balances move by deltas and history is kept; a
+    transfer is reversed by transferring its stock back. Reversing an IN is
+    refused if it would drive any product negative, overall or at the
+    line's location; that check is a single query joining the lines to the
+    maintained balances.
+    """
+    with transaction.atomic():
+        original = StockMain.objects.select_for_update().select_related('to_location').get(pk=transaction_id)
+        if original.reversal_of_id is not None:
+            raise ReversalError("A reversal cannot itself be reversed.")
+        if StockMain.objects.filter(reversal_of=original).exists():
+            raise ReversalError("This transaction has already been reversed.")
+
+        if original.type == 'TRF':
+            return _reverse_transfer(original, remarks)
+
+        if stock_sign(REVERSAL_TYPES[original.type]) < 0:
+            at_location = LocationBalance.objects.filter(
+                location_id=OuterRef('location_id'), product_id=OuterRef('product_id')
+            ).values('quantity')[:1]
+            shortages = original.details.annotate(
+                available=Coalesce('product__balance__quantity', 0),
+                available_here=Coalesce(Subquery(at_location), 0),
+            ).filter(
+                Q(available__lt=F('quantity')) | Q(location__isnull=False, available_here__lt=F('quantity'))
+            ).values('product_id', 'product__sku', 'quantity', 'available', 'available_here', 'location_id')
+            shortages = [
+                {'product': row['product_id'], 'sku': row['product__sku'], 'quantity': row['quantity'],
+                 'available': row['available'] if row['location_id'] is None else min(row['available'], row['available_here'])}
+                for row in shortages
+            ]
+            if shortages:
+                raise ReversalError("Reversing this transaction would make stock negative.", shortages)
+
+        quantities, amounts, locations = {}, {}, {}
+        for product_id, quantity, location_id, fifo_amount, average_amount in original.details.values_list(
+            'product_id', 'quantity', 'location_id', 'fifo_amount', 'average_amount'
+        ):
+            quantities[product_id] = quantity
+            locations[product_id] = location_id
+            # Returned goods go back in at the cost they left with
+            if original.type == 'OUT' and fifo_amount is not None:
+                amounts[product_id] = (fifo_amount, average_amount)
+        return post_transaction(
+            REVERSAL_TYPES[original.type],
+            quantities,
+            remarks=remarks or f"Reversal of transaction #{original.pk}",
+            reversal_of=original,
+            amounts=amounts,
+            locations=locations,
+        )
+
+
+def _reverse_transfer(original, remarks):
+    sources = set(original.details.values_list('location_id', flat=True))
+    if original.to_location is None or len(sources) != 1 or None in sources:
+        raise ReversalError("Only a transfer from one location to another can be reversed.")
+    quantities = dict(original.details.values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total'))
+    try:
+        return post_transfer(
+            original.to_location, Location.objects.get(pk=sources.pop()), quantities,
+            remarks=remarks or f"Reversal of transaction #{original.pk}", reversal_of=original,
+        )
+    except TransferError as e:
+        raise ReversalError("Reversing this transfer would make stock negative.", e.shortages) from e
+
+
+def ledger_balances(start_id=None, end_id=None):
+    """Stock per product recomputed from the raw ledger, for ids in [start_id, end_id)"""
+    lines = StockDetail.objects.all()
+    if start_id is not None:
+        lines = lines.filter(product_id__gte=start_id)
+    if end_id is not None:
+        lines = lines.filter(product_id__lt=end_id)
+
+    totals = lines.values('product_id').annotate(
+        stock_in=Sum('quantity', filter=Q(transaction__type='IN')),
+        stock_out=Sum('quantity', filter=Q(transaction__type='OUT')),
+    ).values_list('product_id', 'stock_in', 'stock_out')
+    return {product_id: (stock_in or 0) - (stock_out or 0) for product_id, stock_in, stock_out in totals}
+
+
+def write_balances(balances):
+    """Overwrite the maintained balances for the given products with absolute values"""
+    if not balances:
+        return
+    # MySQL upserts on any unique key and rejects an explicit conflict target
+    unique_fields = ['product'] if connection.features.supports_update_conflicts_with_target else None
+    StockBalance.objects.bulk_create(
+        [StockBalance(product_id=product_id, quantity=quantity) for product_id, quantity in balances.items()],
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=['quantity', 'updated_at'],
+        batch_size=DELTA_CHUNK_SIZE,
+    )
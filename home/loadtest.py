@@ -0,0 +1,144 @@
+# Load-test driver used by the load_test command. Kept free of Django imports
+# so client processes can be spawned without setting Django up: they only
+# talk HTTP to the server, like any other client of the API.
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+OPERATIONS = ('lookup', 'post', 'report')
+
+REPORT_PATHS = (
+    '/api/inventory/current_inventory/',
+    '/api/inventory/low_stock/',
+    '/api/inventory/valuation/',
+)
+
+REQUEST_TIMEOUT = 60
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """wsgiref server handling each request in its own thread"""
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(application, host='127.0.0.1', port=0):
+    """Serve a WSGI application from a background thread; returns the server"""
+    server = make_server(host, port, application, server_class=ThreadingWSGIServer,
+                         handler_class=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def parse_mix(value):
+    """'lookup=70,post=20,report=10' to {operation: weight}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f'Unknown operation "{name}"; use {", ".join(OPERATIONS)}.')
+        mix[name] = float(weight)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError('The mix needs at least one operation with a positive weight.')
+    return mix
+
+
+def build_request(base_url, operation, products, rng, lines_per_post):
+    if operation == 'lookup':
+        _, sku = rng.choice(products)
+        return urllib.request.Request(f'{base_url}/api/products/lookup/{sku}/')
+    if operation == 'post':
+        body = {
+            'type': rng.choice(('IN', 'OUT')),
+            'remarks': 'Load test',
+            'details': [{'product': product_id, 'quantity': 1}
+                        for product_id, _ in rng.sample(products, min(lines_per_post, len(products)))],
+        }
+        return urllib.request.Request(f'{base_url}/api/transactions/', data=json.dumps(body).encode(),
+                                      headers={'Content-Type': 'application/json'}, method='POST')
+    return urllib.request.Request(base_url + rng.choice(REPORT_PATHS))
+
+
+def drive(base_url, products, mix, clients, duration, lines_per_post=3, seed=None):
+    """
+    Run ``clients`` threads issuing the weighted mix of operations for ``duration`` seconds.
+
+    Returns one (operation, latency in seconds, HTTP status or 0) per request,
+    and the seconds the clients ran for.
+    """
+    operations, weights = zip(*mix.items())
+    started = time.perf_counter()
+    deadline = started + duration
+    results = []
+    lock = threading.Lock()
+
+    def client(number):
+        rng = random.Random(None if seed is None else f'{seed}-{number}')
+        own = []
+        while time.perf_counter() < deadline:
+            operation = rng.choices(operations, weights)[0]
+            request = build_request(base_url, operation, products, rng, lines_per_post)
+            sent = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except OSError:
+                status = 0
+            own.append((operation, time.perf_counter() - sent, status))
+        with lock:
+            results.extend(own)
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(math.ceil(fraction * len(sorted_values)) - 1, 0)]
+
+
+def summarize(results, elapsed):
+    """Per-operation and total request counts, error rate, throughput and latency percentiles"""
+    groups = {operation: [] for operation in OPERATIONS}
+    for operation, latency, status in results:
+        groups[operation].append((latency, status))
+    groups['total'] = [(latency, status) for _, latency, status in results]
+
+    summary = {}
+    for name, rows in groups.items():
+        if not rows:
+            continue
+        latencies = sorted(latency for latency, _ in rows)
+        errors = sum(1 for _, status in rows if not 200 <= status < 400)
+        summary[name] = {
+            'requests': len(rows),
+            'errors': errors,
+            'error_rate': errors / len(rows),
+            'throughput': len(rows) / elapsed,
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1],
+        }
+    return summary
@@ -0,0 +1,158 @@
+# Stock per storage location. A line with a location adds to (IN) or takes
+# from (OUT) that location's LocationBalance; a transfer (TRF) takes its lines
+# from their location and puts them at the header's to_location, leaving the
+# product totals alone. Lines without a location count towards the product
+# totals only. Ledger writes apply their location deltas as they are posted
+# (post_transaction() and signals.py), like the product balances.
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
+
+from .bulk import insert_rows
+from .models import LocationBalance, ProductMaster, StockDetail
+
+# Effect of one unit of an IN or OUT line on the stock at its location
+LOCATION_SIGNS = {'IN': 1, 'OUT': -1}
+
+# Products adjusted per UPDATE statement
+LOCATION_CHUNK_SIZE = 500
+
+
+def location_deltas(accumulated, transaction_type, to_location_id, lines, sign=1):
+    """
+    Add the stock changes per (location id, product id) of some lines of one
+    transaction, or with ``sign=-1`` take them back out.
+
+    ``lines`` yields (location id, product id, quantity). Returns ``accumulated``.
+    """
+    for location_id, product_id, quantity in lines:
+        if transaction_type == 'TRF':
+            if location_id:
+                accumulated[(location_id, product_id)] -= sign * quantity
+            if to_location_id:
+                accumulated[(to_location_id, product_id)] += sign * quantity
+        elif location_id:
+            accumulated[(location_id, product_id)] += sign * LOCATION_SIGNS.get(transaction_type, 0) * quantity
+    return accumulated
+
+
+def _by_product(values):
+    return Case(*[When(product_id=product_id, then=Value(value)) for product_id, value in values.items()],
+                default=Value(0))
+
+
+def apply_location_deltas(deltas):
+    """
+    Add signed quantities to the per-location balances.
+
+    Per location and chunk of products, missing rows are inserted, then all
+    of them are adjusted with one relative UPDATE so concurrent writers add
+    up. Rows that reach zero are deleted, so a location's rows are the
+    products it holds.
+    """
+    by_location = {}
+    for (location_id, product_id), delta in deltas.items():
+        if delta:
+            by_location.setdefault(location_id, {})[product_id] = delta
+
+    now = timezone.now()
+    for location_id, changes in sorted(by_location.items()):
+        product_ids = sorted(changes)
+        for start in range(0, len(product_ids), LOCATION_CHUNK_SIZE):
+            chunk = {product_id: changes[product_id] for product_id in product_ids[start:start + LOCATION_CHUNK_SIZE]}
+            rows = LocationBalance.objects.filter(location_id=location_id, product_id__in=chunk)
+            missing = set(chunk).difference(rows.values_list('product_id', flat=True))
+            if missing:
+                LocationBalance.objects.bulk_create(
+                    [LocationBalance(location_id=location_id, product_id=product_id, quantity=0) for product_id in missing],
+                    ignore_conflicts=True,
+                )
+            rows.update(quantity=F('quantity') + _by_product(chunk), updated_at=now)
+            if any(delta < 0 for delta in chunk.values()):
+                rows.filter(quantity=0).delete()
+
+
+def ledger_location_balances(product_ids=None):
+    """Stock per (location id, product id) recomputed from the raw ledger"""
+    lines = StockDetail.objects.all()
+    if product_ids is not None:
+        lines = lines.filter(product_id__in=product_ids)
+
+    balances = Counter()
+    at_line_location = lines.filter(location__isnull=False).values('location_id', 'product_id').annotate(
+        quantity=Sum(Case(
+            When(transaction__type='IN', then=F('quantity')),
+            When(transaction__type__in=['OUT', 'TRF'], then=-F('quantity')),
+            default=Value(0),
+        ))
+    ).order_by().values_list('location_id', 'product_id', 'quantity')
+    transferred_in = lines.filter(transaction__type='TRF', transaction__to_location__isnull=False).values(
+        'transaction__to_location_id', 'product_id'
+    ).annotate(quantity=Sum('quantity')).order_by().values_list('transaction__to_location_id', 'product_id', 'quantity')
+    for location_id, product_id, quantity in [*at_line_location, *transferred_in]:
+        balances[(location_id, product_id)] += quantity
+    return balances
+
+
+def rebuild_location_balances(product_ids=None):
+    """
+    Recompute the per-location balances from the ledger, for all products or
+    only ``product_ids``; returns the number of rows written.
+    """
+    balances = ledger_location_balances(product_ids)
+    existing = LocationBalance.objects.all()
+    if product_ids is not None:
+        existing = existing.filter(product_id__in=product_ids)
+
+    now = timezone.now()
+    rows = [(location_id, product_id, quantity, now)
+            for (location_id, product_id), quantity in sorted(balances.items()) if quantity]
+    with transaction.atomic():
+        existing.delete()
+        insert_rows(LocationBalance, ['location', 'product', 'quantity', 'updated_at'], rows)
+    return len(rows)
+
+
+def location_stock(location):
+    """Stock on hand at a location, one row per product it holds, by product id"""
+    # A range of the (location, product) unique index: the cost follows the products held there
+    return LocationBalance.objects.filter(location=location).exclude(quantity=0).order_by('product_id')
+
+
+def location_shortages(location_id, quantities, lock=False):
+    """
+    Products of ``quantities`` (product id to quantity) the location holds
+    too little of, as {'product', 'sku', 'quantity', 'available'} rows; with
+    ``lock`` the balance rows stay locked until the transaction ends.
+    """
+    balances = LocationBalance.objects.filter(location_id=location_id, product_id__in=quantities)
+    if lock:
+        balances = balances.select_for_update()
+    available = dict(balances.values_list('product_id', 'quantity'))
+    short = {product_id: quantity for product_id, quantity in quantities.items()
+             if quantity > available.get(product_id, 0)}
+    if not short:
+        return []
+    skus = dict(ProductMaster.objects.filter(pk__in=short).values_list('pk', 'sku'))
+    return [
+        {'product': product_id, 'sku': skus.get(product_id), 'quantity': quantity,
+         'available': available.get(product_id, 0)}
+        for product_id, quantity in short.items()
+    ]
+
+
+def location_quantities(pairs):
+    """{(location id, product id): stock} for some pairs, in one query; pairs without a row hold nothing"""
+    pairs = set(pairs)
+    if not pairs:
+        return {}
+    rows = LocationBalance.objects.filter(
+        location_id__in={location_id for location_id, _ in pairs},
+        product_id__in={product_id for _, product_id in pairs},
+    ).values_list('location_id', 'product_id', 'quantity')
+    quantities = {pair: 0 for pair in pairs}
+    quantities.update(((location_id, product_id), quantity) for location_id, product_id, quantity in rows
+                      if (location_id, product_id) in pairs)
+    return quantities
@@ -0,0 +1,94 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from home.ledger import apply_stock_deltas
+from home.models import ProductMaster, StockMain, StockDetail
+from home.renderers import FastJSONRenderer
+from home.serializers import (
+    ProductMasterSerializer,
+    InventoryReportSerializer,
+    ProductMasterValuesSerializer,
+    InventoryReportValuesSerializer,
+    inventory_status,
+)
+
+
+class Command(BaseCommand):
+    help = 'Compare DRF serializers with the values() fast path on report and list responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Number of products to benchmark with')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement (best is reported)')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        repeat = max(options['repeat'], 1)
+
+        # Seed throwaway products inside a transaction that is always rolled back
+        with transaction.atomic():
+            self.seed(rows)
+            products = ProductMaster.objects.with_current_stock().filter(sku__startswith='BENCH-').order_by('id')
+
+            def drf_report():
+                inventory_data = [{
+                    'product_id': product.id,
+                    'product_name': product.name,
+                    'product_sku': product.sku,
+                    'product_description': product.description or '',
+                    'current_stock': product.current_stock,
+                    'status': inventory_status(product.current_stock),
+                    'created_at': product.created_at,
+                } for product in products.all()]
+                return JSONRenderer().render(InventoryReportSerializer(inventory_data, many=True).data)
+
+            def fast_report():
+                return FastJSONRenderer().render(InventoryReportValuesSerializer(products.all()).data)
+
+            def drf_products():
+                return JSONRenderer().render(ProductMasterSerializer(products.all(), many=True).data)
+
+            def fast_products():
+                return FastJSONRenderer().render(ProductMasterValuesSerializer(products.all()).data)
+
+            self.stdout.write(f'Rows: {rows}')
+            for label, baseline, fast in [
+                ('inventory report', drf_report, fast_report),
+                ('product list', drf_products, fast_products),
+            ]:
+                baseline_time, baseline_output = self.measure(baseline, repeat)
+                fast_time, fast_output = self.measure(fast, repeat)
+                if baseline_output != fast_output:
+                    raise CommandError(f'{label}: fast path output differs from the DRF serializer output')
+                self.stdout.write(
+                    f'{label:<18} DRF {baseline_time:8.3f}s   fast path {fast_time:8.3f}s   '
+                    f'speedup {baseline_time / fast_time:5.1f}x   ({len(fast_output)} identical bytes)'
+                )
+
+            transaction.set_rollback(True)
+
+    def seed(self, rows):
+        products = ProductMaster.objects.bulk_create(
+            [ProductMaster(name=f'Benchmark Product {i}', sku=f'BENCH-{i:07d}',
+                           description=f'Benchmark description {i}' if i % 2 else None)
+             for i in range(rows)],
+            batch_size=5000
+        )
+        stock_in = StockMain.objects.create(type='IN', remarks='Benchmark stock')
+        lines = StockDetail.objects.bulk_create(
+            [StockDetail(transaction=stock_in, product=product, quantity=i % 20)
+             for i, product in enumerate(products) if i % 20],
+            batch_size=5000
+        )
+        apply_stock_deltas({line.product_id: line.quantity for line in lines})
+
+    def measure(self, func, repeat):
+        best, output = None, None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            output = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, output
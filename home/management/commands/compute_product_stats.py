@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from home.models import ProductStats
+from home.velocity import compute_product_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute 30/90-day issue volume, turnover and ABC class for every product'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        written = compute_product_stats()
+        elapsed = time.perf_counter() - started
+
+        classes = dict(ProductStats.objects.values_list('abc_class').annotate(total=Count('pk')).order_by())
+        self.stdout.write(self.style.SUCCESS(
+            f'Stats computed for {written} products in {elapsed:.2f}s '
+            f'(A: {classes.get("A", 0)}, B: {classes.get("B", 0)}, C: {classes.get("C", 0)})'
+        ))
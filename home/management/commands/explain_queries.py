@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from home.queryplans import PlanUnavailable, check_hot_queries, index_operation, inspect_endpoints
+
+
+class Command(BaseCommand):
+    help = ('Explain the queries behind the hot views and API endpoints, flag full scans and temporary sorts '
+            'and propose indexes; --check fails when a known hot query no longer uses its index')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only verify that each known hot query uses its index; exits non-zero otherwise')
+        parser.add_argument('--all', action='store_true', help='Also list queries whose plans raise no flags')
+        parser.add_argument('--sql', action='store_true', help='Print the SQL of each listed query')
+
+    def handle(self, *args, **options):
+        try:
+            if options['check']:
+                self.check_indexes()
+            else:
+                self.inspect(options)
+        except PlanUnavailable as e:
+            raise CommandError(str(e))
+
+    def check_indexes(self):
+        failures = check_hot_queries()
+        for name, table, columns, steps in failures:
+            plan = '; '.join(step.detail for step in steps) or 'no plan steps'
+            self.stderr.write(f'{name}: expected an index on {table}({", ".join(columns)}), plan: {plan}')
+        if failures:
+            raise CommandError(f'{len(failures)} hot queries lost their index')
+        self.stdout.write(self.style.SUCCESS('Every hot query uses its index'))
+
+    def inspect(self, options):
+        findings = inspect_endpoints()
+        proposals = []
+        for finding in findings:
+            if not finding.problems and not options['all']:
+                continue
+            label = self.style.WARNING('FLAG') if finding.problems else 'ok  '
+            runs = f' (run {finding.runs} times)' if finding.runs > 1 else ''
+            self.stdout.write(f'{label} {finding.endpoint}{runs}')
+            for step in finding.steps:
+                self.stdout.write(f'       {step.detail}')
+            if options['sql']:
+                self.stdout.write(f'       {finding.sql}')
+            for proposal in finding.proposals:
+                if proposal not in proposals:
+                    proposals.append(proposal)
+
+        flagged = sum(1 for finding in findings if finding.problems)
+        self.stdout.write(f'{len(findings)} queries explained, {flagged} flagged')
+        if proposals:
+            self.stdout.write('Proposed index operations:')
+            for model_name, fields in proposals:
+                self.stdout.write(f'    {index_operation(model_name, fields)},')
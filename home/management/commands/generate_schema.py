@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home.schema import write_schema
+
+
+class Command(BaseCommand):
+    help = 'Generate the OpenAPI schema served by /api/schema/ and the docs pages (run at deploy time)'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        paths = write_schema()
+        elapsed = time.perf_counter() - started
+        for path in paths:
+            self.stdout.write(f'Wrote {path}')
+        self.stdout.write(self.style.SUCCESS(f'Schema generated in {elapsed:.2f}s'))
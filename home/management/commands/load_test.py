@@ -0,0 +1,149 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import urllib.request
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from home import loadtest
+from home.ledger import post_transaction
+from home.models import ProductMaster
+
+SEED_SKU_PREFIX = 'LOAD-'
+
+# Opening stock per product, enough that OUT posts never run short
+SEED_STOCK = 1000000
+
+
+class Command(BaseCommand):
+    help = 'Load-test the WSGI app in-process on a seeded throwaway database and report latency percentiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mix', default='lookup=70,post=20,report=10',
+                            help='Relative weights of product lookups, transaction posts and report reads')
+        parser.add_argument('--clients', type=int, default=16, help='Concurrent client threads in total')
+        parser.add_argument('--processes', type=int, default=2,
+                            help='Client processes the threads are spread over, so clients do not share the server\'s GIL')
+        parser.add_argument('--duration', type=float, default=20, help='Seconds to run')
+        parser.add_argument('--products', type=int, default=1000, help='Products to seed')
+        parser.add_argument('--lines', type=int, default=3, help='Lines per posted transaction')
+        parser.add_argument('--seed', type=int, help='Random seed for a repeatable request sequence')
+        parser.add_argument('--url', help='Drive an already running server (e.g. gunicorn) instead of the in-process one')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the seeded test database between runs')
+        parser.add_argument('--with-limits', action='store_true', help='Keep API rate limits and concurrency caps on')
+        parser.add_argument('--json', dest='json_output', help='Also write the summary to this JSON file')
+
+    def handle(self, *args, **options):
+        try:
+            mix = loadtest.parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['clients'] < 1 or options['processes'] < 1 or options['duration'] <= 0:
+            raise CommandError('--clients, --processes and --duration must be positive')
+
+        if options['url']:
+            base_url = options['url'].rstrip('/')
+            with urllib.request.urlopen(f'{base_url}/api/products/') as response:
+                products = [(row['id'], row['sku']) for row in json.load(response)]
+            summary = self.run(base_url, products, mix, options)
+        else:
+            summary = self.run_in_process(mix, options)
+
+        self.report(summary, options)
+
+    def run_in_process(self, mix, options):
+        """Serve the WSGI application from this process against a freshly seeded test database"""
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        if connection.vendor == 'sqlite' and not test_settings.get('NAME'):
+            # A file, not the in-memory default, so every server thread sees the same data
+            test_settings['NAME'] = os.path.join(tempfile.gettempdir(), 'loadtest.sqlite3')
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=options['keepdb'])
+
+        overrides = {}
+        if not options['with_limits']:
+            overrides = {
+                # Views bind their throttle classes at import; without rates the throttles pass everything
+                'REST_FRAMEWORK': {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}},
+                'API_CONCURRENCY_LIMITS': {},
+            }
+        try:
+            with override_settings(**overrides):
+                products = self.seed(options['products'])
+                from parksons_graphics_task.wsgi import application
+
+                server = loadtest.start_server(application)
+                try:
+                    host, port = server.server_address[:2]
+                    return self.run(f'http://{host}:{port}', products, mix, options)
+                finally:
+                    server.shutdown()
+                    server.server_close()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+    def seed(self, count):
+        """Products with ample stock, reused when --keepdb kept an earlier seed"""
+        seeded = ProductMaster.objects.filter(sku__startswith=SEED_SKU_PREFIX)
+        if not seeded.exists():
+            created = ProductMaster.objects.bulk_create(
+                [ProductMaster(name=f'Load Test Product {i}', sku=f'{SEED_SKU_PREFIX}{i:06d}') for i in range(count)],
+                batch_size=1000
+            )
+            post_transaction('IN', {product.pk: SEED_STOCK for product in created}, remarks='Load test opening stock')
+        return list(seeded.order_by('id').values_list('id', 'sku'))
+
+    def run(self, base_url, products, mix, options):
+        if not products:
+            raise CommandError('There are no products to drive the load test with.')
+
+        processes = min(options['processes'], options['clients'])
+        shares = [options['clients'] // processes + (i < options['clients'] % processes) for i in range(processes)]
+        self.stdout.write(
+            f'Driving {base_url} with {options["clients"]} clients in {processes} processes '
+            f'for {options["duration"]:g}s ({len(products)} products)...'
+        )
+
+        # Spawned, not forked: this process is already running server threads
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [
+                pool.submit(loadtest.drive, base_url, products, mix, clients, options['duration'], options['lines'],
+                            None if options['seed'] is None else f'{options["seed"]}-{number}')
+                for number, clients in enumerate(shares)
+            ]
+            runs = [future.result() for future in futures]
+        # Throughput over the time the clients actually ran, not process start-up
+        results = [row for rows, _ in runs for row in rows]
+        elapsed = max(seconds for _, seconds in runs)
+
+        summary = loadtest.summarize(results, elapsed)
+        summary['statuses'] = dict(Counter(str(status) for _, _, status in results))
+        return summary
+
+    def report(self, summary, options):
+        self.stdout.write(
+            f'\n{"operation":<10}{"requests":>10}{"errors":>8}{"err %":>8}{"req/s":>9}'
+            f'{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"max ms":>9}'
+        )
+        for name in (*loadtest.OPERATIONS, 'total'):
+            row = summary.get(name)
+            if row is None:
+                continue
+            self.stdout.write(
+                f'{name:<10}{row["requests"]:>10}{row["errors"]:>8}{row["error_rate"] * 100:>8.2f}'
+                f'{row["throughput"]:>9.1f}{row["p50"] * 1000:>9.1f}{row["p95"] * 1000:>9.1f}'
+                f'{row["p99"] * 1000:>9.1f}{row["max"] * 1000:>9.1f}'
+            )
+        self.stdout.write(f'\nHTTP statuses: {", ".join(f"{code}: {n}" for code, n in sorted(summary["statuses"].items()))}'
+                          ' (0 = connection error or timeout)')
+
+        if options['json_output']:
+            with open(options['json_output'], 'w') as output_file:
+                json.dump(summary, output_file, indent=2)
+            self.stdout.write(f'Summary written to {options["json_output"]}')
@@ -0,0 +1,15 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home.locations import rebuild_location_balances
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stock per location and product from the ledger'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        written = rebuild_location_balances()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'{written} location balance rows rebuilt in {elapsed:.2f}s'))
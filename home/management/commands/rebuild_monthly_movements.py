@@ -0,0 +1,15 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home.movements import rebuild_monthly_movements
+
+
+class Command(BaseCommand):
+    help = 'Recompute the monthly movement summary of every product from the ledger'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        written = rebuild_monthly_movements()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'{written} monthly movement rows rebuilt in {elapsed:.2f}s'))
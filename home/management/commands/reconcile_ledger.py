@@ -0,0 +1,167 @@
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Max, Min
+
+from home.caching import bump_inventory_version
+from home.ledger import ledger_balances, write_balances
+from home.models import ProductMaster, StockBalance
+
+
+def _init_worker():
+    # Each worker process opens its own connection instead of sharing the parent's
+    import django
+    django.setup()
+    connections.close_all()
+
+
+def reconcile_range(start_id, end_id, snapshot=None, repair=False):
+    """
+    Recompute balances from the ledger for product ids in [start_id, end_id).
+
+    Compares them with the stored balances, or with ``snapshot`` when given,
+    and returns (product_id, ledger, recorded) for every mismatch. With
+    ``repair`` the stored balances of the range are rewritten while locked.
+    """
+    with transaction.atomic():
+        if snapshot is None:
+            stored = StockBalance.objects.filter(product_id__gte=start_id, product_id__lt=end_id)
+            if repair:
+                stored = stored.select_for_update()
+            recorded = dict(stored.values_list('product_id', 'quantity'))
+        else:
+            recorded = snapshot
+        ledger = ledger_balances(start_id, end_id)
+
+        discrepancies = []
+        for product_id in sorted(set(ledger) | set(recorded)):
+            expected = ledger.get(product_id, 0)
+            actual = recorded.get(product_id, 0)
+            if expected != actual:
+                discrepancies.append((product_id, expected, actual))
+
+        if repair and discrepancies:
+            write_balances({product_id: expected for product_id, expected, _ in discrepancies})
+            bump_inventory_version()
+
+    return start_id, end_id, discrepancies
+
+
+class Command(BaseCommand):
+    help = 'Recompute stock balances from the ledger in parallel, report discrepancies and optionally repair them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes; 1 runs in this process')
+        parser.add_argument('--range-size', type=int, default=10000, help='Product ids per unit of work')
+        parser.add_argument('--snapshot', help='CSV (product_id,quantity) or JSON {product_id: quantity} to compare against '
+                                               'instead of the stored balances')
+        parser.add_argument('--report', help='Write the discrepancies to this CSV file')
+        parser.add_argument('--repair', action='store_true', help='Overwrite mismatching stored balances with the ledger values')
+        parser.add_argument('--state', help='Checkpoint file recording finished ranges; an interrupted run with the same '
+                                            'options is resumed from it, and it is removed once the run completes')
+
+    def handle(self, *args, **options):
+        if options['repair'] and options['snapshot']:
+            raise CommandError('--repair rewrites stored balances and cannot be combined with --snapshot')
+        if options['range_size'] < 1:
+            raise CommandError('--range-size must be positive')
+
+        snapshot = self.load_snapshot(options['snapshot']) if options['snapshot'] else None
+        run = {'range_size': options['range_size'], 'snapshot': options['snapshot'], 'repair': options['repair']}
+        state = self.load_state(options['state'], run)
+        done = {tuple(bounds) for bounds in state['completed']}
+        ranges = [bounds for bounds in self.id_ranges(options['range_size'], snapshot) if bounds not in done]
+
+        if done:
+            self.stdout.write(f'Resuming from {options["state"]}: skipping {len(done)} ranges already reconciled, '
+                              f'{len(ranges)} left')
+
+        def record(start_id, end_id, discrepancies):
+            state['completed'].append([start_id, end_id])
+            state['discrepancies'].extend(discrepancies)
+            self.save_state(options['state'], state)
+            self.stdout.write(f'  ids {start_id}-{end_id - 1}: {len(discrepancies)} discrepancies')
+
+        def range_snapshot(start_id, end_id):
+            if snapshot is None:
+                return None
+            return {pid: qty for pid, qty in snapshot.items() if start_id <= pid < end_id}
+
+        if options['workers'] <= 1 or len(ranges) <= 1:
+            for start_id, end_id in ranges:
+                record(*reconcile_range(start_id, end_id, range_snapshot(start_id, end_id), options['repair']))
+        else:
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as executor:
+                futures = [
+                    executor.submit(reconcile_range, start_id, end_id, range_snapshot(start_id, end_id), options['repair'])
+                    for start_id, end_id in ranges
+                ]
+                for future in as_completed(futures):
+                    record(*future.result())
+
+        discrepancies = sorted(state['discrepancies'])
+        if options['report']:
+            self.write_report(options['report'], discrepancies)
+        if options['state'] and os.path.exists(options['state']):
+            # The run is complete; the next one with this file starts over
+            os.remove(options['state'])
+
+        if not discrepancies:
+            self.stdout.write(self.style.SUCCESS('Ledger and balances agree'))
+        elif options['repair']:
+            self.stdout.write(self.style.SUCCESS(f'Repaired {len(discrepancies)} balances'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{len(discrepancies)} products disagree with the ledger'))
+
+    def id_ranges(self, range_size, snapshot):
+        bounds = ProductMaster.objects.aggregate(low=Min('id'), high=Max('id'))
+        low, high = bounds['low'], bounds['high']
+        if snapshot:
+            low = min(low if low is not None else min(snapshot), min(snapshot))
+            high = max(high if high is not None else max(snapshot), max(snapshot))
+        if low is None:
+            return []
+        return [(start, min(start + range_size, high + 1)) for start in range(low, high + 1, range_size)]
+
+    def load_snapshot(self, path):
+        try:
+            with open(path, newline='') as snapshot_file:
+                if path.endswith('.json'):
+                    return {int(pid): int(qty) for pid, qty in json.load(snapshot_file).items()}
+                return {int(row['product_id']): int(row['quantity']) for row in csv.DictReader(snapshot_file)}
+        except (OSError, ValueError, KeyError) as exc:
+            raise CommandError(f'Could not read snapshot {path}: {exc}')
+
+    def load_state(self, path, run):
+        if path and os.path.exists(path):
+            with open(path) as state_file:
+                state = json.load(state_file)
+            if state.get('run') == run:
+                return state
+            self.stdout.write(f'Ignoring {path}: it was written by a run with different options')
+        return {'run': run, 'completed': [], 'discrepancies': []}
+
+    def save_state(self, path, state):
+        if not path:
+            return
+        # Write then rename so an interrupted run never leaves a truncated checkpoint
+        with open(f'{path}.tmp', 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(f'{path}.tmp', path)
+
+    def write_report(self, path, discrepancies):
+        skus = dict(
+            ProductMaster.objects.filter(id__in=[pid for pid, _, _ in discrepancies]).values_list('id', 'sku')
+        )
+        with open(path, 'w', newline='') as report_file:
+            writer = csv.writer(report_file)
+            writer.writerow(['product_id', 'sku', 'ledger_quantity', 'recorded_quantity', 'difference'])
+            for product_id, expected, actual in discrepancies:
+                writer.writerow([product_id, skus.get(product_id, ''), expected, actual, actual - expected])
+        self.stdout.write(f'Discrepancy report written to {path}')
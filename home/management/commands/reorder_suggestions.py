@@ -0,0 +1,68 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from home.forecasting import DEFAULTS, reorder_suggestions
+
+FIELDS = [
+    'product_id', 'product_sku', 'product_name', 'current_stock', 'moving_average',
+    'smoothed_demand', 'days_of_cover', 'reorder_point', 'suggested_quantity',
+]
+
+
+class Command(BaseCommand):
+    help = 'Forecast demand for the whole catalog and suggest reorder quantities'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--history-days', type=int, default=DEFAULTS['history_days'], help='Days of issue history to use')
+        parser.add_argument('--window', type=int, default=DEFAULTS['window'], help='Moving average window in days')
+        parser.add_argument('--alpha', type=float, default=DEFAULTS['alpha'], help='Exponential smoothing factor')
+        parser.add_argument('--lead-time', type=int, default=DEFAULTS['lead_time'], help='Supplier lead time in days')
+        parser.add_argument('--cover-days', type=int, default=DEFAULTS['cover_days'],
+                            help='Days of demand to cover beyond the lead time')
+        parser.add_argument('--service-z', type=float, default=DEFAULTS['service_z'],
+                            help='Safety stock in standard deviations of lead-time demand')
+        parser.add_argument('--all', action='store_true', help='Include products that need no reorder')
+        parser.add_argument('--output', help='Write the suggestions to this CSV file')
+
+    def handle(self, *args, **options):
+        if not 1 <= options['window'] <= options['history_days']:
+            raise CommandError('--window must be between 1 and --history-days')
+        if not 0 < options['alpha'] <= 1:
+            raise CommandError('--alpha must be in (0, 1]')
+
+        started = time.perf_counter()
+        rows = reorder_suggestions(
+            history_days=options['history_days'],
+            window=options['window'],
+            alpha=options['alpha'],
+            lead_time=options['lead_time'],
+            cover_days=options['cover_days'],
+            service_z=options['service_z'],
+        )
+        elapsed = time.perf_counter() - started
+
+        suggested = [row for row in rows if row['suggested_quantity'] > 0]
+        output_rows = rows if options['all'] else suggested
+        output_rows.sort(key=lambda row: (row['days_of_cover'] is None, row['days_of_cover'] or 0))
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output_file:
+                writer = csv.DictWriter(output_file, fieldnames=FIELDS)
+                writer.writeheader()
+                writer.writerows(output_rows)
+            self.stdout.write(f'Suggestions written to {options["output"]}')
+        else:
+            for row in output_rows[:20]:
+                self.stdout.write(
+                    f'{row["product_sku"]:<20} stock {row["current_stock"]:>7}  demand/day {row["smoothed_demand"]:>8}  '
+                    f'cover {row["days_of_cover"] if row["days_of_cover"] is not None else "-":>7}  '
+                    f'reorder {row["suggested_quantity"]:>7}'
+                )
+            if len(output_rows) > 20:
+                self.stdout.write(f'... {len(output_rows) - 20} more (use --output to export all)')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(suggested)} of {len(rows)} products need reordering ({elapsed:.2f}s)'
+        ))
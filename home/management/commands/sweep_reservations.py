@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home.reservations import SWEEP_BATCH_SIZE, sweep_expired_reservations
+
+
+class Command(BaseCommand):
+    help = 'Delete expired stock reservations in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE,
+                            help='Reservations deleted per statement')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        deleted = sweep_expired_reservations(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'{deleted} expired reservations deleted in {elapsed:.2f}s'))
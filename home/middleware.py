@@ -0,0 +1,20 @@
+from .profiling import profile_request, requested_profiler
+
+
+class RequestProfilerMiddleware:
+    """
+    Profile a staff request that asks for it with ?profile=1 or an
+    X-Profile header, when settings.REQUEST_PROFILING is on.
+
+    Must come after AuthenticationMiddleware. Every other request passes
+    straight through.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profiler = requested_profiler(request)
+        if profiler is None:
+            return self.get_response(request)
+        return profile_request(request, self.get_response, profiler)
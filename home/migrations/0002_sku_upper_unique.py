@@ -0,0 +1,57 @@
+# Generated by Django 5.0.7 on 2026-10-19 00:45
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+def normalize_and_deduplicate_skus(apps, schema_editor):
+    """Uppercase stored SKUs and merge products whose SKUs only differ by case"""
+    ProductMaster = apps.get_model("home", "ProductMaster")
+    StockDetail = apps.get_model("home", "StockDetail")
+
+    groups = {}
+    for product_id, sku in ProductMaster.objects.order_by("id").values_list("id", "sku"):
+        groups.setdefault(sku.strip().upper(), []).append((product_id, sku))
+
+    for normalized, members in groups.items():
+        keeper_id = members[0][0]
+        duplicate_ids = [product_id for product_id, _ in members[1:]]
+
+        if duplicate_ids:
+            # Move ledger lines onto the surviving product, merging lines that
+            # would collide on (transaction, product)
+            keeper_lines = {
+                line.transaction_id: line
+                for line in StockDetail.objects.filter(product_id=keeper_id)
+            }
+            for line in StockDetail.objects.filter(product_id__in=duplicate_ids).order_by("id"):
+                existing = keeper_lines.get(line.transaction_id)
+                if existing:
+                    existing.quantity += line.quantity
+                    existing.save(update_fields=["quantity"])
+                    line.delete()
+                else:
+                    line.product_id = keeper_id
+                    line.save(update_fields=["product"])
+                    keeper_lines[line.transaction_id] = line
+            ProductMaster.objects.filter(id__in=duplicate_ids).delete()
+
+        if members[0][1] != normalized:
+            ProductMaster.objects.filter(id=keeper_id).update(sku=normalized)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("home", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_and_deduplicate_skus, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="productmaster",
+            constraint=models.UniqueConstraint(
+                django.db.models.functions.text.Upper("sku"),
+                name="prodmast_sku_upper_uniq",
+            ),
+        ),
+    ]
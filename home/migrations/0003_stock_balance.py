@@ -0,0 +1,61 @@
+# Generated by Django 5.0.7 on 2026-10-19 00:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+
+def backfill_balances(apps, schema_editor):
+    """Compute the initial balance of every product from the ledger"""
+    StockBalance = apps.get_model("home", "StockBalance")
+    StockDetail = apps.get_model("home", "StockDetail")
+
+    totals = StockDetail.objects.values("product_id").annotate(
+        stock_in=Sum("quantity", filter=Q(transaction__type="IN")),
+        stock_out=Sum("quantity", filter=Q(transaction__type="OUT")),
+    )
+    now = timezone.now()
+    StockBalance.objects.bulk_create(
+        [
+            StockBalance(
+                product_id=row["product_id"],
+                quantity=(row["stock_in"] or 0) - (row["stock_out"] or 0),
+                updated_at=now,
+            )
+            for row in totals
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("home", "0002_sku_upper_unique"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StockBalance",
+            fields=[
+                (
+                    "product",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="balance",
+                        serialize=False,
+                        to="home.productmaster",
+                    ),
+                ),
+                ("quantity", models.IntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Stock Balance",
+                "verbose_name_plural": "Stock Balances",
+                "db_table": "stckbal",
+            },
+        ),
+        migrations.RunPython(backfill_balances, migrations.RunPython.noop),
+    ]
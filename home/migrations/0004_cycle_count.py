@@ -0,0 +1,48 @@
+# Generated by Django 5.0.7 on 2026-10-19 00:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0003_stock_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('remarks', models.TextField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('OPEN', 'Open'), ('POSTED', 'Posted')], default='OPEN', max_length=6)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('posted_at', models.DateTimeField(blank=True, null=True)),
+                ('adjustment_in', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='home.stockmain')),
+                ('adjustment_out', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='home.stockmain')),
+            ],
+            options={
+                'verbose_name': 'Count Session',
+                'verbose_name_plural': 'Count Sessions',
+                'db_table': 'cntsession',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CountLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('counted_quantity', models.PositiveIntegerField()),
+                ('system_quantity', models.IntegerField(blank=True, null=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='count_lines', to='home.productmaster')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='home.countsession')),
+            ],
+            options={
+                'verbose_name': 'Count Line',
+                'verbose_name_plural': 'Count Lines',
+                'db_table': 'cntline',
+                'unique_together': {('session', 'product')},
+            },
+        ),
+    ]
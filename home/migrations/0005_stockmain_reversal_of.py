@@ -0,0 +1,19 @@
+# Generated by Django 5.0.7 on 2026-10-19 01:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0004_cycle_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockmain',
+            name='reversal_of',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='reversed_by', to='home.stockmain'),
+        ),
+    ]
@@ -0,0 +1,150 @@
+# Generated by Django 5.0.7 on 2026-10-19 01:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def open_valuations(apps, schema_editor):
+    """Value stock that predates cost tracking as zero-cost opening layers"""
+    StockBalance = apps.get_model("home", "StockBalance")
+    CostLayer = apps.get_model("home", "CostLayer")
+    ProductValuation = apps.get_model("home", "ProductValuation")
+
+    balances = list(
+        StockBalance.objects.exclude(quantity=0).values_list("product_id", "quantity")
+    )
+    now = timezone.now()
+    CostLayer.objects.bulk_create(
+        [
+            CostLayer(
+                product_id=product_id,
+                unit_cost=0,
+                quantity=quantity,
+                remaining=quantity,
+            )
+            for product_id, quantity in balances
+            if quantity > 0
+        ],
+        batch_size=1000,
+    )
+    ProductValuation.objects.bulk_create(
+        [
+            ProductValuation(
+                product_id=product_id,
+                quantity=quantity,
+                fifo_value=0,
+                average_value=0,
+                updated_at=now,
+            )
+            for product_id, quantity in balances
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("home", "0005_stockmain_reversal_of"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductValuation",
+            fields=[
+                (
+                    "product",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="valuation",
+                        serialize=False,
+                        to="home.productmaster",
+                    ),
+                ),
+                ("quantity", models.IntegerField(default=0)),
+                (
+                    "fifo_value",
+                    models.DecimalField(decimal_places=4, default=0, max_digits=16),
+                ),
+                (
+                    "average_value",
+                    models.DecimalField(decimal_places=4, default=0, max_digits=16),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Product Valuation",
+                "verbose_name_plural": "Product Valuations",
+                "db_table": "prodval",
+            },
+        ),
+        migrations.AddField(
+            model_name="stockdetail",
+            name="average_amount",
+            field=models.DecimalField(
+                blank=True, decimal_places=4, editable=False, max_digits=16, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="stockdetail",
+            name="fifo_amount",
+            field=models.DecimalField(
+                blank=True, decimal_places=4, editable=False, max_digits=16, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="stockdetail",
+            name="unit_cost",
+            field=models.DecimalField(
+                blank=True, decimal_places=4, max_digits=12, null=True
+            ),
+        ),
+        migrations.CreateModel(
+            name="CostLayer",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("unit_cost", models.DecimalField(decimal_places=4, max_digits=12)),
+                ("quantity", models.PositiveIntegerField()),
+                ("remaining", models.PositiveIntegerField()),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="cost_layers",
+                        to="home.productmaster",
+                    ),
+                ),
+                (
+                    "transaction",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="cost_layers",
+                        to="home.stockmain",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Cost Layer",
+                "verbose_name_plural": "Cost Layers",
+                "db_table": "costlayer",
+                "indexes": [
+                    models.Index(
+                        fields=["product", "remaining"], name="costlayer_open_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(open_valuations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.0.7 on 2026-10-19 01:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("home", "0006_inventory_valuation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductStats",
+            fields=[
+                (
+                    "product",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to="home.productmaster",
+                    ),
+                ),
+                ("out_30d", models.PositiveIntegerField(default=0)),
+                ("out_90d", models.PositiveIntegerField(default=0)),
+                (
+                    "turnover",
+                    models.DecimalField(
+                        blank=True, decimal_places=2, max_digits=12, null=True
+                    ),
+                ),
+                (
+                    "abc_class",
+                    models.CharField(
+                        choices=[
+                            ("A", "A - Fast mover"),
+                            ("B", "B - Medium mover"),
+                            ("C", "C - Slow mover"),
+                        ],
+                        default="C",
+                        max_length=1,
+                    ),
+                ),
+                ("computed_at", models.DateTimeField()),
+            ],
+            options={
+                "verbose_name": "Product Stats",
+                "verbose_name_plural": "Product Stats",
+                "db_table": "prodstats",
+                "indexes": [
+                    models.Index(fields=["out_30d"], name="prodstats_out30_idx"),
+                    models.Index(fields=["out_90d"], name="prodstats_out90_idx"),
+                    models.Index(fields=["turnover"], name="prodstats_turnover_idx"),
+                    models.Index(
+                        fields=["abc_class", "out_90d"], name="prodstats_abc_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
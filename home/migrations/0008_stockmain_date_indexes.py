@@ -0,0 +1,21 @@
+# Generated by Django 5.0.7 on 2026-10-19 01:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("home", "0007_product_stats"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="stockmain",
+            index=models.Index(fields=["date"], name="stckmain_date_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="stockmain",
+            index=models.Index(fields=["type", "date"], name="stckmain_type_date_idx"),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.0.7 on 2026-10-19 01:58
+
+import django.core.serializers.json
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("home", "0008_stockmain_date_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LedgerChange",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                (
+                    "entity",
+                    models.CharField(
+                        choices=[
+                            ("transaction", "Transaction"),
+                            ("transaction_detail", "Transaction line"),
+                        ],
+                        max_length=18,
+                    ),
+                ),
+                ("entity_id", models.BigIntegerField()),
+                (
+                    "action",
+                    models.CharField(
+                        choices=[
+                            ("create", "Created"),
+                            ("update", "Updated"),
+                            ("delete", "Deleted"),
+                        ],
+                        max_length=6,
+                    ),
+                ),
+                (
+                    "data",
+                    models.JSONField(
+                        encoder=django.core.serializers.json.DjangoJSONEncoder
+                    ),
+                ),
+                ("changed_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                "verbose_name": "Ledger Change",
+                "verbose_name_plural": "Ledger Changes",
+                "db_table": "ledgerchg",
+            },
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.0.7 on 2026-10-19 02:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import DateField, Q, Sum
+from django.db.models.functions import TruncMonth
+
+
+def backfill_movements(apps, schema_editor):
+    """Summarize the existing ledger per product and month"""
+    MonthlyMovement = apps.get_model("home", "MonthlyMovement")
+    StockDetail = apps.get_model("home", "StockDetail")
+
+    totals = (
+        StockDetail.objects.annotate(
+            month=TruncMonth("transaction__date", output_field=DateField())
+        )
+        .values("product_id", "month")
+        .annotate(
+            in_qty=Sum("quantity", filter=Q(transaction__type="IN"), default=0),
+            out_qty=Sum("quantity", filter=Q(transaction__type="OUT"), default=0),
+        )
+        .order_by("product_id", "month")
+    )
+    rows, product, closing = [], None, 0
+    for row in totals.iterator(chunk_size=5000):
+        if row["product_id"] != product:
+            product, closing = row["product_id"], 0
+        closing += row["in_qty"] - row["out_qty"]
+        rows.append(MonthlyMovement(closing=closing, **row))
+        if len(rows) >= 5000:
+            MonthlyMovement.objects.bulk_create(rows)
+            rows = []
+    MonthlyMovement.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("home", "0009_ledger_change"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MonthlyMovement",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("month", models.DateField()),
+                ("in_qty", models.IntegerField(default=0)),
+                ("out_qty", models.IntegerField(default=0)),
+                ("closing", models.IntegerField(default=0)),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="monthly_movements",
+                        to="home.productmaster",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Monthly Movement",
+                "verbose_name_plural": "Monthly Movements",
+                "db_table": "monthmove",
+                "indexes": [models.Index(fields=["month"], name="monthmove_month_idx")],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="monthlymovement",
+            constraint=models.UniqueConstraint(
+                fields=("product", "month"), name="monthmove_product_month_uniq"
+            ),
+        ),
+        migrations.RunPython(backfill_movements, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 5.0.7 on 2026-10-19 02:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("home", "0010_monthly_movement"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Location",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("code", models.CharField(max_length=20, unique=True)),
+                ("name", models.CharField(max_length=255)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name": "Location",
+                "verbose_name_plural": "Locations",
+                "db_table": "location",
+                "ordering": ["code"],
+            },
+        ),
+        migrations.AlterField(
+            model_name="stockmain",
+            name="type",
+            field=models.CharField(
+                choices=[("IN", "Stock In"), ("OUT", "Stock Out"), ("TRF", "Transfer")],
+                max_length=3,
+            ),
+        ),
+        migrations.AddField(
+            model_name="stockdetail",
+            name="location",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="stock_details",
+                to="home.location",
+            ),
+        ),
+        migrations.AddField(
+            model_name="stockmain",
+            name="to_location",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="transfers_in",
+                to="home.location",
+            ),
+        ),
+        migrations.CreateModel(
+            name="LocationBalance",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("quantity", models.IntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "location",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="balances",
+                        to="home.location",
+                    ),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="location_balances",
+                        to="home.productmaster",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Location Balance",
+                "verbose_name_plural": "Location Balances",
+                "db_table": "locbal",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="locationbalance",
+            constraint=models.UniqueConstraint(
+                fields=("location", "product"), name="locbal_location_product_uniq"
+            ),
+        ),
+    ]
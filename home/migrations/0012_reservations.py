@@ -0,0 +1,56 @@
+# Generated by Django 5.0.7 on 2026-10-19 02:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("home", "0011_locations"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Reservation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("quantity", models.IntegerField()),
+                ("reference", models.CharField(blank=True, default="", max_length=100)),
+                ("expires_at", models.DateTimeField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="reservations",
+                        to="home.productmaster",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Reservation",
+                "verbose_name_plural": "Reservations",
+                "db_table": "reservation",
+                "ordering": ["expires_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["product", "expires_at"],
+                        name="reservation_prod_expires_idx",
+                    ),
+                    models.Index(fields=["expires_at"], name="reservation_expires_idx"),
+                    models.Index(
+                        fields=["reference"], name="reservation_reference_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
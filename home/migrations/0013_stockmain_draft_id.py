@@ -0,0 +1,20 @@
+# Generated by Django 5.0.7 on 2026-10-19 03:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("home", "0012_reservations"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stockmain",
+            name="draft_id",
+            field=models.CharField(
+                blank=True, editable=False, max_length=32, null=True, unique=True
+            ),
+        ),
+    ]
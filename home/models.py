@@ -1,7 +1,49 @@
+import re
+
 from django.db import models
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce, Upper
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 
+# SKUs are stored uppercase and may only contain letters, numbers and hyphens
+SKU_PATTERN = re.compile(r'^[A-Z0-9\-]+$')
+SKU_MIN_LENGTH = 3
+
+
+def normalize_sku(value):
+    """Return the canonical (stripped, uppercase) form of a SKU"""
+    return (value or '').strip().upper()
+
+
+def sku_format_error(sku):
+    """Return a validation message for a normalized SKU, or None if it is valid"""
+    if not SKU_PATTERN.match(sku):
+        return "SKU can only contain uppercase letters, numbers, and hyphens."
+    if len(sku) < SKU_MIN_LENGTH:
+        return "SKU must be at least 3 characters long."
+    return None
+
+class ProductMasterQuerySet(models.QuerySet):
+    def with_current_stock(self):
+        """Annotate each product with its current stock level in the same query"""
+        # Read from the maintained balance row rather than aggregating the ledger
+        return self.annotate(current_stock=Coalesce('balance__quantity', 0))
+
+    def with_available_to_promise(self, now=None, exclude_reference=None):
+        """
+        Annotate current stock, the quantity held by active reservations and
+        what is left to promise (``available``), in one grouped query;
+        holds for ``exclude_reference`` are not counted.
+        """
+        active = Q(reservations__expires_at__gt=now or timezone.now())
+        if exclude_reference:
+            active &= ~Q(reservations__reference=exclude_reference)
+        return self.with_current_stock().annotate(
+            reserved=Sum('reservations__quantity', filter=active, default=0),
+        ).annotate(available=F('current_stock') - F('reserved'))
+
 class ProductMaster(models.Model):
     """Product Master Table - stores the details of the products"""
     name = models.CharField(max_length=255)
@@ -10,16 +52,32 @@ class ProductMaster(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductMasterQuerySet.as_manager()
+
     class Meta:
         db_table = 'prodmast'
         verbose_name = 'Product'
         verbose_name_plural = 'Products'
+        constraints = [
+            # Case-insensitive uniqueness, enforced by the database instead of a pre-check query
+            models.UniqueConstraint(Upper('sku'), name='prodmast_sku_upper_uniq'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.sku})"
 
     def get_current_stock(self):
-        """Calculate current stock level for this product"""
+        """Get current stock level for this product from its maintained balance"""
+        # Use the value annotated by with_current_stock() when available
+        if hasattr(self, 'current_stock'):
+            return self.current_stock
+        
+        # Always read fresh rather than caching the balance on the instance
+        quantity = StockBalance.objects.filter(product_id=self.pk).values_list('quantity', flat=True).first()
+        return quantity or 0
+
+    def get_ledger_stock(self):
+        """Calculate current stock level for this product from the raw ledger"""
         stock_in = StockDetail.objects.filter(
             product=self,
             transaction__type='IN'
@@ -32,29 +90,77 @@ class ProductMaster(models.Model):
         
         return stock_in - stock_out
 
+class Location(models.Model):
+    """Location Master Table - the storage locations stock is kept at"""
+    code = models.CharField(max_length=20, unique=True)
+    name = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'location'
+        verbose_name = 'Location'
+        verbose_name_plural = 'Locations'
+        ordering = ['code']
+
+    def __str__(self):
+        return f"{self.name} ({self.code})"
+
+class StockMainQuerySet(models.QuerySet):
+    def with_total_items(self):
+        """Annotate each transaction with the total quantity of its lines in the same query"""
+        return self.annotate(
+            total_items=Coalesce(Sum('details__quantity'), 0, output_field=models.IntegerField())
+        )
+
 class StockMain(models.Model):
     """Stock Transaction Header Table - stores the transaction details"""
     TRANSACTION_TYPES = [
         ('IN', 'Stock In'),
         ('OUT', 'Stock Out'),
+        ('TRF', 'Transfer'),
     ]
     
     date = models.DateTimeField(default=timezone.now)
     type = models.CharField(max_length=3, choices=TRANSACTION_TYPES)
     remarks = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set on an offsetting transaction; one reversal per original, enforced by the unique index
+    reversal_of = models.OneToOneField('self', on_delete=models.PROTECT, blank=True, null=True, related_name='reversed_by')
+    # Destination of a transfer; its lines are taken from their own location
+    to_location = models.ForeignKey(Location, on_delete=models.PROTECT, blank=True, null=True, related_name='transfers_in')
+    # Scan draft this transaction was committed from; one transaction per draft, enforced by the unique index
+    draft_id = models.CharField(max_length=32, unique=True, blank=True, null=True, editable=False)
+
+    objects = StockMainQuerySet.as_manager()
 
     class Meta:
         db_table = 'stckmain'
         verbose_name = 'Stock Transaction'
         verbose_name_plural = 'Stock Transactions'
         ordering = ['-date']
+        indexes = [
+            # History pages and date-range filters, optionally by type
+            models.Index(fields=['date'], name='stckmain_date_idx'),
+            models.Index(fields=['type', 'date'], name='stckmain_type_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.type} - {self.date.strftime('%Y-%m-%d %H:%M')}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored type, date and destination so changes can be applied to the derived tables
+        instance._stored_type = instance.__dict__.get('type')
+        instance._stored_date = instance.__dict__.get('date')
+        instance._stored_to_location = instance.__dict__.get('to_location_id', models.DEFERRED)
+        return instance
+
     def get_total_items(self):
         """Get total number of items in this transaction"""
+        # Use the value annotated by with_total_items() when available
+        if hasattr(self, 'total_items'):
+            return self.total_items
         return self.details.aggregate(total=models.Sum('quantity'))['total'] or 0
 
 class StockDetail(models.Model):
@@ -62,6 +168,13 @@ class StockDetail(models.Model):
     transaction = models.ForeignKey(StockMain, on_delete=models.CASCADE, related_name='details')
     product = models.ForeignKey(ProductMaster, on_delete=models.CASCADE, related_name='stock_details')
     quantity = models.PositiveIntegerField()
+    # Entered on IN lines; lines without one are received at the current average cost
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=4, blank=True, null=True)
+    # Extended cost of the line under each valuation method, set when the line is posted
+    fifo_amount = models.DecimalField(max_digits=16, decimal_places=4, blank=True, null=True, editable=False)
+    average_amount = models.DecimalField(max_digits=16, decimal_places=4, blank=True, null=True, editable=False)
+    # Where the quantity is received or issued (a transfer's source); lines without one count towards product totals only
+    location = models.ForeignKey(Location, on_delete=models.PROTECT, blank=True, null=True, related_name='stock_details')
 
     class Meta:
         db_table = 'stckdetail'
@@ -72,8 +185,28 @@ class StockDetail(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.quantity} ({self.transaction.type})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored line so an update can be applied to the balances as a delta
+        instance._stored_line = (
+            instance.__dict__.get('transaction_id'),
+            instance.__dict__.get('product_id'),
+            instance.__dict__.get('quantity'),
+            instance.__dict__.get('location_id', models.DEFERRED),
+        )
+        return instance
+
     def clean(self):
-        """Validate stock out doesn't exceed available stock"""
+        """Validate stock out doesn't exceed available stock, at the line's location too"""
+        if self.transaction.type in ('OUT', 'TRF') and self.location_id:
+            at_location = LocationBalance.objects.filter(
+                location_id=self.location_id, product_id=self.product_id
+            ).values_list('quantity', flat=True).first() or 0
+            if self.quantity > at_location:
+                raise ValidationError(
+                    f"Cannot remove {self.quantity} items. Only {at_location} available at this location."
+                )
         if self.transaction.type == 'OUT':
             current_stock = self.product.get_current_stock()
             if self.quantity > current_stock:
@@ -84,3 +217,227 @@ class StockDetail(models.Model):
     def save(self, *args, **kwargs):
         self.clean()
         super().save(*args, **kwargs)
+
+class StockBalance(models.Model):
+    """Stock Balance Table - current stock per product, derived from the ledger"""
+    product = models.OneToOneField(ProductMaster, on_delete=models.CASCADE, primary_key=True, related_name='balance')
+    quantity = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'stckbal'
+        verbose_name = 'Stock Balance'
+        verbose_name_plural = 'Stock Balances'
+
+    def __str__(self):
+        return f"{self.product_id}: {self.quantity}"
+
+class LocationBalance(models.Model):
+    """Location Balance Table - current stock per location and product, derived from the ledger"""
+    location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name='balances')
+    product = models.ForeignKey(ProductMaster, on_delete=models.CASCADE, related_name='location_balances')
+    quantity = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'locbal'
+        verbose_name = 'Location Balance'
+        verbose_name_plural = 'Location Balances'
+        constraints = [
+            # Also the index location-scoped reads walk: one range per location
+            models.UniqueConstraint(fields=['location', 'product'], name='locbal_location_product_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.location_id}/{self.product_id}: {self.quantity}"
+
+class Reservation(models.Model):
+    """Reservation Table - stock held for an order until it ships or the hold expires"""
+    product = models.ForeignKey(ProductMaster, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.IntegerField()
+    # Order the stock is held for; an issue naming it ships and releases the hold
+    reference = models.CharField(max_length=100, blank=True, default='')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'reservation'
+        verbose_name = 'Reservation'
+        verbose_name_plural = 'Reservations'
+        ordering = ['expires_at']
+        indexes = [
+            # Active holds of a product: summed by available-to-promise
+            models.Index(fields=['product', 'expires_at'], name='reservation_prod_expires_idx'),
+            # Expired holds, deleted oldest first by the sweep
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+            models.Index(fields=['reference'], name='reservation_reference_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.quantity} until {self.expires_at:%Y-%m-%d %H:%M}"
+
+class CostLayer(models.Model):
+    """Cost Layer Table - one FIFO receipt layer per IN line, consumed oldest first"""
+    # Null for the opening layers created from stock that predates cost tracking
+    transaction = models.ForeignKey(StockMain, on_delete=models.CASCADE, blank=True, null=True, related_name='cost_layers')
+    product = models.ForeignKey(ProductMaster, on_delete=models.CASCADE, related_name='cost_layers')
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=4)
+    quantity = models.PositiveIntegerField()
+    remaining = models.PositiveIntegerField()
+
+    class Meta:
+        db_table = 'costlayer'
+        verbose_name = 'Cost Layer'
+        verbose_name_plural = 'Cost Layers'
+        indexes = [
+            models.Index(fields=['product', 'remaining'], name='costlayer_open_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.remaining}/{self.quantity} @ {self.unit_cost}"
+
+class ProductValuation(models.Model):
+    """Product Valuation Table - maintained FIFO and weighted-average value per product"""
+    product = models.OneToOneField(ProductMaster, on_delete=models.CASCADE, primary_key=True, related_name='valuation')
+    quantity = models.IntegerField(default=0)
+    fifo_value = models.DecimalField(max_digits=16, decimal_places=4, default=0)
+    average_value = models.DecimalField(max_digits=16, decimal_places=4, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'prodval'
+        verbose_name = 'Product Valuation'
+        verbose_name_plural = 'Product Valuations'
+
+    def __str__(self):
+        return f"{self.product_id}: {self.fifo_value}"
+
+    def get_average_unit_cost(self):
+        """Weighted-average cost of one unit on hand"""
+        if self.quantity <= 0:
+            return 0
+        return self.average_value / self.quantity
+
+class ProductStats(models.Model):
+    """Product Stats Table - movement velocity and ABC class per product, computed in batch"""
+    ABC_CLASSES = [
+        ('A', 'A - Fast mover'),
+        ('B', 'B - Medium mover'),
+        ('C', 'C - Slow mover'),
+    ]
+
+    product = models.OneToOneField(ProductMaster, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    out_30d = models.PositiveIntegerField(default=0)
+    out_90d = models.PositiveIntegerField(default=0)
+    # Annualized issues over stock on hand; null when nothing is on hand
+    turnover = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
+    abc_class = models.CharField(max_length=1, choices=ABC_CLASSES, default='C')
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'prodstats'
+        verbose_name = 'Product Stats'
+        verbose_name_plural = 'Product Stats'
+        indexes = [
+            models.Index(fields=['out_30d'], name='prodstats_out30_idx'),
+            models.Index(fields=['out_90d'], name='prodstats_out90_idx'),
+            models.Index(fields=['turnover'], name='prodstats_turnover_idx'),
+            models.Index(fields=['abc_class', 'out_90d'], name='prodstats_abc_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.abc_class} ({self.out_90d})"
+
+class CountSession(models.Model):
+    """Cycle Count Session Table - one physical stock count and its posted adjustments"""
+    STATUS_CHOICES = [
+        ('OPEN', 'Open'),
+        ('POSTED', 'Posted'),
+    ]
+    
+    remarks = models.TextField(blank=True, null=True)
+    status = models.CharField(max_length=6, choices=STATUS_CHOICES, default='OPEN')
+    created_at = models.DateTimeField(auto_now_add=True)
+    posted_at = models.DateTimeField(blank=True, null=True)
+    adjustment_in = models.ForeignKey(StockMain, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    adjustment_out = models.ForeignKey(StockMain, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+
+    class Meta:
+        db_table = 'cntsession'
+        verbose_name = 'Count Session'
+        verbose_name_plural = 'Count Sessions'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Count #{self.pk} ({self.status})"
+
+class CountLine(models.Model):
+    """Cycle Count Line Table - counted quantity of one product within a count session"""
+    session = models.ForeignKey(CountSession, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(ProductMaster, on_delete=models.CASCADE, related_name='count_lines')
+    counted_quantity = models.PositiveIntegerField()
+    # System stock snapshotted when the session is posted
+    system_quantity = models.IntegerField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'cntline'
+        verbose_name = 'Count Line'
+        verbose_name_plural = 'Count Lines'
+        unique_together = ['session', 'product']
+
+    def __str__(self):
+        return f"{self.product_id}: {self.counted_quantity}"
+
+class LedgerChange(models.Model):
+    """Ledger Change Log - one row per insert, update or delete of a transaction or line, append-only"""
+    ENTITIES = [
+        ('transaction', 'Transaction'),
+        ('transaction_detail', 'Transaction line'),
+    ]
+    ACTIONS = [
+        ('create', 'Created'),
+        ('update', 'Updated'),
+        ('delete', 'Deleted'),
+    ]
+
+    # The feed cursor: ids only grow and are never reused
+    id = models.BigAutoField(primary_key=True)
+    entity = models.CharField(max_length=18, choices=ENTITIES)
+    # No foreign key: the change outlives the row it describes
+    entity_id = models.BigIntegerField()
+    action = models.CharField(max_length=6, choices=ACTIONS)
+    # The row's ledger fields after the change (before it, for deletes)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'ledgerchg'
+        verbose_name = 'Ledger Change'
+        verbose_name_plural = 'Ledger Changes'
+
+    def __str__(self):
+        return f"#{self.pk} {self.action} {self.entity} {self.entity_id}"
+
+class MonthlyMovement(models.Model):
+    """Monthly Movement Table - IN/OUT quantities and closing stock per product and month, derived from the ledger"""
+    product = models.ForeignKey(ProductMaster, on_delete=models.CASCADE, related_name='monthly_movements')
+    # First day of the month, in the current time zone
+    month = models.DateField()
+    in_qty = models.IntegerField(default=0)
+    out_qty = models.IntegerField(default=0)
+    # Stock at the end of the month; months without a row had no movement and keep the previous closing
+    closing = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'monthmove'
+        verbose_name = 'Monthly Movement'
+        verbose_name_plural = 'Monthly Movements'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'month'], name='monthmove_product_month_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['month'], name='monthmove_month_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} {self.month:%Y-%m}: +{self.in_qty} -{self.out_qty} = {self.closing}"
@@ -0,0 +1,186 @@
+# Monthly IN/OUT quantities and closing stock per product are kept in
+# MonthlyMovement, so month-over-month reports read one row per product and
+# month instead of aggregating years of ledger lines. Ledger writes apply
+# their movements as they are posted (post_transaction() and signals.py);
+# the rebuild_monthly_movements command recomputes the table from the ledger.
+import datetime
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, DateField, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .bulk import insert_rows
+from .models import MonthlyMovement, ProductMaster, StockDetail
+
+# Products adjusted per UPDATE statement
+MOVEMENT_CHUNK_SIZE = 500
+
+# Summary rows inserted per statement by a rebuild
+REBUILD_CHUNK_SIZE = 5000
+
+# Longest span of a movement report
+MAX_REPORT_MONTHS = 120
+
+
+def month_of(moment):
+    """First day of the month of a transaction date, in the current time zone"""
+    if timezone.is_aware(moment):
+        moment = timezone.localtime(moment)
+    return moment.date().replace(day=1)
+
+
+def movements():
+    """An empty accumulator for add_movements(): {(product_id, month): [in, out]}"""
+    return defaultdict(lambda: [0, 0])
+
+
+def add_movements(accumulated, transaction_type, date, quantities, sign=1):
+    """Add the line quantities of one transaction, or with ``sign=-1`` take them back out"""
+    column = {'IN': 0, 'OUT': 1}.get(transaction_type)
+    if column is None:
+        # Transfers move stock between locations and leave the product's totals alone
+        return accumulated
+    month = month_of(date)
+    for product_id, quantity in quantities.items():
+        accumulated[(product_id, month)][column] += sign * quantity
+    return accumulated
+
+
+def _by_product(values):
+    return Case(*[When(product_id=product_id, then=Value(value)) for product_id, value in values.items()],
+                default=Value(0))
+
+
+def apply_movements(accumulated):
+    """
+    Add accumulated IN/OUT quantities to the monthly summary.
+
+    Per month and chunk of products, missing rows are inserted with the
+    closing stock of the product's previous row, then the month's
+    quantities and the closing stock of that month and every later one are
+    adjusted with relative UPDATEs, so concurrent writers add up. A
+    back-dated write therefore touches one row per later month with
+    movement, never the ledger. Rows left without movement are dropped, as
+    a rebuild would not write them.
+    """
+    by_month = defaultdict(dict)
+    for (product_id, month), (in_qty, out_qty) in accumulated.items():
+        if in_qty or out_qty:
+            by_month[month][product_id] = (in_qty, out_qty)
+
+    for month, deltas in sorted(by_month.items()):
+        product_ids = sorted(deltas)
+        for start in range(0, len(product_ids), MOVEMENT_CHUNK_SIZE):
+            chunk = {product_id: deltas[product_id] for product_id in product_ids[start:start + MOVEMENT_CHUNK_SIZE]}
+            _apply_month(month, chunk)
+
+
+def _apply_month(month, deltas):
+    existing = set(
+        MonthlyMovement.objects.filter(month=month, product_id__in=deltas).values_list('product_id', flat=True)
+    )
+    missing = [product_id for product_id in deltas if product_id not in existing]
+    if missing:
+        previous = MonthlyMovement.objects.filter(
+            product_id=OuterRef('pk'), month__lt=month
+        ).order_by('-month').values('closing')[:1]
+        MonthlyMovement.objects.bulk_create(
+            [
+                MonthlyMovement(product_id=product_id, month=month, closing=closing or 0)
+                for product_id, closing in ProductMaster.objects.filter(pk__in=missing).annotate(
+                    closing=Subquery(previous)
+                ).values_list('pk', 'closing')
+            ],
+            ignore_conflicts=True,
+        )
+
+    MonthlyMovement.objects.filter(month=month, product_id__in=deltas).update(
+        in_qty=F('in_qty') + _by_product({product_id: in_qty for product_id, (in_qty, _) in deltas.items() if in_qty}),
+        out_qty=F('out_qty') + _by_product({product_id: out_qty for product_id, (_, out_qty) in deltas.items() if out_qty}),
+    )
+    changes = {product_id: in_qty - out_qty for product_id, (in_qty, out_qty) in deltas.items() if in_qty != out_qty}
+    if changes:
+        MonthlyMovement.objects.filter(month__gte=month, product_id__in=changes).update(
+            closing=F('closing') + _by_product(changes)
+        )
+    # A month whose movements were all taken back carries no information
+    if any(in_qty < 0 or out_qty < 0 for in_qty, out_qty in deltas.values()):
+        MonthlyMovement.objects.filter(month=month, product_id__in=deltas, in_qty=0, out_qty=0).delete()
+
+
+def rebuild_monthly_movements(product_ids=None):
+    """
+    Recompute the summary from the ledger, for all products or only
+    ``product_ids``; returns the number of rows written.
+
+    One grouped query over the lines yields each product's quantities per
+    month in order, the closing stock is carried forward in Python and the
+    rows are replaced within one transaction.
+    """
+    lines = StockDetail.objects.all()
+    existing = MonthlyMovement.objects.all()
+    if product_ids is not None:
+        lines = lines.filter(product_id__in=product_ids)
+        existing = existing.filter(product_id__in=product_ids)
+
+    totals = lines.annotate(
+        month=TruncMonth('transaction__date', output_field=DateField())
+    ).values('product_id', 'month').annotate(
+        in_qty=Sum('quantity', filter=Q(transaction__type='IN'), default=0),
+        out_qty=Sum('quantity', filter=Q(transaction__type='OUT'), default=0),
+    ).order_by('product_id', 'month').values_list('product_id', 'month', 'in_qty', 'out_qty')
+
+    fields = ['product', 'month', 'in_qty', 'out_qty', 'closing']
+    written = 0
+    with transaction.atomic():
+        existing.delete()
+        rows, product, closing = [], None, 0
+        for product_id, month, in_qty, out_qty in totals.iterator(chunk_size=REBUILD_CHUNK_SIZE):
+            if product_id != product:
+                product, closing = product_id, 0
+            closing += in_qty - out_qty
+            rows.append((product_id, month, in_qty, out_qty, closing))
+            if len(rows) >= REBUILD_CHUNK_SIZE:
+                insert_rows(MonthlyMovement, fields, rows)
+                written += len(rows)
+                rows = []
+        insert_rows(MonthlyMovement, fields, rows)
+        written += len(rows)
+    return written
+
+
+def add_months(month, count):
+    """The first of the month ``count`` months after (or before) ``month``"""
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def monthly_totals(start, end, product_ids=None):
+    """
+    IN/OUT quantities, opening and closing stock for every month from
+    ``start`` to ``end``, over all products or only ``product_ids``.
+
+    Reads the summary only: the opening stock is the net movement of the
+    rows before ``start``, each month's quantities one grouped sum.
+    """
+    rows = MonthlyMovement.objects.all()
+    if product_ids is not None:
+        rows = rows.filter(product_id__in=product_ids)
+
+    before = rows.filter(month__lt=start).aggregate(in_qty=Sum('in_qty', default=0), out_qty=Sum('out_qty', default=0))
+    sums = {
+        month: (in_qty, out_qty)
+        for month, in_qty, out_qty in rows.filter(month__range=(start, end)).values('month').annotate(
+            in_qty=Sum('in_qty'), out_qty=Sum('out_qty')
+        ).order_by().values_list('month', 'in_qty', 'out_qty')
+    }
+
+    report, closing, month = [], before['in_qty'] - before['out_qty'], start
+    while month <= end:
+        in_qty, out_qty = sums.get(month, (0, 0))
+        opening, closing = closing, closing + in_qty - out_qty
+        report.append({'month': month, 'in_qty': in_qty, 'out_qty': out_qty, 'opening': opening, 'closing': closing})
+        month = add_months(month, 1)
+    return report
@@ -0,0 +1,34 @@
+import csv
+import io
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+def read_csv_rows(raw, encoding=None):
+    """Decode a CSV payload and return its rows as dicts keyed by lowercase header"""
+    try:
+        text = raw.decode(encoding or settings.DEFAULT_CHARSET) if isinstance(raw, bytes) else raw
+    except (UnicodeDecodeError, LookupError) as exc:
+        raise ParseError(f"CSV parse error - {exc}")
+
+    reader = csv.reader(io.StringIO(text.lstrip('\ufeff')))
+    try:
+        header = next(reader, None)
+        if not header:
+            return []
+        header = [column.strip().lower() for column in header]
+        return [dict(zip(header, values)) for values in reader if values]
+    except csv.Error as exc:
+        raise ParseError(f"CSV parse error - {exc}")
+
+
+class CSVParser(BaseParser):
+    """Parses text/csv request bodies into a list of row dicts"""
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return read_csv_rows(stream.read(), encoding)
@@ -0,0 +1,227 @@
+# Opt-in request profiling for staff. With REQUEST_PROFILING on, a staff
+# request carrying ?profile=1 or an X-Profile header is run under a profiler
+# (pyinstrument's sampling profiler when installed, cProfile otherwise) with
+# its SQL recorded. Each capture is written to PROFILE_DIR as a JSON summary
+# with the top functions and the SQL log, next to the raw profile, and
+# captures beyond the retention limits are deleted.
+import contextlib
+import cProfile
+import datetime
+import json
+import pstats
+import re
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+try:
+    import pyinstrument
+except ImportError:  # pyinstrument is optional; profiles are deterministic (cProfile) without it
+    pyinstrument = None
+
+PROFILE_PARAM = 'profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+# Functions listed per capture, by own time
+TOP_FUNCTIONS = 25
+
+# Statements kept in a capture's SQL log; the rest are only counted
+MAX_LOGGED_QUERIES = 1000
+
+
+def profile_dir():
+    return Path(getattr(settings, 'PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+
+
+def requested_profiler(request):
+    """
+    'sampling' or 'cprofile' when a staff request asks to be profiled and
+    profiling is enabled, else None.
+
+    ``?profile=cprofile`` (or the header with that value) forces cProfile;
+    any other value uses the sampling profiler when it is installed.
+    """
+    if not getattr(settings, 'REQUEST_PROFILING', False):
+        return None
+    value = request.GET.get(PROFILE_PARAM) or request.META.get(PROFILE_HEADER)
+    if not value or value.lower() in ('0', 'false', 'off'):
+        return None
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_staff:
+        return None
+    return 'cprofile' if pyinstrument is None or value.lower() == 'cprofile' else 'sampling'
+
+
+class SQLLog:
+    """Execute wrapper recording each statement's SQL, parameters and duration"""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.queries = []
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.time += duration
+            if len(self.queries) < MAX_LOGGED_QUERIES:
+                self.queries.append({
+                    'database': self.alias,
+                    'sql': sql,
+                    'params': None if params is None else [str(param) for param in params],
+                    'many': many,
+                    'ms': round(duration * 1000, 3),
+                })
+
+
+@contextlib.contextmanager
+def logging_sql():
+    """Record the statements run on every database inside the block; yields the SQLLogs"""
+    logs = [SQLLog(alias) for alias in connections]
+    with contextlib.ExitStack() as stack:
+        for log in logs:
+            stack.enter_context(connections[log.alias].execute_wrapper(log))
+        yield logs
+
+
+def _cprofile_top(profiler):
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({'function': name, 'file': filename, 'line': line, 'calls': calls,
+                     'own_ms': round(tottime * 1000, 3), 'total_ms': round(cumtime * 1000, 3)})
+    rows.sort(key=lambda row: row['own_ms'], reverse=True)
+    return rows[:TOP_FUNCTIONS]
+
+
+def _sampling_top(session):
+    """Own and total time per function, summed over the sampled call tree"""
+    functions = {}
+
+    def visit(frame, on_stack):
+        key = (frame.function, frame.file_path, frame.line_no)
+        row = functions.setdefault(key, {'function': frame.function, 'file': frame.file_path, 'line': frame.line_no,
+                                         'calls': None, 'own_ms': 0.0, 'total_ms': 0.0})
+        row['own_ms'] += frame.total_self_time * 1000
+        if key not in on_stack:
+            # Recursive calls are already inside the outer call's total
+            row['total_ms'] += frame.time * 1000
+        for child in frame.children:
+            visit(child, on_stack | {key})
+
+    root = session.root_frame()
+    if root is not None:
+        visit(root, frozenset())
+    rows = sorted(functions.values(), key=lambda row: row['own_ms'], reverse=True)[:TOP_FUNCTIONS]
+    for row in rows:
+        row['own_ms'], row['total_ms'] = round(row['own_ms'], 3), round(row['total_ms'], 3)
+    return rows
+
+
+def profile_request(request, get_response, profiler_name):
+    """Run the rest of the request under the profiler and save the capture; returns the response"""
+    started_at = timezone.now()
+    started = time.perf_counter()
+    with logging_sql() as logs:
+        if profiler_name == 'sampling':
+            profiler = pyinstrument.Profiler(interval=getattr(settings, 'PROFILE_SAMPLING_INTERVAL', 0.001))
+            profiler.start()
+            try:
+                response = get_response(request)
+            finally:
+                profiler.stop()
+        else:
+            profiler = cProfile.Profile()
+            response = profiler.runcall(get_response, request)
+    duration = time.perf_counter() - started
+
+    capture_id = f'{started_at:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}'
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    if profiler_name == 'sampling':
+        top = _sampling_top(profiler.last_session)
+        profile_file = f'{capture_id}.html'
+        (directory / profile_file).write_text(profiler.output_html(), encoding='utf-8')
+    else:
+        top = _cprofile_top(profiler)
+        profile_file = f'{capture_id}.prof'
+        profiler.dump_stats(directory / profile_file)
+
+    summary = {
+        'id': capture_id,
+        'captured_at': started_at.isoformat(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'user': request.user.get_username(),
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 3),
+        'profiler': profiler_name,
+        'profile_file': profile_file,
+        'query_count': sum(log.count for log in logs),
+        'query_ms': round(sum(log.time for log in logs) * 1000, 3),
+        'top_functions': top,
+        'queries': [query for log in logs for query in log.queries][:MAX_LOGGED_QUERIES],
+    }
+    (directory / f'{capture_id}.json').write_text(json.dumps(summary, indent=1), encoding='utf-8')
+    prune_profiles()
+
+    response['X-Profile-Id'] = capture_id
+    return response
+
+
+def list_profiles():
+    """Capture summaries, newest first"""
+    profiles = []
+    for path in sorted(profile_dir().glob('*.json'), reverse=True):
+        try:
+            profiles.append(json.loads(path.read_text(encoding='utf-8')))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def get_profile(capture_id):
+    """The summary of one capture, or None"""
+    if not re.fullmatch(r'\d{8}T\d{12}-[0-9a-f]{8}', capture_id):
+        return None
+    path = profile_dir() / f'{capture_id}.json'
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def prune_profiles():
+    """
+    Delete captures older than ``PROFILE_MAX_AGE`` seconds and all but the
+    newest ``PROFILE_KEEP``; returns the number deleted.
+    """
+    keep = getattr(settings, 'PROFILE_KEEP', 50)
+    max_age = getattr(settings, 'PROFILE_MAX_AGE', 7 * 86400)
+    oldest = timezone.now() - datetime.timedelta(seconds=max_age)
+
+    # Capture ids start with their UTC timestamp, so names sort by age
+    captures = sorted(profile_dir().glob('*.json'), reverse=True)
+    deleted = 0
+    for index, path in enumerate(captures):
+        try:
+            captured_at = datetime.datetime.strptime(path.stem.split('-')[0], '%Y%m%dT%H%M%S%f').replace(
+                tzinfo=datetime.timezone.utc
+            )
+        except ValueError:
+            continue
+        if index < keep and captured_at >= oldest:
+            continue
+        for capture_file in profile_dir().glob(f'{path.stem}.*'):
+            capture_file.unlink(missing_ok=True)
+        deleted += 1
+    return deleted
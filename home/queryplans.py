@@ -0,0 +1,344 @@
+# Query plan inspection. The queries behind the hot views and API endpoints
+# are captured by requesting them in-process, inside a transaction that is
+# rolled back, and each SELECT is run through the database's EXPLAIN. Full
+# table scans and temporary sorts are flagged, with an index proposed where
+# the query filters or orders on columns no index leads with. _hot_queries()
+# pins the index each known hot query must use, for explain_queries --check.
+import datetime
+import re
+import uuid
+from dataclasses import dataclass, field
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+from django.test import Client
+from django.test.utils import override_settings
+
+from .models import (
+    CostLayer, LedgerChange, LocationBalance, MonthlyMovement, ProductMaster, Reservation, StockDetail, StockMain,
+)
+
+# (name, path) of the endpoints whose queries are inspected; {product},
+# {sku} and {transaction} are filled in from existing rows
+HOT_ENDPOINTS = [
+    ('dashboard', '/'),
+    ('product list', '/products/'),
+    ('transaction list', '/transactions/'),
+    ('transaction list, OUT', '/transactions/?type=OUT'),
+    ('transaction list, by product', '/transactions/?product={sku}'),
+    ('transaction detail', '/transactions/{transaction}/'),
+    ('inventory report', '/inventory/'),
+    ('product stock', '/api/product-stock/{product}/'),
+    ('API product lookup', '/api/products/lookup/{sku}/'),
+    ('API transactions', '/api/transactions/?fields=id,date,type&type=OUT'),
+    ('API transaction lines', '/api/transaction-details/?transaction__type=OUT&product={product}'),
+    ('API low stock', '/api/inventory/low_stock/'),
+    ('API monthly movements', '/api/inventory/movements/?product={sku}'),
+    ('API changes', '/api/changes/?limit=100'),
+]
+
+
+def _hot_queries():
+    """
+    (name, queryset, table, columns) per known hot query; its plan must use
+    an index on ``table`` leading with ``columns``.
+    """
+    return [
+        ('transactions by date', StockMain.objects.order_by('-date')[:50], 'stckmain', ['date']),
+        ('transactions by type and date', StockMain.objects.filter(type='OUT').order_by('-date')[:50],
+         'stckmain', ['type', 'date']),
+        ('lines of a transaction', StockDetail.objects.filter(transaction_id=1), 'stckdetail', ['transaction_id']),
+        ('lines of a product', StockDetail.objects.filter(product_id=1).order_by(), 'stckdetail', ['product_id']),
+        ('stock by product and type', StockDetail.objects.filter(product_id__in=[1, 2]).values('product_id').annotate(
+            stock_in=Sum('quantity', filter=Q(transaction__type='IN')),
+            stock_out=Sum('quantity', filter=Q(transaction__type='OUT')),
+        ).order_by(), 'stckdetail', ['product_id']),
+        ('open cost layers', CostLayer.objects.filter(product_id=1, remaining__gt=0),
+         CostLayer._meta.db_table, ['product_id', 'remaining']),
+        ('changes after a cursor', LedgerChange.objects.filter(id__gt=1).order_by('id')[:500],
+         LedgerChange._meta.db_table, ['id']),
+        ('monthly movements of a range', MonthlyMovement.objects.filter(month__range=('2025-01-01', '2025-12-01')),
+         MonthlyMovement._meta.db_table, ['month']),
+        ('stock at a location', LocationBalance.objects.filter(location_id=1).exclude(quantity=0).order_by('product_id'),
+         LocationBalance._meta.db_table, ['location_id']),
+        ('available to promise', ProductMaster.objects.filter(pk__in=[1, 2]).with_available_to_promise(),
+         Reservation._meta.db_table, ['product_id']),
+        ('expired reservations', Reservation.objects.filter(
+            expires_at__lte=datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+        ).order_by('expires_at')[:1000], Reservation._meta.db_table, ['expires_at']),
+    ]
+
+
+@dataclass
+class PlanStep:
+    table: str
+    index: str = None
+    full_scan: bool = False
+    temp_sort: bool = False
+    detail: str = ''
+
+
+@dataclass
+class Finding:
+    endpoint: str
+    sql: str
+    steps: list
+    runs: int = 1
+    proposals: list = field(default_factory=list)
+
+    @property
+    def problems(self):
+        return [step for step in self.steps if step.full_scan or step.temp_sort]
+
+
+class PlanUnavailable(Exception):
+    """Raised for a database whose plans cannot be read"""
+
+
+def explain(sql, params=None):
+    """The plan of one query as PlanSteps; SQLite and MySQL/MariaDB are supported"""
+    if connection.vendor == 'sqlite':
+        return _explain_sqlite(sql, params)
+    if connection.vendor == 'mysql':
+        return _explain_mysql(sql, params)
+    raise PlanUnavailable(f'Query plans are not supported on {connection.vendor}.')
+
+
+def explain_queryset(queryset):
+    return explain(*queryset.query.sql_with_params())
+
+
+def _aliases(sql):
+    """{alias or table name: table} for the tables the query reads"""
+    quote = connection.ops.quote_name('x')[0]
+    tables = set(connection.introspection.table_names())
+    pattern = rf'(?:FROM|JOIN)\s+{quote}(\w+){quote}(?:\s+(?:AS\s+)?{quote}?(\w+){quote}?)?'
+    aliases = {}
+    for table, alias in re.findall(pattern, sql, flags=re.IGNORECASE):
+        if table in tables:
+            aliases[table] = table
+            if alias and alias.upper() not in ('ON', 'WHERE', 'INNER', 'LEFT', 'GROUP', 'ORDER', 'LIMIT'):
+                aliases[alias] = table
+    return aliases
+
+
+def _explain_sqlite(sql, params):
+    aliases = _aliases(sql)
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        details = [row[-1] for row in cursor.fetchall()]
+
+    steps, current = [], None
+    for detail in details:
+        match = re.match(r'(SCAN|SEARCH) (\S+)(?: USING (?:COVERING )?INDEX (\S+)| USING (INTEGER PRIMARY KEY))?', detail)
+        if match:
+            kind, name, index, rowid = match.groups()
+            if name in aliases:
+                current = PlanStep(aliases[name], index=index or rowid,
+                                   full_scan=kind == 'SCAN' and not (index or rowid), detail=detail)
+                steps.append(current)
+        elif detail.startswith('USE TEMP B-TREE'):
+            if current is None:
+                current = PlanStep('')
+                steps.append(current)
+            current.temp_sort = True
+            current.detail = f'{current.detail}; {detail}'.lstrip('; ')
+    return steps
+
+
+def _explain_mysql(sql, params):
+    aliases = _aliases(sql)
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN {sql}', params)
+        columns = [column[0].lower() for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    steps = []
+    for row in rows:
+        extra = row.get('extra') or ''
+        table = aliases.get(row.get('table'))
+        if table is None and 'Using temporary' not in extra and 'Using filesort' not in extra:
+            continue
+        steps.append(PlanStep(
+            table or '', index=row.get('key'), full_scan=table is not None and row.get('type') == 'ALL',
+            temp_sort='Using temporary' in extra or 'Using filesort' in extra,
+            detail=f"type={row.get('type')} key={row.get('key')} {extra}".strip(),
+        ))
+    return steps
+
+
+def _clause(sql, keyword, ends):
+    """Text of the outermost ``keyword`` clause, up to the next of ``ends``"""
+    start = sql.rfind(f' {keyword} ')
+    if start < 0:
+        return ''
+    clause = sql[start + len(keyword) + 2:]
+    for end in ends:
+        position = clause.find(f' {end} ')
+        if position >= 0:
+            clause = clause[:position]
+    return clause
+
+
+def _columns(clause, table, aliases):
+    quote = connection.ops.quote_name('x')[0]
+    names = [name for name, real in aliases.items() if real == table]
+    columns = []
+    for name, column in re.findall(rf'{quote}?(\w+){quote}?\.{quote}(\w+){quote}', clause):
+        if name in names and column not in columns:
+            columns.append(column)
+    return columns
+
+
+def _indexed_prefixes(table):
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    return [constraint['columns'] for constraint in constraints.values()
+            if constraint['index'] or constraint['primary_key'] or constraint['unique']]
+
+
+def propose_indexes(sql, steps):
+    """
+    Index proposals for the flagged steps of a plan, as (model, field names).
+
+    A full scan proposes the columns the query filters the table on, a
+    temporary sort those it orders by; nothing is proposed when an index
+    already leads with them.
+    """
+    aliases = _aliases(sql)
+    where = _clause(sql, 'WHERE', ('GROUP BY', 'ORDER BY', 'LIMIT'))
+    order_by = _clause(sql, 'ORDER BY', ('LIMIT',))
+    models = {model._meta.db_table: model for model in apps.get_app_config('home').get_models()}
+
+    proposals = []
+    for step in steps:
+        model = models.get(step.table)
+        if model is None:
+            continue
+        columns = []
+        if step.full_scan:
+            columns += _columns(where, step.table, aliases)
+        if step.temp_sort:
+            columns += [column for column in _columns(order_by, step.table, aliases) if column not in columns]
+        if not columns:
+            continue
+        if any(indexed[:len(columns)] == columns for indexed in _indexed_prefixes(step.table)):
+            continue
+        by_column = {model_field.column: model_field.name for model_field in model._meta.concrete_fields}
+        proposal = (model._meta.model_name, [by_column.get(column, column) for column in columns])
+        if proposal not in proposals:
+            proposals.append(proposal)
+    return proposals
+
+
+def index_operation(model_name, fields):
+    """AddIndex migration operation source for a proposal"""
+    table = apps.get_model('home', model_name)._meta.db_table
+    name = f"{table}_{'_'.join(fields)}"[:26] + '_idx'
+    return f"migrations.AddIndex(model_name='{model_name}', index=models.Index(fields={fields!r}, name='{name}'))"
+
+
+def _placeholders():
+    product = ProductMaster.objects.order_by('pk').values_list('pk', 'sku').first()
+    transaction_id = StockMain.objects.order_by('-pk').values_list('pk', flat=True).first()
+    values = {'transaction': transaction_id}
+    if product is not None:
+        values.update(product=product[0], sku=product[1])
+    return values
+
+
+def capture_endpoint_queries(endpoints=HOT_ENDPOINTS):
+    """
+    {endpoint name: [(sql, params, times run)]} of the SELECTs each
+    endpoint runs, once per distinct statement.
+
+    Requests are made in-process by a temporary superuser, with fresh
+    caches and no rate limits, inside a transaction that is rolled back.
+    Endpoints needing rows the database lacks are skipped.
+    """
+    from django.conf import settings
+
+    location = f'explain-{uuid.uuid4().hex}'
+    overrides = {
+        'CACHES': {alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'{location}-{alias}'}
+                   for alias in settings.CACHES},
+        'REST_FRAMEWORK': {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}},
+        'API_CONCURRENCY_LIMITS': {},
+    }
+    captured = {}
+    with override_settings(**overrides), transaction.atomic():
+        values = _placeholders()
+        user = User(username=f'explain-{uuid.uuid4().hex[:8]}', is_staff=True, is_superuser=True)
+        user.set_unusable_password()
+        user.save()
+        client = Client()
+        client.force_login(user)
+
+        for name, path in endpoints:
+            try:
+                url = path.format(**values)
+            except KeyError:
+                continue
+            if 'None' in url:
+                continue
+            statements = {}
+
+            def record(execute, sql, params, many, context):
+                if sql.lstrip().upper().startswith('SELECT') and 'django_session' not in sql:
+                    statements.setdefault(sql, [sql, params, 0])[2] += 1
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(record):
+                client.get(url, HTTP_HOST='localhost')
+            captured[name] = list(statements.values())
+        transaction.set_rollback(True)
+    return captured
+
+
+def inspect_endpoints(endpoints=HOT_ENDPOINTS):
+    """Findings for every captured query, flagged or not"""
+    findings = []
+    for name, statements in capture_endpoint_queries(endpoints).items():
+        for sql, params, runs in statements:
+            steps = explain(sql, params)
+            finding = Finding(name, sql, steps, runs)
+            if finding.problems:
+                finding.proposals = propose_indexes(sql, finding.problems)
+            findings.append(finding)
+    return findings
+
+
+def _sqlite_autoindexes(table):
+    """{name: columns} of the indexes SQLite creates for inline UNIQUE constraints, which introspection names after the constraint"""
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA index_list({quote(table)})')
+        names = [row[1] for row in cursor.fetchall() if row[1].startswith('sqlite_autoindex_')]
+        indexes = {}
+        for name in names:
+            cursor.execute(f'PRAGMA index_info({quote(name)})')
+            indexes[name] = [row[2] for row in sorted(cursor.fetchall())]
+    return indexes
+
+
+def check_hot_queries():
+    """(name, table, columns, plan steps) of each hot query whose plan uses no index leading with its columns"""
+    failures = []
+    for name, queryset, table, columns in _hot_queries():
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+        # SQLite names the rowid lookup rather than the primary key
+        indexes = {'INTEGER PRIMARY KEY'} if columns == ['id'] else set()
+        indexes.update(
+            index for index, constraint in constraints.items()
+            if constraint['columns'][:len(columns)] == columns
+            and (constraint['index'] or constraint['primary_key'] or constraint['unique'])
+        )
+        if connection.vendor == 'sqlite':
+            indexes.update(index for index, indexed in _sqlite_autoindexes(table).items() if indexed[:len(columns)] == columns)
+        steps = explain_queryset(queryset)
+        if not any(step.table == table and step.index in indexes for step in steps):
+            failures.append((name, table, columns, steps))
+    return failures
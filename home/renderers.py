@@ -0,0 +1,85 @@
+import msgpack
+import orjson
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+
+def to_columns(data):
+    """
+    Turn a list of row dicts into {"count": n, "columns": {field: [values]}}.
+
+    Paginated payloads have their ``results`` converted in place; anything
+    that is not a list of dicts (single objects, errors) is returned as is.
+    """
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return {**data, 'results': to_columns(data['results'])}
+    if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+        return data
+
+    names = list(data[0]) if data else []
+    return {
+        'count': len(data),
+        'columns': {name: [row.get(name) for row in data] for name in names},
+    }
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson.
+
+    For the default compact, unicode output the bytes match JSONRenderer:
+    types orjson would format differently (dates, times, decimals, lazy
+    strings) are passed through DRF's encoder. Indented or ASCII-only output,
+    and anything orjson cannot encode, falls back to the stdlib encoder.
+    """
+    orjson_options = (
+        orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+        | orjson.OPT_NON_STR_KEYS
+    )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.orjson_options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Match JSONRenderer's escaping of the JavaScript line terminators
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class ColumnarJSONRenderer(FastJSONRenderer):
+    """
+    JSON with one array per field instead of one object per row.
+
+    Field names are sent once rather than once per row, which makes large
+    list payloads smaller and lets clients load each column directly.
+    """
+    media_type = 'application/vnd.columnar+json'
+    format = 'columnar'
+    compressible = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(to_columns(data), accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Renders responses as MessagePack"""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    compressible = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # Dates, decimals and lazy strings are encoded the same way as in JSON output
+        return msgpack.packb(data, use_bin_type=True, default=encoders.JSONEncoder().default)
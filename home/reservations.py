@@ -0,0 +1,112 @@
+# Stock reservations. A sales order holds stock with a Reservation until it
+# ships or the hold expires; available to promise (ATP) is the on-hand stock
+# less the active holds, read with one grouped query over the maintained
+# balances. Expired rows no longer count and are deleted in batches by the
+# sweep_reservations command, so the table stays the size of the open holds.
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ProductMaster, Reservation, StockBalance
+
+# Reservations deleted per statement by a sweep
+SWEEP_BATCH_SIZE = 1000
+
+
+class ReservationError(Exception):
+    """Raised when stock cannot be reserved; ``shortages`` lists the products short"""
+
+    def __init__(self, message, shortages=()):
+        super().__init__(message)
+        self.shortages = list(shortages)
+
+
+def default_expiry():
+    return timezone.now() + datetime.timedelta(seconds=getattr(settings, 'RESERVATION_TTL', 86400))
+
+
+def available_to_promise(product_ids, exclude_reference=None):
+    """
+    {product id: (on hand, reserved, available)} for ``product_ids``, in one
+    grouped query. Holds for ``exclude_reference`` are not counted, so an
+    issue shipping an order may use the stock held for it.
+    """
+    rows = ProductMaster.objects.filter(pk__in=product_ids).with_available_to_promise(
+        exclude_reference=exclude_reference
+    ).order_by().values_list('pk', 'current_stock', 'reserved', 'available')
+    figures = {product_id: (0, 0, 0) for product_id in product_ids}
+    figures.update((product_id, (on_hand, reserved, available)) for product_id, on_hand, reserved, available in rows)
+    return figures
+
+
+def atp_shortages(quantities, exclude_reference=None):
+    """
+    Products of ``quantities`` (product id to quantity) with too little
+    stock to promise, as {'product', 'sku', 'quantity', 'available'} rows.
+    """
+    figures = available_to_promise(list(quantities), exclude_reference)
+    short = {product_id: quantity for product_id, quantity in quantities.items() if quantity > figures[product_id][2]}
+    if not short:
+        return []
+    skus = dict(ProductMaster.objects.filter(pk__in=short).values_list('pk', 'sku'))
+    return [
+        {'product': product_id, 'sku': skus.get(product_id), 'quantity': quantity, 'available': figures[product_id][2]}
+        for product_id, quantity in short.items()
+    ]
+
+
+def lock_balances(product_ids):
+    """Lock the balance rows of ``product_ids`` until the transaction ends, serializing stock checks"""
+    list(StockBalance.objects.select_for_update().filter(product_id__in=product_ids).values_list('pk'))
+
+
+def reserve(quantities, expires_at=None, reference=''):
+    """
+    Hold stock of several products for one order; returns the Reservations.
+
+    The products' balance rows are locked first, so concurrent holds are
+    checked one after the other and cannot promise the same stock twice; a
+    shortage raises ReservationError listing every product short.
+    """
+    expires_at = expires_at or default_expiry()
+    with transaction.atomic():
+        lock_balances(quantities)
+        shortages = atp_shortages(quantities)
+        if shortages:
+            raise ReservationError("Not enough stock available to promise.", shortages)
+        return Reservation.objects.bulk_create([
+            Reservation(product_id=product_id, quantity=quantity, reference=reference or '', expires_at=expires_at)
+            for product_id, quantity in quantities.items()
+        ])
+
+
+def release(reference, product_ids=None):
+    """Delete the holds of an order, or only those of ``product_ids``; returns the number deleted"""
+    holds = Reservation.objects.filter(reference=reference)
+    if product_ids is not None:
+        holds = holds.filter(product_id__in=product_ids)
+    return holds.delete()[0]
+
+
+def active_reservations(now=None):
+    return Reservation.objects.filter(expires_at__gt=now or timezone.now())
+
+
+def sweep_expired_reservations(batch_size=SWEEP_BATCH_SIZE, now=None):
+    """
+    Delete expired reservations ``batch_size`` at a time, oldest first;
+    returns the number deleted.
+
+    Each batch is a range of the expiry index and its own short
+    transaction, so a large backlog never holds long locks.
+    """
+    now = now or timezone.now()
+    deleted = 0
+    while True:
+        batch = list(Reservation.objects.filter(expires_at__lte=now).order_by('expires_at')
+                     .values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        deleted += Reservation.objects.filter(pk__in=batch).delete()[0]
@@ -0,0 +1,155 @@
+# The OpenAPI schema is generated once, by the generate_schema command at
+# deploy time, and served as a static artifact with an ETag. drf_yasg is
+# only imported when a schema has to be generated or a docs page rendered,
+# which keeps it out of worker start-up.
+import functools
+import hashlib
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import condition, require_GET
+
+SCHEMA_FORMATS = {
+    'json': 'application/openapi+json; charset=utf-8',
+    'yaml': 'application/yaml; charset=utf-8',
+}
+
+# ?format= values understood by the schema endpoints, as drf_yasg names them
+FORMAT_ALIASES = {'openapi': 'json', '.json': 'json', 'json': 'json', '.yaml': 'yaml', 'yaml': 'yaml'}
+
+DESCRIPTION = """
+        Warehouse Inventory Management System API
+
+        This API provides endpoints for managing warehouse inventory including:
+        - Product management (CRUD operations)
+        - Stock transaction recording (IN/OUT)
+        - Inventory reporting and analytics
+        - Stock level monitoring
+
+        ## Features:
+        - Create and manage products with unique SKUs
+        - Record stock movements (IN for receiving, OUT for shipping/sales)
+        - Real-time inventory tracking
+        - Low stock alerts
+        - Comprehensive transaction history
+
+        ## Validation:
+        - SKU uniqueness validation
+        - Stock availability validation for OUT transactions
+        - Positive quantity validation
+        - Required field validation
+        """
+
+
+def schema_dir():
+    return Path(getattr(settings, 'API_SCHEMA_DIR', settings.BASE_DIR / 'schema'))
+
+
+def schema_path(schema_format):
+    return schema_dir() / f'openapi.{schema_format}'
+
+
+@functools.lru_cache(maxsize=None)
+def api_info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
+        title="Warehouse Inventory API",
+        default_version='v1',
+        description=DESCRIPTION,
+        terms_of_service="https://www.example.com/policies/terms/",
+        contact=openapi.Contact(email="contact@warehouse.local"),
+        license=openapi.License(name="MIT License"),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_schema_view():
+    """drf_yasg SchemaView class for this API, built on first use"""
+    from drf_yasg.views import get_schema_view as yasg_schema_view
+    from rest_framework import permissions
+
+    return yasg_schema_view(api_info(), public=True, permission_classes=(permissions.AllowAny,))
+
+
+def generate_schema():
+    """Introspect the whole API once and return {format: encoded schema bytes}"""
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+
+    schema = get_schema_view().generator_class(api_info()).get_schema(request=None, public=True)
+    return {
+        'json': OpenAPICodecJson(validators=[]).encode(schema),
+        'yaml': OpenAPICodecYaml(validators=[]).encode(schema),
+    }
+
+
+def write_schema():
+    """Generate the schema artifacts; returns the paths written"""
+    schema_dir().mkdir(parents=True, exist_ok=True)
+    paths = []
+    for schema_format, content in generate_schema().items():
+        path = schema_path(schema_format)
+        path.write_bytes(content)
+        paths.append(path)
+    return paths
+
+
+@functools.lru_cache(maxsize=None)
+def load_schema():
+    """
+    {format: (content, etag)} for this process, read once.
+
+    Reads the artifacts written by generate_schema and falls back to
+    generating them in memory when they are missing, e.g. in development.
+    """
+    try:
+        artifacts = {schema_format: schema_path(schema_format).read_bytes() for schema_format in SCHEMA_FORMATS}
+    except FileNotFoundError:
+        artifacts = generate_schema()
+    return {
+        schema_format: (content, '"%s"' % hashlib.sha256(content).hexdigest()[:32])
+        for schema_format, content in artifacts.items()
+    }
+
+
+def requested_format(request):
+    """Schema format asked for with ?format= or the Accept header; YAML by default, as before"""
+    schema_format = FORMAT_ALIASES.get(request.GET.get('format', ''))
+    if schema_format is None and 'json' in request.META.get('HTTP_ACCEPT', ''):
+        schema_format = 'json'
+    return schema_format or 'yaml'
+
+
+def _schema_etag(request, *args, **kwargs):
+    return load_schema()[requested_format(request)][1]
+
+
+@require_GET
+@condition(etag_func=_schema_etag)
+def schema(request):
+    """The cached OpenAPI schema; conditional requests get 304 Not Modified"""
+    schema_format = requested_format(request)
+    response = HttpResponse(load_schema()[schema_format][0], content_type=SCHEMA_FORMATS[schema_format])
+    # Clients may keep it but must revalidate, which costs a 304
+    response['Cache-Control'] = 'no-cache'
+    response['Vary'] = 'Accept'
+    return response
+
+
+def docs_view(renderer):
+    """Swagger UI / ReDoc page; the spec it fetches with ?format=openapi is the cached one"""
+
+    @require_GET
+    def docs(request):
+        if request.GET.get('format') in FORMAT_ALIASES:
+            return schema(request)
+        # The page itself needs no introspection: drf_yasg renders it from an empty schema
+        return get_ui_view(renderer)(request)
+
+    return docs
+
+
+@functools.lru_cache(maxsize=None)
+def get_ui_view(renderer):
+    return get_schema_view().with_ui(renderer, cache_timeout=0)
@@ -1,50 +1,93 @@
+import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from rest_framework import serializers
-from .models import ProductMaster, StockMain, StockDetail
+from .caching import product_cache
+from .ledger import post_transaction
+from .models import ProductMaster, Location, StockMain, StockDetail, CountSession, Reservation, normalize_sku, sku_format_error
+from .locations import location_quantities
+from .movements import MAX_REPORT_MONTHS, add_months, month_of
+from .reservations import available_to_promise, lock_balances, release
+
+class SparseFieldsMixin:
+    """Serializer taking ``fields=`` (a collection of names) to emit only those fields"""
+    
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
-class ProductMasterSerializer(serializers.ModelSerializer):
+class ProductMasterSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     current_stock = serializers.ReadOnlyField(source='get_current_stock')
     
     class Meta:
         model = ProductMaster
         fields = ['id', 'name', 'description', 'sku', 'current_stock', 'created_at', 'updated_at']
         read_only_fields = ['created_at', 'updated_at', 'current_stock']
+        # SKU uniqueness is enforced by the database index, not a pre-check query
+        extra_kwargs = {'sku': {'validators': []}}
     
     def validate_sku(self, value):
-        """Ensure SKU is unique"""
+        """Normalize the SKU and validate its format"""
         # Convert to uppercase for consistency
-        value = value.upper().strip()
-        
-        # Check for existing SKU, excluding current instance if updating
-        queryset = ProductMaster.objects.filter(sku=value)
-        if self.instance:
-            queryset = queryset.exclude(pk=self.instance.pk)
-        
-        if queryset.exists():
-            raise serializers.ValidationError("A product with this SKU already exists.")
+        value = normalize_sku(value)
         
         # Validate SKU format
-        import re
-        if not re.match(r'^[A-Z0-9\-]+$', value):
-            raise serializers.ValidationError("SKU can only contain uppercase letters, numbers, and hyphens.")
-        
-        if len(value) < 3:
-            raise serializers.ValidationError("SKU must be at least 3 characters long.")
+        error = sku_format_error(value)
+        if error:
+            raise serializers.ValidationError(error)
         
         return value
 
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError({'sku': ["A product with this SKU already exists."]})
+
+    def update(self, instance, validated_data):
+        try:
+            with transaction.atomic():
+                return super().update(instance, validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError({'sku': ["A product with this SKU already exists."]})
+
     def validate_name(self, value):
         """Validate product name"""
         if len(value.strip()) < 2:
             raise serializers.ValidationError("Product name must be at least 2 characters long.")
         return value.strip()
 
-class StockDetailSerializer(serializers.ModelSerializer):
+class CachedProductField(serializers.PrimaryKeyRelatedField):
+    """Product by id, resolved through the product cache"""
+    
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        product = product_cache.get(pk)
+        if product is None:
+            self.fail('does_not_exist', pk_value=data)
+        return product
+
+class StockDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    product = CachedProductField(queryset=ProductMaster.objects.all())
     product_name = serializers.ReadOnlyField(source='product.name')
     product_sku = serializers.ReadOnlyField(source='product.sku')
+    location = serializers.SlugRelatedField(slug_field='code', queryset=Location.objects.all(), required=False, allow_null=True)
     
     class Meta:
         model = StockDetail
-        fields = ['id', 'product', 'product_name', 'product_sku', 'quantity']
+        fields = ['id', 'product', 'product_name', 'product_sku', 'location', 'quantity', 'unit_cost', 'fifo_amount',
+                  'average_amount']
     
     def validate_quantity(self, value):
         """Ensure quantity is positive and within reasonable limits"""
@@ -54,8 +97,14 @@ class StockDetailSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Quantity cannot exceed 10,000 units.")
         return value
     
+    def validate_unit_cost(self, value):
+        """Ensure unit cost is not negative"""
+        if value is not None and value < 0:
+            raise serializers.ValidationError("Unit cost cannot be negative.")
+        return value
+    
     def validate(self, data):
-        """Validate stock out doesn't exceed available stock"""
+        """Validate stock out doesn't exceed the stock available to promise, at the line's location too"""
         if hasattr(self, 'instance') and self.instance:
             # This is an update - get transaction from instance
             transaction = self.instance.transaction
@@ -63,35 +112,54 @@ class StockDetailSerializer(serializers.ModelSerializer):
             # This is creation - transaction should be provided in context
             transaction = self.context.get('transaction')
         
+        if transaction and transaction.type == 'OUT' and data.get('unit_cost') is not None:
+            raise serializers.ValidationError({'unit_cost': ["Unit cost only applies to stock in; issues are costed from the cost layers."]})
+        
         if transaction and transaction.type == 'OUT':
             product = data.get('product')
             quantity = data.get('quantity')
+            location = data.get('location')
             
             if product and quantity:
-                current_stock = product.get_current_stock()
-                if quantity > current_stock:
+                # A transaction passes the figures of all its lines, read once; a lone line reads its own
+                available = self.context.get('available')
+                if available is None:
+                    available = {product.pk: available_to_promise([product.pk], self.context.get('reservation'))[product.pk][2]}
+                if quantity > available.get(product.pk, 0):
                     raise serializers.ValidationError(
-                        f"Cannot remove {quantity} {product.name}. Only {current_stock} available in stock."
+                        f"Cannot remove {quantity} {product.name}. Only {available.get(product.pk, 0)} available to promise."
                     )
+                if location:
+                    at_locations = self.context.get('location_available')
+                    if at_locations is None:
+                        at_locations = location_quantities([(location.pk, product.pk)])
+                    at_location = at_locations.get((location.pk, product.pk), 0)
+                    if quantity > at_location:
+                        raise serializers.ValidationError(
+                            f"Cannot remove {quantity} {product.name}. Only {at_location} available at {location.code}."
+                        )
         
         return data
 
-class StockMainSerializer(serializers.ModelSerializer):
+class StockMainSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     details = StockDetailSerializer(many=True, read_only=True)
     total_items = serializers.ReadOnlyField(source='get_total_items')
+    to_location = serializers.SlugRelatedField(slug_field='code', read_only=True)
     
     class Meta:
         model = StockMain
-        fields = ['id', 'date', 'type', 'remarks', 'total_items', 'details', 'created_at']
-        read_only_fields = ['created_at', 'total_items', 'details']
+        fields = ['id', 'date', 'type', 'remarks', 'total_items', 'details', 'reversal_of', 'to_location', 'created_at']
+        read_only_fields = ['created_at', 'total_items', 'details', 'reversal_of', 'to_location']
 
 class StockTransactionCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating transactions with details"""
     details = StockDetailSerializer(many=True)
+    # Reference of the reservations an issue ships: their stock may be used, and they are released
+    reservation = serializers.CharField(max_length=100, required=False, allow_blank=True, write_only=True)
     
     class Meta:
         model = StockMain
-        fields = ['type', 'remarks', 'details']
+        fields = ['type', 'remarks', 'details', 'reservation']
     
     def validate_details(self, value):
         """Ensure at least one product detail is provided and no duplicates"""
@@ -111,18 +179,100 @@ class StockTransactionCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Transaction type must be either 'IN' or 'OUT'.")
         return value
     
+    def stock_context(self, details, reservation=None):
+        """Stock available to promise and at the lines' locations for all lines of an issue, in two queries"""
+        product_ids = [detail['product'].pk for detail in details]
+        return {
+            'available': {product_id: figures[2] for product_id, figures in available_to_promise(product_ids, reservation).items()},
+            'location_available': location_quantities(
+                (detail['location'].pk, detail['product'].pk) for detail in details if detail.get('location')
+            ),
+        }
+    
     def create(self, validated_data):
         details_data = validated_data.pop('details')
-        stock_main = StockMain.objects.create(**validated_data)
-        
-        for detail_data in details_data:
-            # Add transaction context for validation
-            detail_serializer = StockDetailSerializer(data=detail_data, context={'transaction': stock_main})
-            if detail_serializer.is_valid(raise_exception=True):
-                detail_serializer.save(transaction=stock_main)
+        reservation = validated_data.pop('reservation', None)
+        transaction_type = validated_data['type']
+        with transaction.atomic():
+            context = {'transaction': StockMain(type=transaction_type)}
+            if transaction_type == 'OUT':
+                lock_balances([detail['product'].pk for detail in details_data])
+                context.update(self.stock_context(details_data, reservation))
+            
+            # Check the validated lines against the transaction and the figures read above, without a query per line
+            line_serializer = StockDetailSerializer(context=context)
+            for detail_data in details_data:
+                try:
+                    line_serializer.validate(detail_data)
+                except serializers.ValidationError as error:
+                    raise serializers.ValidationError(serializers.as_serializer_error(error))
+            
+            # The lines are inserted in bulk and the balances moved by deltas
+            stock_main = post_transaction(
+                transaction_type,
+                {detail['product'].pk: detail['quantity'] for detail in details_data},
+                remarks=validated_data.get('remarks'),
+                locations={detail['product'].pk: detail['location'].pk for detail in details_data if detail.get('location')},
+                unit_costs={detail['product'].pk: detail['unit_cost'] for detail in details_data
+                            if detail.get('unit_cost') is not None},
+            )
+            
+            if transaction_type == 'OUT' and reservation:
+                # The shipped order's holds are fulfilled
+                release(reservation, [detail['product'].pk for detail in details_data])
         
         return stock_main
 
+class TransferLineSerializer(serializers.Serializer):
+    """One product moved by a transfer"""
+    product = CachedProductField(queryset=ProductMaster.objects.all())
+    quantity = serializers.IntegerField(min_value=1, max_value=10000)
+
+class TransferSerializer(serializers.Serializer):
+    """A transfer of several products between two locations, by location code"""
+    from_location = serializers.SlugRelatedField(slug_field='code', queryset=Location.objects.all())
+    to_location = serializers.SlugRelatedField(slug_field='code', queryset=Location.objects.all())
+    remarks = serializers.CharField(required=False, allow_blank=True, allow_null=True, default=None)
+    details = TransferLineSerializer(many=True)
+    
+    def validate_details(self, value):
+        if not value:
+            raise serializers.ValidationError("At least one product must be included in the transfer.")
+        product_ids = [detail['product'].pk for detail in value]
+        if len(product_ids) != len(set(product_ids)):
+            raise serializers.ValidationError("Each product can only appear once per transfer.")
+        return value
+    
+    def validate(self, data):
+        if data['from_location'] == data['to_location']:
+            raise serializers.ValidationError({'to_location': ["Choose a location other than the source."]})
+        return data
+
+class LocationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Location
+        fields = ['id', 'code', 'name', 'created_at']
+        read_only_fields = ['created_at']
+    
+    def validate_code(self, value):
+        return value.strip().upper()
+
+class ReservationSerializer(serializers.ModelSerializer):
+    product = CachedProductField(queryset=ProductMaster.objects.all())
+    product_sku = serializers.ReadOnlyField(source='product.sku')
+    quantity = serializers.IntegerField(min_value=1, max_value=10000)
+    expires_at = serializers.DateTimeField(required=False)
+    
+    class Meta:
+        model = Reservation
+        fields = ['id', 'product', 'product_sku', 'quantity', 'reference', 'expires_at', 'created_at']
+        read_only_fields = ['created_at']
+    
+    def validate_expires_at(self, value):
+        if value <= timezone.now():
+            raise serializers.ValidationError("The expiry must be in the future.")
+        return value
+
 class InventoryReportSerializer(serializers.Serializer):
     """Serializer for inventory report data"""
     product_id = serializers.IntegerField()
@@ -132,3 +282,294 @@ class InventoryReportSerializer(serializers.Serializer):
     current_stock = serializers.IntegerField()
     status = serializers.CharField()
     created_at = serializers.DateTimeField()
+
+def inventory_status(current_stock):
+    """Stock status label used by the full inventory report"""
+    return 'Low Stock' if current_stock <= 5 else 'In Stock' if current_stock > 0 else 'Out of Stock'
+
+def low_stock_status(current_stock):
+    """Stock status label used by the low stock report"""
+    return 'Low Stock' if current_stock > 0 else 'Out of Stock'
+
+def out_of_stock_status(current_stock):
+    """Stock status label used by the out of stock report"""
+    return 'Out of Stock'
+
+def _nullable(to_representation):
+    """Wrap a field converter so None passes through, as DRF serializers do"""
+    return lambda value: None if value is None else to_representation(value)
+
+def datetime_converter():
+    """
+    Converter matching serializers.DateTimeField output in the active timezone.
+
+    The timezone is resolved once per response rather than once per value,
+    which is where most of DateTimeField's per-row cost goes.
+    """
+    field_timezone = timezone.get_current_timezone() if settings.USE_TZ else None
+
+    def convert(value):
+        if value is None:
+            return None
+        if field_timezone is not None:
+            if value.utcoffset() is None:
+                value = timezone.make_aware(value, field_timezone)
+            else:
+                value = value.astimezone(field_timezone)
+        elif value.utcoffset() is not None:
+            value = timezone.make_naive(value, datetime.timezone.utc)
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+    return convert
+
+class ValuesSerializer:
+    """
+    Read-only fast path for large list responses.
+
+    Rows are fetched with values_list() and turned straight into output dicts,
+    skipping model instances and per-row DRF field objects. get_fields()
+    returns (output name, queryset lookup, converter) tuples; the converters
+    reproduce what the equivalent ModelSerializer would emit, so the rendered
+    JSON is identical.
+    """
+
+    def __init__(self, queryset, fields=None):
+        self.queryset = queryset
+        self.only_fields = fields
+
+    def get_fields(self):
+        raise NotImplementedError('ValuesSerializer subclasses must implement get_fields()')
+
+    def get_output_fields(self):
+        """get_fields() narrowed to the names passed as ``fields``, if any"""
+        fields = self.get_fields()
+        if self.only_fields is None:
+            return fields
+        return tuple(field for field in fields if field[0] in self.only_fields)
+
+    def get_lookups(self, fields):
+        return list(dict.fromkeys(lookup for _, lookup, _ in fields))
+
+    def rows(self):
+        """values_list() queryset holding one column per distinct lookup"""
+        return self.queryset.values_list(*self.get_lookups(self.get_output_fields()))
+
+    def to_representation(self, rows):
+        fields = self.get_output_fields()
+        lookups = self.get_lookups(fields)
+        plan = [(name, lookups.index(lookup), converter) for name, lookup, converter in fields]
+        return [
+            {name: converter(row[index]) if converter else row[index] for name, index, converter in plan}
+            for row in rows
+        ]
+
+    @property
+    def data(self):
+        return self.to_representation(self.rows())
+
+class ProductMasterValuesSerializer(ValuesSerializer):
+    """Fast path equivalent of ProductMasterSerializer(many=True); needs with_current_stock()"""
+
+    def get_fields(self):
+        to_datetime = datetime_converter()
+        return (
+            ('id', 'id', None),
+            ('name', 'name', None),
+            ('description', 'description', None),
+            ('sku', 'sku', None),
+            ('current_stock', 'current_stock', None),
+            ('created_at', 'created_at', to_datetime),
+            ('updated_at', 'updated_at', to_datetime),
+        )
+
+class InventoryReportValuesSerializer(ValuesSerializer):
+    """Fast path equivalent of InventoryReportSerializer(many=True); needs with_current_stock()"""
+
+    def __init__(self, queryset, status=inventory_status):
+        super().__init__(queryset)
+        self.status = status
+
+    def get_fields(self):
+        return (
+            ('product_id', 'id', None),
+            ('product_name', 'name', None),
+            ('product_sku', 'sku', None),
+            ('product_description', 'description', lambda value: value or ''),
+            ('current_stock', 'current_stock', None),
+            ('status', 'current_stock', self.status),
+            ('created_at', 'created_at', datetime_converter()),
+        )
+
+class CountSessionSerializer(serializers.ModelSerializer):
+    line_count = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = CountSession
+        fields = ['id', 'remarks', 'status', 'line_count', 'adjustment_in', 'adjustment_out', 'created_at', 'posted_at']
+        read_only_fields = ['status', 'line_count', 'adjustment_in', 'adjustment_out', 'created_at', 'posted_at']
+    
+    def get_line_count(self, obj):
+        # Use the value annotated by the viewset when available
+        if hasattr(obj, 'line_count'):
+            return obj.line_count
+        return obj.lines.count()
+
+class CountVarianceValuesSerializer(ValuesSerializer):
+    """Variance rows of a count session; needs count_variances()"""
+
+    def get_fields(self):
+        return (
+            ('product_id', 'product_id', None),
+            ('product_sku', 'product__sku', None),
+            ('product_name', 'product__name', None),
+            ('counted_quantity', 'counted_quantity', None),
+            ('system_quantity', 'system', None),
+            ('variance', 'variance', None),
+        )
+
+def decimal_string(value):
+    """Match serializers.DecimalField(decimal_places=4) output"""
+    return None if value is None else str(Decimal(value).quantize(Decimal('0.0001')))
+
+def decimal_total(rows, field):
+    """Sum a decimal column of represented rows, formatted like the column"""
+    return str(sum((Decimal(row[field]) for row in rows), Decimal('0.0000')))
+
+class ProductValuationValuesSerializer(ValuesSerializer):
+    """Valuation rows per product; needs a ProductValuation queryset annotated with average_unit_cost"""
+
+    def get_fields(self):
+        return (
+            ('product_id', 'product_id', None),
+            ('product_sku', 'product__sku', None),
+            ('product_name', 'product__name', None),
+            ('quantity', 'quantity', None),
+            ('average_unit_cost', 'average_unit_cost', decimal_string),
+            ('average_value', 'average_value', decimal_string),
+            ('fifo_value', 'fifo_value', decimal_string),
+        )
+
+class CostOfGoodsValuesSerializer(ValuesSerializer):
+    """Cost of goods sold per product; needs cost_of_goods()"""
+
+    def get_fields(self):
+        return (
+            ('product_id', 'product_id', None),
+            ('product_sku', 'product__sku', None),
+            ('product_name', 'product__name', None),
+            ('quantity', 'quantity', None),
+            ('fifo_cogs', 'fifo_cogs', decimal_string),
+            ('average_cogs', 'average_cogs', decimal_string),
+        )
+
+class ReorderParamsSerializer(serializers.Serializer):
+    """Query parameters of the reorder suggestion report"""
+    history_days = serializers.IntegerField(min_value=7, max_value=1095, default=365)
+    window = serializers.IntegerField(min_value=1, max_value=365, default=28)
+    alpha = serializers.FloatField(min_value=0.01, max_value=1, default=0.3)
+    lead_time = serializers.IntegerField(min_value=0, max_value=365, default=7)
+    cover_days = serializers.IntegerField(min_value=0, max_value=365, default=14)
+    service_z = serializers.FloatField(min_value=0, max_value=5, default=1.65)
+    suggested_only = serializers.BooleanField(default=True)
+    
+    def validate(self, data):
+        if data['window'] > data['history_days']:
+            raise serializers.ValidationError({'window': ["The moving average window cannot exceed the history."]})
+        return data
+
+class ScanDraftSerializer(serializers.Serializer):
+    """Header of a new scan draft"""
+    type = serializers.ChoiceField(choices=['IN', 'OUT'])
+    remarks = serializers.CharField(required=False, allow_blank=True, allow_null=True, default=None)
+
+class ScanSerializer(serializers.Serializer):
+    """One barcode scan added to a draft"""
+    sku = serializers.CharField(max_length=100)
+    quantity = serializers.IntegerField(min_value=1, max_value=10000, default=1)
+
+class ChangeFeedParamsSerializer(serializers.Serializer):
+    """Query parameters of the ledger change feed"""
+    after = serializers.IntegerField(min_value=0, default=0)
+    limit = serializers.IntegerField(min_value=1, max_value=5000, default=500)
+
+class LedgerChangeSerializer(serializers.Serializer):
+    """One change feed entry, from a values() row"""
+    id = serializers.IntegerField()
+    entity = serializers.CharField()
+    entity_id = serializers.IntegerField()
+    action = serializers.CharField()
+    data = serializers.JSONField()
+    changed_at = serializers.DateTimeField()
+
+class MovementReportParamsSerializer(serializers.Serializer):
+    """Query parameters of the monthly movement report; months as YYYY-MM"""
+    start = serializers.DateField(input_formats=['%Y-%m'], required=False)
+    end = serializers.DateField(input_formats=['%Y-%m'], required=False)
+    product = serializers.CharField(max_length=100, required=False)
+    by = serializers.ChoiceField(choices=['month', 'product'], default='month')
+    # Pages of ?by=product: the ``next`` of the previous page, and rows per page
+    after = serializers.CharField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=5000, default=1000)
+
+    def validate_after(self, value):
+        product_id, _, month = value.partition(':')
+        try:
+            return int(product_id), datetime.datetime.strptime(month, '%Y-%m').date()
+        except ValueError:
+            raise serializers.ValidationError("Expected <product id>:<YYYY-MM>, as in a previous page's next.")
+
+    def validate_product(self, value):
+        product = product_cache.get_by_sku(value)
+        if product is None:
+            raise serializers.ValidationError("No product with this SKU.")
+        return product
+
+    def validate(self, data):
+        data.setdefault('end', month_of(timezone.now()))
+        data.setdefault('start', add_months(data['end'], -11))
+        if data['start'] > data['end']:
+            raise serializers.ValidationError({'start': ["The start month must not be after the end month."]})
+        if data['start'] < add_months(data['end'], -(MAX_REPORT_MONTHS - 1)):
+            raise serializers.ValidationError({'start': [f"Reports cover at most {MAX_REPORT_MONTHS} months."]})
+        return data
+
+class MonthlyMovementValuesSerializer(ValuesSerializer):
+    """Summary rows per product and month; months without movement have no row"""
+
+    def get_fields(self):
+        return (
+            ('product_id', 'product_id', None),
+            ('product_sku', 'product__sku', None),
+            ('product_name', 'product__name', None),
+            ('month', 'month', lambda value: value.strftime('%Y-%m')),
+            ('in_qty', 'in_qty', None),
+            ('out_qty', 'out_qty', None),
+            ('closing', 'closing', None),
+        )
+
+class LocationStockValuesSerializer(ValuesSerializer):
+    """Stock held at one location, a row per product"""
+
+    def get_fields(self):
+        return (
+            ('product_id', 'product_id', None),
+            ('product_sku', 'product__sku', None),
+            ('product_name', 'product__name', None),
+            ('quantity', 'quantity', None),
+        )
+
+class AvailableToPromiseValuesSerializer(ValuesSerializer):
+    """On-hand, reserved and available-to-promise stock per product; needs with_available_to_promise()"""
+
+    def get_fields(self):
+        return (
+            ('product_id', 'id', None),
+            ('product_sku', 'sku', None),
+            ('product_name', 'name', None),
+            ('on_hand', 'current_stock', None),
+            ('reserved', 'reserved', None),
+            ('available', 'available', None),
+        )
@@ -0,0 +1,146 @@
+from collections import Counter
+
+from django.db import models
+from django.db.models import Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import bump_inventory_version, product_cache
+from .changefeed import log_changes
+from .ledger import apply_stock_deltas, ledger_balances, stock_sign, write_balances
+from .locations import apply_location_deltas, location_deltas, rebuild_location_balances
+from .models import ProductMaster, StockMain, StockDetail
+from .movements import add_movements, apply_movements, month_of, movements, rebuild_monthly_movements
+from .valuation import revalue, value_lines
+
+
+@receiver([post_save, post_delete], sender=ProductMaster)
+@receiver([post_save, post_delete], sender=StockMain)
+@receiver([post_save, post_delete], sender=StockDetail)
+def invalidate_inventory_fragments(sender, **kwargs):
+    """Product and ledger writes change the cached summary cards"""
+    bump_inventory_version()
+
+
+@receiver([post_save, post_delete], sender=ProductMaster)
+def invalidate_product_cache(sender, **kwargs):
+    """Workers drop their cached product records"""
+    product_cache.invalidate()
+
+
+def _transaction_header(transaction_id, line=None):
+    """(type, date, destination id) of a transaction, from the line's cached header when it has one"""
+    if line is not None and line.transaction_id == transaction_id and StockDetail.transaction.is_cached(line):
+        return line.transaction.type, line.transaction.date, line.transaction.to_location_id
+    return (StockMain.objects.filter(pk=transaction_id).values_list('type', 'date', 'to_location_id').first()
+            or (None, None, None))
+
+
+@receiver(post_save, sender=StockDetail)
+def apply_saved_line(sender, instance, created, **kwargs):
+    """Apply a created or edited ledger line to the stock and location balances, monthly movements and valuation"""
+    stored = getattr(instance, '_stored_line', None)
+    transaction_type, date, to_location_id = _transaction_header(instance.transaction_id, instance)
+    if not created and (stored is None or None in stored[:3] or stored[3] is models.DEFERRED):
+        # The stored line is unknown (e.g. loaded with only()); recompute from the ledger
+        product_id = instance.product_id
+        write_balances({product_id: ledger_balances(product_id, product_id + 1).get(product_id, 0)})
+        revalue({product_id})
+        rebuild_monthly_movements({product_id})
+        rebuild_location_balances({product_id})
+    else:
+        deltas = Counter()
+        moved = movements()
+        placed = Counter()
+        if not created:
+            transaction_id, product_id, quantity, location_id = stored
+            stored_type, stored_date, stored_to_location_id = _transaction_header(transaction_id, instance)
+            deltas[product_id] -= stock_sign(stored_type) * quantity
+            add_movements(moved, stored_type, stored_date, {product_id: quantity}, sign=-1)
+            location_deltas(placed, stored_type, stored_to_location_id, [(location_id, product_id, quantity)], sign=-1)
+        deltas[instance.product_id] += stock_sign(transaction_type) * instance.quantity
+        add_movements(moved, transaction_type, date, {instance.product_id: instance.quantity})
+        location_deltas(placed, transaction_type, to_location_id,
+                        [(instance.location_id, instance.product_id, instance.quantity)])
+        apply_stock_deltas(deltas)
+        apply_movements(moved)
+        apply_location_deltas(placed)
+        
+        if created:
+            # New lines are costed incrementally; edits to posted lines revalue the products
+            value_lines(transaction_type, instance.transaction_id, [instance])
+            StockDetail.objects.filter(pk=instance.pk).update(
+                fifo_amount=instance.fifo_amount, average_amount=instance.average_amount
+            )
+        else:
+            revalue({stored[1], instance.product_id})
+    instance._stored_line = (instance.transaction_id, instance.product_id, instance.quantity, instance.location_id)
+
+
+def _deleting_product(origin):
+    """Whether a delete started at a product, whose derived rows are deleted along with its lines"""
+    model = origin.model if isinstance(origin, models.QuerySet) else type(origin)
+    return issubclass(model, ProductMaster)
+
+
+@receiver(post_delete, sender=StockDetail)
+def apply_deleted_line(sender, instance, origin=None, **kwargs):
+    """Remove a deleted ledger line from the stock and location balances, monthly movements and valuation"""
+    if _deleting_product(origin):
+        # Rebuilding the product's balances would re-insert rows for a product being deleted
+        return
+    transaction_type, date, to_location_id = _transaction_header(instance.transaction_id, instance)
+    apply_stock_deltas({instance.product_id: -stock_sign(transaction_type) * instance.quantity})
+    apply_movements(add_movements(movements(), transaction_type, date, {instance.product_id: instance.quantity}, sign=-1))
+    apply_location_deltas(location_deltas(
+        Counter(), transaction_type, to_location_id, [(instance.location_id, instance.product_id, instance.quantity)], sign=-1
+    ))
+    revalue({instance.product_id})
+
+
+@receiver(post_save, sender=StockMain)
+def apply_header_change(sender, instance, created, **kwargs):
+    """
+    Re-sign and revalue the lines of a transaction whose type was changed,
+    move its lines between months when its type or date changed, and
+    between locations when its type or transfer destination changed.
+    """
+    stored_type = getattr(instance, '_stored_type', None)
+    stored_date = getattr(instance, '_stored_date', None)
+    stored_to_location = getattr(instance, '_stored_to_location', None)
+    if not created and stored_type and stored_date:
+        type_changed = stored_type != instance.type
+        if type_changed or month_of(stored_date) != month_of(instance.date):
+            totals = dict(instance.details.values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total'))
+            if type_changed:
+                change = stock_sign(instance.type) - stock_sign(stored_type)
+                apply_stock_deltas({product_id: change * total for product_id, total in totals.items()})
+                revalue(totals)
+            moved = add_movements(movements(), stored_type, stored_date, totals, sign=-1)
+            apply_movements(add_movements(moved, instance.type, instance.date, totals))
+        if stored_to_location is models.DEFERRED:
+            # The stored destination is unknown (e.g. loaded with only()); recompute from the ledger
+            if type_changed or instance.type == 'TRF':
+                rebuild_location_balances(set(instance.details.values_list('product_id', flat=True)))
+        elif type_changed or (instance.type == 'TRF' and stored_to_location != instance.to_location_id):
+            lines = list(instance.details.values('location_id', 'product_id').annotate(
+                total=Sum('quantity')
+            ).values_list('location_id', 'product_id', 'total'))
+            placed = location_deltas(Counter(), stored_type, stored_to_location, lines, sign=-1)
+            apply_location_deltas(location_deltas(placed, instance.type, instance.to_location_id, lines))
+    instance._stored_type = instance.type
+    instance._stored_date = instance.date
+    instance._stored_to_location = instance.to_location_id
+
+
+@receiver(post_save, sender=StockMain)
+@receiver(post_save, sender=StockDetail)
+def log_saved_change(sender, instance, created, **kwargs):
+    """Append the write to the ledger change feed"""
+    log_changes([instance], 'create' if created else 'update')
+
+
+@receiver(post_delete, sender=StockMain)
+@receiver(post_delete, sender=StockDetail)
+def log_deleted_change(sender, instance, **kwargs):
+    log_changes([instance], 'delete')
@@ -1,7 +1,56 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+import msgpack
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError, call_command
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User
-from .models import ProductMaster, StockMain, StockDetail
+from django.db import IntegrityError, connection, transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from .models import (
+    ProductMaster, StockMain, StockDetail, StockBalance, CountSession, ProductValuation, ProductStats, MonthlyMovement,
+    Location, LocationBalance, Reservation,
+)
+from .api_views import accepts_gzip
+from .renderers import FastJSONRenderer
+from .valuation import rebuild_valuations
+from .forecasting import reorder_suggestions
+from .velocity import compute_product_stats
+from .ledger import post_reversal, post_transaction
+from .locations import rebuild_location_balances
+from .forms import CustomStockDetailFormSet, ProductForm
+from .movements import rebuild_monthly_movements
+from .queryplans import explain_queryset, propose_indexes
+from .throttling import ScopedRateThrottle, throttle_cache
+from .caching import ProductCache, cache_lock, product_cache
+from . import loadtest, schema
+from .serializers import (
+    ProductMasterSerializer,
+    InventoryReportSerializer,
+    ProductMasterValuesSerializer,
+    InventoryReportValuesSerializer,
+    inventory_status,
+)
 
 class BasicTestCase(TestCase):
     """Basic tests to ensure the application works"""
@@ -41,3 +90,1459 @@ class BasicTestCase(TestCase):
         })
         # Should redirect after successful login (either 301 or 302 is acceptable)
         self.assertIn(response.status_code, [301, 302])
+
+class ProductBulkUpsertTestCase(TestCase):
+    """Tests for the bulk product upsert endpoint"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('productmaster-bulk-upsert')
+        ProductMaster.objects.create(name='Existing Product', sku='EXIST-001')
+    
+    def test_json_upsert_reports_per_row_results(self):
+        """Test that new SKUs are created, existing ones updated and bad rows reported"""
+        response = self.client.post(self.url, [
+            {'sku': ' new-001 ', 'name': 'New Product', 'description': 'Fresh'},
+            {'sku': 'exist-001', 'name': 'Renamed Product'},
+            {'sku': 'bad sku', 'name': 'Broken'},
+            {'sku': 'NEW-001', 'name': 'Duplicate Row'},
+        ], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['errors']), (1, 1, 2))
+        self.assertEqual([r['status'] for r in response.data['results']], ['created', 'updated', 'error', 'error'])
+        self.assertEqual(ProductMaster.objects.get(sku='NEW-001').name, 'New Product')
+        self.assertEqual(ProductMaster.objects.get(sku='EXIST-001').name, 'Renamed Product')
+        self.assertEqual(ProductMaster.objects.count(), 2)
+    
+    def test_csv_upsert_uses_constant_queries(self):
+        """Test that a CSV body is accepted and validated with one lookup per chunk"""
+        lines = ['sku,name,description'] + [f'CSV-{i:04d},Product {i},Row {i}' for i in range(50)]
+        with self.assertNumQueries(4):  # savepoint, IN lookup, upsert, release
+            response = self.client.post(self.url, '\n'.join(lines), content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 50)
+        self.assertEqual(ProductMaster.objects.filter(sku__startswith='CSV-').count(), 50)
+
+class SkuUniquenessTestCase(TestCase):
+    """Tests for database-enforced SKU uniqueness and scanner lookups"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.product = ProductMaster.objects.create(name='Scanner Product', sku='SCAN-001')
+        stock_in = StockMain.objects.create(type='IN')
+        StockDetail.objects.create(transaction=stock_in, product=self.product, quantity=7)
+    
+    def test_duplicate_sku_rejected_by_index(self):
+        """Test that a case-variant duplicate SKU is rejected without a pre-check"""
+        response = self.client.post('/api/products/', {'name': 'Copy', 'sku': 'scan-001'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sku', response.data)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ProductMaster.objects.create(name='Raw Copy', sku='Scan-001')
+    
+    def test_product_form_leaves_duplicates_to_the_index(self):
+        """Test that adding a product runs no SKU pre-check and reports a case-variant duplicate on the field"""
+        user = User.objects.create_user(username='skuuser', password='testpass123')
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(ProductForm(data={'name': 'Copy', 'sku': 'scan-001'}).is_valid())
+        self.assertEqual(len(queries), 0)
+        
+        response = self.client.post(reverse('add_product'), {'name': 'Copy', 'sku': 'scan-001'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['form'].errors, {'sku': ['A product with this SKU already exists.']})
+        
+        response = self.client.post(reverse('add_product'), {'name': 'New', 'sku': ' new-001 '})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(ProductMaster.objects.filter(sku='NEW-001', name='New').exists())
+        self.assertEqual(ProductForm(instance=self.product)['sku'].value(), 'SCAN-001')
+    
+    def test_lookup_returns_product_and_stock_in_one_query(self):
+        """Test that the scanner lookup resolves SKU and stock in one query"""
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/products/lookup/scan-001/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], self.product.id)
+        self.assertEqual(response.data['current_stock'], 7)
+        self.assertEqual(self.client.get('/api/products/lookup/NOPE-001/').status_code, 404)
+
+class FastSerializationTestCase(TestCase):
+    """Tests that the fast serialization path matches the DRF serializers byte for byte"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        stock_in = StockMain.objects.create(type='IN')
+        for i, quantity in enumerate([0, 3, 12]):
+            product = ProductMaster.objects.create(
+                name=f'Product  {i}', sku=f'FAST-00{i}', description='Déjà vu' if i else None
+            )
+            if quantity:
+                StockDetail.objects.create(transaction=stock_in, product=product, quantity=quantity)
+    
+    def test_values_serializers_match_drf_output(self):
+        """Test that the values() serializers render the same bytes as the DRF serializers"""
+        products = ProductMaster.objects.with_current_stock().order_by('id')
+        self.assertEqual(
+            FastJSONRenderer().render(ProductMasterValuesSerializer(products).data),
+            JSONRenderer().render(ProductMasterSerializer(products, many=True).data),
+        )
+        report = [{
+            'product_id': p.id, 'product_name': p.name, 'product_sku': p.sku,
+            'product_description': p.description or '', 'current_stock': p.current_stock,
+            'status': inventory_status(p.current_stock), 'created_at': p.created_at,
+        } for p in products]
+        self.assertEqual(
+            FastJSONRenderer().render(InventoryReportValuesSerializer(products).data),
+            JSONRenderer().render(InventoryReportSerializer(report, many=True).data),
+        )
+    
+    def test_report_endpoints_use_constant_queries(self):
+        """Test that the inventory report endpoints no longer query per product"""
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/inventory/current_inventory/')
+        self.assertEqual([row['status'] for row in response.json()], ['Low Stock', 'Low Stock', 'In Stock'])
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/inventory/low_stock/')
+        self.assertEqual([row['status'] for row in response.json()], ['Out of Stock', 'Low Stock'])
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/products/', {'search': 'FAST'})
+        self.assertEqual(len(response.json()), 3)
+
+class MachineFormatsTestCase(TestCase):
+    """Tests for content negotiation of the compact machine formats"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        ProductMaster.objects.create(name='Columnar A', sku='COL-001')
+        ProductMaster.objects.create(name='Columnar B', sku='COL-002')
+    
+    def test_default_is_json(self):
+        """Test that clients without a preference still get JSON"""
+        response = self.client.get('/api/inventory/current_inventory/', HTTP_ACCEPT='*/*')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertNotIn('Content-Encoding', response)
+    
+    def test_columnar_gzip(self):
+        """Test that columnar output has one array per field and is gzipped on request"""
+        response = self.client.get(
+            '/api/inventory/current_inventory/',
+            HTTP_ACCEPT='application/vnd.columnar+json',
+            HTTP_ACCEPT_ENCODING='gzip, deflate',
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        payload = json.loads(gzip.decompress(response.content))
+        self.assertEqual(payload['count'], 2)
+        self.assertEqual(payload['columns']['product_sku'], ['COL-001', 'COL-002'])
+        
+        # Clients refusing gzip get the plain bytes
+        for accept_encoding in ('gzip;q=0, deflate', 'identity', '*;q=1, gzip;q=0.0'):
+            response = self.client.get('/api/inventory/current_inventory/', HTTP_ACCEPT='application/vnd.columnar+json',
+                                       HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertNotIn('Content-Encoding', response)
+            self.assertEqual(json.loads(response.content)['count'], 2)
+        self.assertTrue(accepts_gzip('deflate, *;q=0.5'))
+        self.assertTrue(accepts_gzip('GZIP; q=0.8'))
+    
+    def test_msgpack(self):
+        """Test that MessagePack output decodes to the JSON payload"""
+        response = self.client.get('/api/products/', {'format': 'msgpack', 'ordering': 'sku'})
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), self.client.get('/api/products/', {'ordering': 'sku'}).json())
+
+class FragmentCachingTestCase(TestCase):
+    """Tests for versioned fragment caching on the inventory pages"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cacheuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.product = ProductMaster.objects.create(name='Cached Product', sku='CACHE-001')
+        ProductMaster.objects.create(name='Other Product', sku='CACHE-002')
+    
+    def test_pages_render_with_constant_queries(self):
+        """Test that the product pages no longer query stock per product"""
+        for url in [reverse('product_list'), reverse('inventory_report'), reverse('dashboard')]:
+            self.client.get(url)
+            ProductMaster.objects.create(name=f'Extra {url}', sku=f'EXTRA-{len(url):03d}')
+            with CaptureQueriesContext(connection) as first:
+                self.client.get(url)
+            ProductMaster.objects.create(name=f'More {url}', sku=f'MORE-{len(url):03d}')
+            with CaptureQueriesContext(connection) as second:
+                self.client.get(url)
+            self.assertEqual(len(first), len(second), url)
+    
+    def test_write_refreshes_rows_and_summary(self):
+        """Test that a transaction re-renders the affected row and the summary cards"""
+        response = self.client.get(reverse('product_list'))
+        self.assertContains(response, '<span class="h4 text-success">0</span>', html=False)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            stock_in = StockMain.objects.create(type='IN')
+            StockDetail.objects.create(transaction=stock_in, product=self.product, quantity=8)
+        
+        response = self.client.get(reverse('product_list'))
+        self.assertContains(response, '<span class="h4 text-success">1</span>', html=False)
+        self.assertContains(response, '8')
+
+class AdminChangelistTestCase(TestCase):
+    """Tests that admin changelists run a constant number of queries"""
+    
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass123', email='a@example.com')
+        self.client.force_login(self.admin)
+    
+    def add_rows(self, start, count):
+        stock_in = StockMain.objects.create(type='IN')
+        for i in range(start, start + count):
+            product = ProductMaster.objects.create(name=f'Admin Product {i}', sku=f'ADM-{i:03d}')
+            StockDetail.objects.create(transaction=stock_in, product=product, quantity=i)
+    
+    def test_changelists_use_constant_queries(self):
+        """Test that stock and item totals are annotated instead of queried per row"""
+        urls = [
+            '/admin/home/productmaster/',
+            '/admin/home/productmaster/?o=3&stock_status=low',
+            '/admin/home/stockmain/?o=4',
+            '/admin/home/stockdetail/',
+        ]
+        self.add_rows(1, 3)
+        counts = []
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            counts.append(len(queries))
+        self.add_rows(4, 6)
+        for url, count in zip(urls, counts):
+            with self.assertNumQueries(count):
+                self.client.get(url)
+    
+    def test_stock_status_filter(self):
+        """Test that the stock status filter runs on the annotated stock"""
+        self.add_rows(4, 4)  # stock 4, 5, 6, 7
+        response = self.client.get('/admin/home/productmaster/', {'stock_status': 'low'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+class StockBalanceTestCase(TestCase):
+    """Tests for the maintained stock balances and the ledger reconciliation command"""
+    
+    def setUp(self):
+        self.product = ProductMaster.objects.create(name='Balance Product', sku='BAL-001')
+        self.other = ProductMaster.objects.create(name='Other Balance', sku='BAL-002')
+        self.stock_in = StockMain.objects.create(type='IN')
+        self.line = StockDetail.objects.create(transaction=self.stock_in, product=self.product, quantity=10)
+    
+    def test_balances_follow_ledger_edits(self):
+        """Test that creating, editing, re-typing and deleting lines keep balances in step"""
+        stock_out = StockMain.objects.create(type='OUT')
+        StockDetail.objects.create(transaction=stock_out, product=self.product, quantity=4)
+        self.assertEqual(self.product.get_current_stock(), 6)
+        
+        line = StockDetail.objects.get(pk=self.line.pk)
+        line.product = self.other
+        line.quantity = 3
+        line.save()
+        self.assertEqual((self.product.get_current_stock(), self.other.get_current_stock()), (-4, 3))
+        
+        stock_out = StockMain.objects.get(pk=stock_out.pk)
+        stock_out.type = 'IN'
+        stock_out.save()
+        self.assertEqual(self.product.get_current_stock(), 4)
+        
+        self.stock_in.delete()
+        self.assertEqual((self.product.get_current_stock(), self.other.get_current_stock()), (4, 0))
+        for product in (self.product, self.other):
+            self.assertEqual(product.get_current_stock(), product.get_ledger_stock())
+    
+    def test_deleting_a_product_with_history(self):
+        """Test that a product with ledger lines can be deleted, taking its derived rows with it"""
+        location = Location.objects.create(code='BIN', name='Bin')
+        post_transaction('IN', {self.product.pk: 5, self.other.pk: 2}, locations={self.product.pk: location.pk})
+        user = User.objects.create_user(username='remover', password='testpass123')
+        self.client.force_login(user)
+        
+        response = self.client.delete(f'/api/products/{self.product.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(StockDetail.objects.filter(product_id=self.product.pk).exists())
+        self.assertFalse(StockBalance.objects.filter(product_id=self.product.pk).exists())
+        self.assertFalse(MonthlyMovement.objects.filter(product_id=self.product.pk).exists())
+        self.assertFalse(LocationBalance.objects.exists())
+        self.assertEqual(self.other.get_current_stock(), 2)
+        
+    def test_reconcile_reports_and_repairs(self):
+        """Test that the reconcile command finds drifted balances and repairs them"""
+        StockBalance.objects.filter(product=self.product).update(quantity=99)
+        with tempfile.TemporaryDirectory() as tmp:
+            report = os.path.join(tmp, 'report.csv')
+            call_command('reconcile_ledger', workers=1, range_size=1, report=report, stdout=StringIO())
+            with open(report) as report_file:
+                rows = list(csv.DictReader(report_file))
+            self.assertEqual([(r['sku'], r['ledger_quantity'], r['recorded_quantity']) for r in rows], [('BAL-001', '10', '99')])
+            
+            state = os.path.join(tmp, 'state.json')
+            call_command('reconcile_ledger', workers=1, repair=True, state=state, stdout=StringIO())
+            self.assertEqual(self.product.get_current_stock(), 10)
+            self.assertFalse(os.path.exists(state))
+            
+            # A finished run is repeated in full
+            StockBalance.objects.filter(product=self.product).update(quantity=5)
+            call_command('reconcile_ledger', workers=1, repair=True, state=state, stdout=StringIO())
+            self.assertEqual(self.product.get_current_stock(), 10)
+            
+            # An interrupted one skips the ranges it finished
+            StockBalance.objects.filter(product=self.product).update(quantity=5)
+            run = {'range_size': 1, 'snapshot': None, 'repair': True}
+            with open(state, 'w') as state_file:
+                json.dump({'run': run, 'completed': [[self.product.pk, self.product.pk + 1]], 'discrepancies': []}, state_file)
+            out = StringIO()
+            call_command('reconcile_ledger', workers=1, range_size=1, repair=True, state=state, stdout=out)
+            self.assertIn('skipping 1 ranges already reconciled', out.getvalue())
+            self.assertEqual(self.product.get_current_stock(), 5)
+    
+    def test_reconcile_against_snapshot(self):
+        """Test that a supplied snapshot is compared instead of the stored balances"""
+        with tempfile.TemporaryDirectory() as tmp:
+            snapshot = os.path.join(tmp, 'snapshot.json')
+            with open(snapshot, 'w') as snapshot_file:
+                json.dump({str(self.product.id): 7}, snapshot_file)
+            out = StringIO()
+            call_command('reconcile_ledger', workers=1, snapshot=snapshot, stdout=out)
+            self.assertIn('1 products disagree', out.getvalue())
+
+class CycleCountTestCase(TestCase):
+    """Tests for count sessions, variance computation and batched adjustments"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.products = ProductMaster.objects.bulk_create(
+            [ProductMaster(name=f'Counted Product {i}', sku=f'CNT-{i:03d}') for i in range(30)]
+        )
+        stock_in = StockMain.objects.create(type='IN')
+        for product in self.products:
+            StockDetail.objects.create(transaction=stock_in, product=product, quantity=10)
+        self.session = CountSession.objects.create(remarks='Weekly count')
+    
+    def test_upload_and_variances(self):
+        """Test that counts upload by SKU and variances come from a single query"""
+        lines = ['sku,counted_quantity'] + [f'cnt-{i:03d},{10 + i % 3 - 1}' for i in range(30)] + ['NOPE-001,4', 'CNT-000,x']
+        response = self.client.post(reverse('countsession-counts', args=[self.session.pk]),
+                                    '\n'.join(lines), content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['recorded'], response.data['errors']), (30, 2))
+        
+        url = reverse('countsession-variances', args=[self.session.pk])
+        with self.assertNumQueries(2):  # session, variance rows
+            response = self.client.get(url)
+        self.assertEqual((response.data['total_surplus'], response.data['total_shortage']), (10, 10))
+        self.assertEqual(response.data['lines'][0]['product_sku'], 'CNT-000')
+        self.assertEqual(response.data['lines'][0]['variance'], -1)
+    
+    def test_post_creates_one_adjustment_pair(self):
+        """Test that posting records all variances as one IN and one OUT transaction"""
+        self.client.post(reverse('countsession-counts', args=[self.session.pk]), [
+            {'sku': 'CNT-000', 'counted_quantity': 14},
+            {'sku': 'CNT-001', 'counted_quantity': 0},
+            {'sku': 'CNT-002', 'counted_quantity': 10},
+        ], format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('countsession-post-adjustments', args=[self.session.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'POSTED')
+        
+        adjustment_in = StockMain.objects.get(pk=response.data['adjustment_in'])
+        adjustment_out = StockMain.objects.get(pk=response.data['adjustment_out'])
+        self.assertEqual((adjustment_in.type, adjustment_in.get_total_items()), ('IN', 4))
+        self.assertEqual((adjustment_out.type, adjustment_out.get_total_items()), ('OUT', 10))
+        stock = [product.get_current_stock() for product in self.products[:3]]
+        self.assertEqual(stock, [14, 0, 10])
+        for product in self.products[:3]:
+            self.assertEqual(product.get_current_stock(), product.get_ledger_stock())
+    
+    def test_posted_session_is_closed(self):
+        """Test that a posted session rejects further counts and a second post"""
+        self.client.post(reverse('countsession-post-adjustments', args=[self.session.pk]))
+        response = self.client.post(reverse('countsession-post-adjustments', args=[self.session.pk]))
+        self.assertEqual(response.status_code, 409)
+        response = self.client.post(reverse('countsession-counts', args=[self.session.pk]),
+                                    [{'sku': 'CNT-000', 'counted_quantity': 1}], format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(StockMain.objects.count(), 1)
+
+class TransactionReversalTestCase(TestCase):
+    """Tests for reversing transactions with linked offsetting transactions"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.product = ProductMaster.objects.create(name='Reversed Product', sku='REV-001')
+        self.other = ProductMaster.objects.create(name='Other Reversed', sku='REV-002')
+        self.stock_in = StockMain.objects.create(type='IN')
+        StockDetail.objects.create(transaction=self.stock_in, product=self.product, quantity=10)
+        StockDetail.objects.create(transaction=self.stock_in, product=self.other, quantity=5)
+    
+    def test_reverse_posts_linked_offset(self):
+        """Test that a reversal restores balances, links to the original and is allowed once"""
+        stock_out = StockMain.objects.create(type='OUT')
+        StockDetail.objects.create(transaction=stock_out, product=self.product, quantity=4)
+        
+        url = reverse('stockmain-reverse', args=[stock_out.pk])
+        response = self.client.post(url, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['type'], response.data['reversal_of'], response.data['total_items']), ('IN', stock_out.pk, 4))
+        self.assertEqual(self.product.get_current_stock(), 10)
+        self.assertEqual(self.product.get_current_stock(), self.product.get_ledger_stock())
+        
+        self.assertEqual(self.client.post(url, format='json').status_code, 400)
+        self.assertEqual(self.client.post(reverse('stockmain-reverse', args=[response.data['id']]), format='json').status_code, 400)
+        self.assertEqual(self.client.delete(reverse('stockmain-detail', args=[stock_out.pk])).status_code, 409)
+    
+    def test_reversing_consumed_stock_in_is_refused(self):
+        """Test that reversing an IN whose stock was shipped reports the short products"""
+        stock_out = StockMain.objects.create(type='OUT')
+        StockDetail.objects.create(transaction=stock_out, product=self.product, quantity=8)
+        
+        response = self.client.post(reverse('stockmain-reverse', args=[self.stock_in.pk]), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([(row['sku'], row['available']) for row in response.data['shortages']], [('REV-001', 2)])
+        self.assertEqual(StockMain.objects.count(), 2)
+        self.assertEqual((self.product.get_current_stock(), self.other.get_current_stock()), (2, 5))
+    
+    def test_reverse_from_detail_page(self):
+        """Test that the detail page button reverses and redirects to the reversal"""
+        user = User.objects.create_user(username='reverser', password='testpass123')
+        self.client.force_login(user)
+        url = reverse('reverse_transaction', args=[self.stock_in.pk])
+        self.assertEqual(self.client.get(url).status_code, 405)
+        
+        response = self.client.post(url)
+        reversal = StockMain.objects.get(reversal_of=self.stock_in)
+        self.assertRedirects(response, reverse('transaction_detail', args=[reversal.pk]))
+        self.assertEqual((self.product.get_current_stock(), self.other.get_current_stock()), (0, 0))
+        self.assertContains(self.client.get(reverse('transaction_detail', args=[self.stock_in.pk])), 'Reversed by')
+
+class InventoryValuationTestCase(TestCase):
+    """Tests for FIFO / weighted-average cost layers and the valuation reports"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.product = ProductMaster.objects.create(name='Valued Product', sku='VAL-001')
+        self.transactions_url = reverse('stockmain-list')
+        for unit_cost in ('2.00', '4.00'):
+            self.client.post(self.transactions_url, {
+                'type': 'IN', 'details': [{'product': self.product.id, 'quantity': 10, 'unit_cost': unit_cost}],
+            }, format='json')
+        response = self.client.post(self.transactions_url, {
+            'type': 'OUT', 'details': [{'product': self.product.id, 'quantity': 15}],
+        }, format='json')
+        self.stock_out = StockMain.objects.get(pk=response.data['id'])
+    
+    def valuation(self):
+        return ProductValuation.objects.values_list('quantity', 'fifo_value', 'average_value').get(product=self.product)
+    
+    def test_issue_consumes_oldest_layers(self):
+        """Test that an issue is costed FIFO and at the running average, and the reports agree"""
+        line = self.stock_out.details.get()
+        self.assertEqual((line.fifo_amount, line.average_amount), (Decimal('40.0000'), Decimal('45.0000')))
+        self.assertEqual(self.valuation(), (5, Decimal('20.0000'), Decimal('15.0000')))
+        
+        response = self.client.get(reverse('inventory-valuation'))
+        self.assertEqual((response.data['total_fifo_value'], response.data['total_average_value']), ('20.0000', '15.0000'))
+        self.assertEqual(response.data['products'][0]['average_unit_cost'], '3.0000')
+        
+        response = self.client.get(reverse('inventory-cogs'), {'start': '2000-01-01'})
+        self.assertEqual((response.data['total_fifo_cogs'], response.data['total_average_cogs']), ('40.0000', '45.0000'))
+        self.assertEqual(self.client.get(reverse('inventory-cogs'), {'end': 'soon'}).status_code, 400)
+    
+    def test_reversed_issue_returns_at_its_cost(self):
+        """Test that reversing an issue restores its layers' value and nets out of COGS"""
+        self.client.post(reverse('stockmain-reverse', args=[self.stock_out.pk]), format='json')
+        self.assertEqual(self.valuation(), (20, Decimal('60.0000'), Decimal('60.0000')))
+        self.assertEqual(self.client.get(reverse('inventory-cogs')).data['total_fifo_cogs'], '0.0000')
+        
+        # A receipt without a cost comes in at the average
+        self.client.post(self.transactions_url, {
+            'type': 'IN', 'details': [{'product': self.product.id, 'quantity': 20}],
+        }, format='json')
+        self.assertEqual(self.valuation(), (40, Decimal('120.0000'), Decimal('120.0000')))
+        self.assertEqual(self.client.post(self.transactions_url, {
+            'type': 'OUT', 'details': [{'product': self.product.id, 'quantity': 1, 'unit_cost': '1.00'}],
+        }, format='json').status_code, 400)
+    
+    def test_editing_posted_line_revalues(self):
+        """Test that editing a posted receipt rebuilds the product to match a full replay"""
+        first_in = StockDetail.objects.filter(transaction__type='IN').order_by('id').first()
+        first_in.unit_cost = Decimal('1.00')
+        first_in.save()
+        self.assertEqual(self.stock_out.details.get().fifo_amount, Decimal('30.0000'))
+        self.assertEqual(self.valuation(), (5, Decimal('20.0000'), Decimal('12.5000')))
+        
+        before = self.valuation()
+        rebuild_valuations([self.product.id])
+        self.assertEqual(self.valuation(), before)
+    
+    def test_deleting_a_transaction_replays_once(self):
+        """Test that deleting a transaction rebuilds each product once, inside the delete's own transaction"""
+        products = [self.product] + [
+            ProductMaster.objects.create(name=f'Other Product {n}', sku=f'VAL-00{n}') for n in (2, 3)
+        ]
+        stock_in = StockMain.objects.create(type='IN')
+        for product in products:
+            StockDetail.objects.create(transaction=stock_in, product=product, quantity=2, unit_cost=Decimal('8.00'))
+        self.assertEqual(self.valuation(), (7, Decimal('36.0000'), Decimal('31.0000')))
+        
+        self.client.force_login(User.objects.create_user(username='valuer', password='testpass123'))
+        url = reverse('stockmain-detail', args=[stock_in.pk])
+        
+        # A failing rebuild takes the delete back with it
+        with mock.patch('home.valuation.rebuild_valuations', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            self.client.delete(url)
+        self.assertEqual(stock_in.details.count(), 3)
+        
+        with mock.patch('home.valuation.rebuild_valuations', wraps=rebuild_valuations) as rebuild:
+            self.assertEqual(self.client.delete(url).status_code, 204)
+        rebuild.assert_called_once()
+        self.assertEqual(set(rebuild.call_args.args[0]), {product.id for product in products})
+        self.assertEqual(self.valuation(), (5, Decimal('20.0000'), Decimal('15.0000')))
+
+class DemandForecastTestCase(TestCase):
+    """Tests for the vectorized demand forecast and reorder suggestions"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.selling = ProductMaster.objects.create(name='Selling Product', sku='FC-001')
+        self.idle = ProductMaster.objects.create(name='Idle Product', sku='FC-002')
+        now = timezone.now()
+        stock_in = StockMain.objects.create(type='IN', date=now - datetime.timedelta(days=60))
+        StockDetail.objects.create(transaction=stock_in, product=self.selling, quantity=170)
+        StockDetail.objects.create(transaction=stock_in, product=self.idle, quantity=3)
+        # Five a day for the last four weeks, with varying daily quantities
+        self.sales = [5 + (day % 3) - 1 for day in range(28)]
+        for day, quantity in enumerate(self.sales):
+            stock_out = StockMain.objects.create(type='OUT', date=now - datetime.timedelta(days=27 - day))
+            StockDetail.objects.create(transaction=stock_out, product=self.selling, quantity=quantity)
+    
+    def test_matches_per_product_recurrence(self):
+        """Test that the closed-form statistics match a plain day-by-day computation"""
+        rows = {row['product_sku']: row for row in reorder_suggestions(history_days=60, window=28, alpha=0.3)}
+        daily = [0] * 32 + self.sales
+        mean = sum(daily) / 60
+        level = mean
+        for quantity in daily:
+            level = 0.3 * quantity + 0.7 * level
+        
+        selling = rows['FC-001']
+        stock = 170 - sum(self.sales)
+        self.assertEqual(selling['current_stock'], stock)
+        self.assertAlmostEqual(selling['moving_average'], round(sum(self.sales) / 28, 2))
+        self.assertAlmostEqual(selling['smoothed_demand'], round(level, 2))
+        self.assertAlmostEqual(selling['days_of_cover'], round(stock / level, 1))
+        self.assertGreater(selling['suggested_quantity'], 0)
+        self.assertEqual((rows['FC-002']['days_of_cover'], rows['FC-002']['suggested_quantity']), (None, 0))
+    
+    def test_endpoint_and_command(self):
+        """Test that the API lists only products to reorder and the command exports them"""
+        response = self.client.get(reverse('inventory-reorder'), {'history_days': 60})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['product_sku'] for row in response.data], ['FC-001'])
+        self.assertEqual(self.client.get(reverse('inventory-reorder'), {'history_days': 30, 'window': 60}).status_code, 400)
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'reorder.csv')
+            call_command('reorder_suggestions', history_days=60, all=True, output=path, stdout=StringIO())
+            with open(path) as output_file:
+                self.assertEqual([row['product_sku'] for row in csv.DictReader(output_file)], ['FC-001', 'FC-002'])
+
+
+class ProductStatsTestCase(TestCase):
+    """Tests for the batch velocity and ABC classification"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        now = timezone.now()
+        self.fast = ProductMaster.objects.create(name='Fast Mover', sku='ABC-001')
+        self.medium = ProductMaster.objects.create(name='Medium Mover', sku='ABC-002')
+        self.slow = ProductMaster.objects.create(name='Slow Mover', sku='ABC-003')
+        self.idle = ProductMaster.objects.create(name='Idle Product', sku='ABC-004')
+        stock_in = StockMain.objects.create(type='IN', date=now - datetime.timedelta(days=120))
+        for product in (self.fast, self.medium, self.slow, self.idle):
+            StockDetail.objects.create(transaction=stock_in, product=product, quantity=100)
+        
+        def issue(days_ago, quantities):
+            stock_out = StockMain.objects.create(type='OUT', date=now - datetime.timedelta(days=days_ago))
+            for product, quantity in quantities.items():
+                StockDetail.objects.create(transaction=stock_out, product=product, quantity=quantity)
+            return stock_out
+        
+        issue(10, {self.fast: 50, self.medium: 5})
+        issue(60, {self.fast: 30, self.medium: 10, self.slow: 5})
+        # Outside the 90-day window, and a reversed issue: neither counts
+        issue(100, {self.slow: 40})
+        post_reversal(issue(5, {self.idle: 20}).pk)
+    
+    def test_velocity_turnover_and_classes(self):
+        """Test the rolling volumes, turnover and ABC class of each product"""
+        self.assertEqual(compute_product_stats(), 4)
+        stats = {row.product_id: row for row in ProductStats.objects.all()}
+        fast = stats[self.fast.pk]
+        self.assertEqual((fast.out_30d, fast.out_90d, fast.abc_class), (50, 80, 'A'))
+        self.assertEqual(fast.turnover, (Decimal(80) * 365 / 90 / 20).quantize(Decimal('0.01')))
+        self.assertEqual((stats[self.medium.pk].out_30d, stats[self.medium.pk].abc_class), (5, 'B'))
+        self.assertEqual((stats[self.slow.pk].out_90d, stats[self.slow.pk].abc_class), (5, 'C'))
+        self.assertEqual((stats[self.idle.pk].out_90d, stats[self.idle.pk].abc_class), (0, 'C'))
+        
+        # Recomputing updates the rows in place
+        call_command('compute_product_stats', stdout=StringIO())
+        self.assertEqual(ProductStats.objects.count(), 4)
+    
+    def test_filter_and_sort_products(self):
+        """Test that products can be filtered by class and sorted by velocity"""
+        compute_product_stats()
+        url = reverse('productmaster-list')
+        response = self.client.get(url, {'ordering': '-out_90d'})
+        self.assertEqual([row['sku'] for row in response.data[:3]], ['ABC-001', 'ABC-002', 'ABC-003'])
+        response = self.client.get(url, {'abc_class': 'C', 'ordering': '-out_90d'})
+        self.assertEqual([row['sku'] for row in response.data], ['ABC-003', 'ABC-004'])
+        response = self.client.get(url, {'min_out_30d': 6})
+        self.assertEqual([row['sku'] for row in response.data], ['ABC-001'])
+
+
+class RateLimitingTestCase(TestCase):
+    """Tests for the token-bucket throttles and the report concurrency cap"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.product = ProductMaster.objects.create(name='Limited Product', sku='RATE-001')
+        throttle_cache().clear()
+        self.addCleanup(throttle_cache().clear)
+    
+    def test_reports_cost_more_tokens_than_lookups(self):
+        """Test that weighted reports exhaust their bucket while lookups still pass"""
+        rates = {'anon': '100/min', 'user': '100/min', 'reports': '25/min'}
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}):
+            for _ in range(2):
+                self.assertEqual(self.client.get('/api/inventory/current_inventory/').status_code, 200)
+            response = self.client.get('/api/inventory/current_inventory/')
+            self.assertEqual(response.status_code, 429)
+            self.assertGreater(int(response['Retry-After']), 0)
+            
+            # Lookups cost one token from the client budget
+            for _ in range(10):
+                self.assertEqual(self.client.get('/api/products/lookup/RATE-001/').status_code, 200)
+    
+    def test_concurrency_cap_sheds_load(self):
+        """Test that busy report slots answer 429 per client and 503 in total, then free up"""
+        cache = throttle_cache()
+        cache.set('home:inflight:reports:ip-127.0.0.1', 2)
+        response = self.client.get('/api/inventory/low_stock/')
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '5'))
+        
+        cache.set('home:inflight:reports:ip-127.0.0.1', 0)
+        cache.set('home:inflight:reports', 4)
+        response = self.client.get('/api/inventory/low_stock/')
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '5'))
+        
+        cache.set('home:inflight:reports', 3)
+        self.assertEqual(self.client.get('/api/inventory/low_stock/').status_code, 200)
+        self.assertEqual(cache.get('home:inflight:reports'), 3)
+        self.assertEqual(cache.get('home:inflight:reports:ip-127.0.0.1'), 0)
+    
+    def test_concurrent_requests_share_one_bucket(self):
+        """Test that simultaneous requests from one client cannot overspend its bucket"""
+        request = SimpleNamespace(user=SimpleNamespace(is_authenticated=True, pk=1), META={})
+        view = SimpleNamespace(throttle_scope='reports')
+        start = threading.Barrier(20)
+        allowed = []
+        
+        def send():
+            start.wait()
+            allowed.append(ScopedRateThrottle().allow_request(request, view))
+        
+        original_get = LocMemCache.get
+        
+        def slow_get(cache, *args, **kwargs):
+            # Slow reads must not let requests decide on a stale count
+            value = original_get(cache, *args, **kwargs)
+            time.sleep(0.01)
+            return value
+        
+        rates = {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'reports': '5/min'}
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}), \
+                mock.patch.object(LocMemCache, 'get', slow_get):
+            threads = [threading.Thread(target=send) for _ in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(allowed.count(True), 5)
+            self.assertEqual(len(allowed), 20)
+            
+            # Rejected requests took their charge back and are told when to retry
+            throttle = ScopedRateThrottle()
+            self.assertFalse(throttle.allow_request(request, view))
+            self.assertTrue(0 < throttle.wait() <= 120)
+
+
+class LoadTestHarnessTestCase(TestCase):
+    """Tests for the load-test driver and its latency summary"""
+    
+    def test_parse_mix_and_summarize(self):
+        """Test mix parsing and the nearest-rank percentiles and error rates"""
+        self.assertEqual(loadtest.parse_mix('lookup=3, post=1'), {'lookup': 3.0, 'post': 1.0})
+        with self.assertRaises(ValueError):
+            loadtest.parse_mix('delete=1')
+        
+        results = [('lookup', ms / 1000, 200) for ms in range(1, 101)] + [('post', 0.5, 500)]
+        summary = loadtest.summarize(results, elapsed=2)
+        self.assertEqual((summary['lookup']['p50'], summary['lookup']['p99']), (0.05, 0.099))
+        self.assertEqual((summary['post']['errors'], summary['post']['error_rate']), (1, 1.0))
+        self.assertEqual((summary['total']['requests'], summary['total']['throughput']), (101, 50.5))
+        self.assertNotIn('report', summary)
+    
+    def test_drive_threaded_server(self):
+        """Test that client threads drive a WSGI app served by the threaded server"""
+        seen = []
+        
+        def application(environ, start_response):
+            seen.append((environ['REQUEST_METHOD'], environ['PATH_INFO']))
+            start_response('200 OK', [('Content-Type', 'application/json')])
+            return [b'{}']
+        
+        server = loadtest.start_server(application)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        host, port = server.server_address[:2]
+        results, elapsed = loadtest.drive(f'http://{host}:{port}', [(1, 'SKU-001'), (2, 'SKU-002')],
+                                          {'lookup': 1, 'post': 1}, clients=2, duration=0.3, seed=1)
+        self.assertTrue(results)
+        self.assertTrue(all(status == 200 for _, _, status in results))
+        self.assertIn(('POST', '/api/transactions/'), seen)
+        self.assertGreaterEqual(elapsed, 0.3)
+
+
+class CachedSchemaTestCase(TestCase):
+    """Tests for the pregenerated OpenAPI schema and the lazy drf_yasg import"""
+    
+    def setUp(self):
+        self.client = APIClient(HTTP_HOST='localhost')
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(API_SCHEMA_DIR=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        schema.load_schema.cache_clear()
+        self.addCleanup(schema.load_schema.cache_clear)
+    
+    def test_serves_generated_schema_with_etag(self):
+        """Test that the generated artifact is served, revalidated with ETags and used by the docs page"""
+        call_command('generate_schema', stdout=StringIO())
+        with open(schema.schema_path('json'), 'rb') as artifact:
+            content = artifact.read()
+        
+        response = self.client.get('/api/schema/', {'format': 'openapi'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, content)
+        self.assertIn('/products/', json.loads(content)['paths'])
+        self.assertEqual(self.client.get('/api/schema/', HTTP_IF_NONE_MATCH=response['ETag'],
+                                         data={'format': 'openapi'}).status_code, 304)
+        self.assertTrue(self.client.get('/api/schema/').content.startswith(b'swagger:'))
+        self.assertEqual(self.client.get('/api/docs/', {'format': 'openapi'}).content, content)
+        self.assertEqual(self.client.get('/api/docs/').status_code, 200)
+    
+    def test_drf_yasg_not_imported_at_startup(self):
+        """Test that loading the URLconf does not import drf_yasg's views or generators"""
+        code = (
+            'import sys, django; django.setup(); '
+            'from django.urls import get_resolver; get_resolver().url_patterns; '
+            'print(sorted(name for name in sys.modules if name.startswith("drf_yasg.")))'
+        )
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'parksons_graphics_task.settings'})
+        self.assertEqual(output.stdout.strip(), '[]')
+
+
+class SparseFieldsetsTestCase(TestCase):
+    """Tests for ?fields= and ?expand= on the products, transactions and transaction-details endpoints"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.product = ProductMaster.objects.create(name='Sparse Product', sku='SPARSE-001', description='Long text')
+        self.stock_in = StockMain.objects.create(type='IN', remarks='Sparse')
+        StockDetail.objects.create(transaction=self.stock_in, product=self.product, quantity=7)
+    
+    def test_products_skip_unrequested_columns_and_annotations(self):
+        """Test that sparse product lists neither join the balance nor read the description"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/products/', {'fields': 'id,sku'})
+        self.assertEqual(response.json(), [{'id': self.product.id, 'sku': 'SPARSE-001'}])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('stckbal', queries[0]['sql'])
+        self.assertNotIn('description', queries[0]['sql'])
+        
+        response = self.client.get(f'/api/products/{self.product.id}/', {'fields': 'name,current_stock'})
+        self.assertEqual(response.json(), {'name': 'Sparse Product', 'current_stock': 7})
+        response = self.client.get('/api/products/', {'fields': 'id,price'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('price', response.data['fields'][0])
+        
+        # An empty value is the same as none
+        response = self.client.get(f'/api/products/{self.product.id}/', {'fields': ''})
+        self.assertEqual(response.json(), self.client.get(f'/api/products/{self.product.id}/').json())
+    
+    def test_transactions_expand_details_on_request(self):
+        """Test that lines and totals are only queried when asked for"""
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/transactions/', {'fields': 'id,date'})
+        self.assertEqual(list(response.data[0]), ['id', 'date'])
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/transactions/', {'fields': 'id', 'expand': 'details'})
+        self.assertEqual(len(queries), 2)  # transactions, then lines with their products
+        self.assertEqual(response.data[0]['details'][0]['product_sku'], 'SPARSE-001')
+        
+        # Without ?fields= the full representation is unchanged, with the totals annotated
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/transactions/')
+        self.assertEqual((response.data[0]['total_items'], len(response.data[0]['details'])), (7, 1))
+        self.assertEqual(self.client.get('/api/transactions/', {'expand': 'product'}).status_code, 400)
+    
+    def test_transaction_details_join_products_only_when_needed(self):
+        """Test that product names are joined in only for the fields that show them"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/transaction-details/', {'fields': 'id,quantity'})
+        self.assertEqual(response.json()[0], {'id': response.json()[0]['id'], 'quantity': 7})
+        self.assertNotIn('prodmast', queries[0]['sql'])
+        
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/transaction-details/', {'fields': 'quantity,product_name'})
+        self.assertEqual(response.json(), [{'product_name': 'Sparse Product', 'quantity': 7}])
+
+class TransactionListTestCase(TestCase):
+    """Tests for the paginated, filterable transaction list page"""
+    
+    def setUp(self):
+        user = User.objects.create_user(username='lister', password='testpass123')
+        self.client.force_login(user)
+        self.widget = ProductMaster.objects.create(name='Listed Widget', sku='LIST-001')
+        self.gadget = ProductMaster.objects.create(name='Listed Gadget', sku='LIST-002')
+        now = timezone.now()
+        for days_ago in reversed(range(60)):
+            self.newest = StockMain.objects.create(type='IN', date=now - datetime.timedelta(days=days_ago))
+            StockDetail.objects.create(transaction=self.newest, product=self.widget, quantity=2)
+        StockDetail.objects.create(transaction=self.newest, product=self.gadget, quantity=5)
+        self.oldest = StockMain.objects.create(type='OUT', date=now - datetime.timedelta(days=100))
+        StockDetail.objects.create(transaction=self.oldest, product=self.gadget, quantity=1)
+    
+    def test_pages_render_with_constant_queries(self):
+        """Test that a page costs the same queries whatever the history length"""
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get(reverse('transaction_list'))
+        self.assertEqual(len(response.context['transactions']), 50)
+        self.assertEqual(response.context['summary'], {'total': 61, 'in': 60, 'out': 1, 'trf': 0})
+        newest = response.context['transactions'][0]
+        self.assertEqual((newest.get_total_items(), newest.more_lines), (7, 0))
+        self.assertEqual([detail.product for detail in newest.preview_lines], [self.widget, self.gadget])
+        
+        response = self.client.get(reverse('transaction_list'), {'page': 2})
+        self.assertEqual(response.context['transactions'][-1], self.oldest)
+        self.assertEqual(self.client.get(reverse('transaction_list'), {'page': 99}).context['page'].number, 2)
+        
+        for _ in range(30):
+            stock_in = StockMain.objects.create(type='IN')
+            StockDetail.objects.create(transaction=stock_in, product=self.gadget, quantity=1)
+        with CaptureQueriesContext(connection) as second:
+            self.client.get(reverse('transaction_list'))
+        self.assertEqual(len(first), len(second))
+    
+    def test_filters_narrow_rows_and_counts(self):
+        """Test that type, date range and product filters apply to the rows and the summary"""
+        today = timezone.localdate()
+        response = self.client.get(reverse('transaction_list'), {
+            'date_from': (today - datetime.timedelta(days=9)).isoformat(),
+            'date_to': today.isoformat(),
+        })
+        self.assertEqual(response.context['summary'], {'total': 10, 'in': 10, 'out': 0, 'trf': 0})
+        
+        response = self.client.get(reverse('transaction_list'), {'product': 'list-002'})
+        self.assertEqual(list(response.context['transactions']), [self.newest, self.oldest])
+        self.assertContains(response, 'page=', count=0)
+        
+        response = self.client.get(reverse('transaction_list'), {'type': 'IN', 'product': 'LIST-001', 'page': 2})
+        self.assertEqual(response.context['summary']['total'], 60)
+        self.assertContains(response, '?type=IN&amp;product=LIST-001&amp;page=1')
+        
+        # Transfers are counted on their own, so the cards add up to the total
+        StockMain.objects.create(type='TRF')
+        response = self.client.get(reverse('transaction_list'))
+        self.assertEqual(response.context['summary'], {'total': 62, 'in': 60, 'out': 1, 'trf': 1})
+    
+    def test_invalid_filters_are_reported(self):
+        """Test that a reversed date range shows an error instead of filtering"""
+        response = self.client.get(reverse('transaction_list'), {'date_from': '2026-02-01', 'date_to': '2026-01-01'})
+        self.assertContains(response, 'The start date must not be after the end date.')
+        self.assertEqual(response.context['summary']['total'], 61)
+
+@override_settings(PRODUCT_CACHE_CHECK_INTERVAL=0)
+class ProductCacheTestCase(TestCase):
+    """Tests for the per-worker product lookup cache"""
+    
+    def setUp(self):
+        cache.clear()
+        self.product = ProductMaster.objects.create(name='Cached Widget', sku='PCACHE-001')
+        self.other = ProductMaster.objects.create(name='Cached Gadget', sku='PCACHE-002')
+        self.products = ProductCache()
+        self.addCleanup(product_cache.clear)
+    
+    def test_lookups_by_id_and_sku_hit_after_commit(self):
+        """Test that committed reads are reused by id and SKU, within the size bound"""
+        self.products.get(self.product.pk)
+        self.assertEqual(self.products.stats()['size'], 0)  # Read inside an open transaction
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products.get(self.product.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.products.get(str(self.product.pk)).name, 'Cached Widget')
+            self.assertEqual(self.products.get_by_sku(' pcache-001 ').pk, self.product.pk)
+            self.products.get(self.product.pk).name = 'Changed by a caller'
+            self.assertEqual(self.products.get(self.product.pk).name, 'Cached Widget')
+        self.assertIsNone(self.products.get_by_sku('NOPE-001'))
+        self.assertIsNone(self.products.get('abc'))
+        
+        with override_settings(PRODUCT_CACHE_SIZE=1), self.captureOnCommitCallbacks(execute=True):
+            self.products.get(self.other.pk)
+        stats = self.products.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size'], stats['evictions']), (4, 4, 1, 1))
+    
+    def test_product_writes_invalidate_every_worker(self):
+        """Test that a product save is seen by this and other workers' caches"""
+        with self.captureOnCommitCallbacks(execute=True):
+            product_cache.get(self.product.pk)
+            self.products.get(self.product.pk)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Renamed Widget'
+            self.product.save()
+        self.assertEqual(product_cache.get(self.product.pk).name, 'Renamed Widget')
+        # Another worker notices the shared version moved
+        self.assertEqual(self.products.get(self.product.pk).name, 'Renamed Widget')
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products.get(self.other.pk)
+            self.other.delete()
+        self.assertIsNone(self.products.get(self.other.pk))
+    
+    def test_api_resolves_products_and_reports_stats(self):
+        """Test that transaction posts resolve products through the cache and staff see its stats"""
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/transactions/', {
+                'type': 'IN', 'details': [{'product': self.product.pk, 'quantity': 3}],
+            }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        hits = product_cache.hits
+        response = self.client.post('/api/transactions/', {
+            'type': 'IN', 'details': [{'product': self.product.pk, 'quantity': 2}],
+        }, content_type='application/json')
+        self.assertEqual((response.status_code, product_cache.hits - hits), (201, 1))  # Resolved once, when validated
+        response = self.client.post('/api/transactions/', {
+            'type': 'IN', 'details': [{'product': 999999, 'quantity': 3}],
+        }, content_type='application/json')
+        self.assertIn('Invalid pk "999999"', str(response.json()))
+        
+        self.assertEqual(self.client.get('/api/products/cache_stats/').status_code, 403)
+        admin = User.objects.create_user(username='cachestaff', password='testpass123', is_staff=True)
+        self.client.force_login(admin)
+        response = self.client.get('/api/products/cache_stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.json()['hits'], 0)
+
+class ScanDraftTestCase(TestCase):
+    """Tests for barcode scan drafts committed as one transaction"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='scanner', password='testpass123')
+        self.client.force_login(self.user)
+        self.widget = ProductMaster.objects.create(name='Scanned Widget', sku='SCAN-101')
+        self.gadget = ProductMaster.objects.create(name='Scanned Gadget', sku='SCAN-102')
+    
+    def open_draft(self, transaction_type):
+        response = self.client.post('/api/scan-drafts/', {'type': transaction_type}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        return f"/api/scan-drafts/{response.json()['id']}/"
+    
+    def test_scans_accumulate_without_ledger_writes(self):
+        """Test that repeated SKUs add to one line and scanning never writes to the database"""
+        url = self.open_draft('IN')
+        with CaptureQueriesContext(connection) as queries:
+            for sku in ('SCAN-101', 'scan-101', 'SCAN-102', ' SCAN-101 '):
+                self.assertEqual(self.client.post(url + 'scans/', {'sku': sku}).status_code, 200)
+            response = self.client.post(url + 'scans/', {'sku': 'SCAN-102', 'quantity': 4})
+        self.assertEqual(response.json()['quantity'], 5)
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in queries))
+        self.assertFalse(StockMain.objects.exists())
+        
+        draft = self.client.get(url).json()
+        self.assertEqual([(line['sku'], line['quantity']) for line in draft['lines']], [('SCAN-101', 3), ('SCAN-102', 5)])
+        self.assertEqual(self.client.post(url + 'scans/', {'sku': 'NOPE-101'}).status_code, 400)
+        self.assertEqual(self.client.delete(f'{url}lines/{self.gadget.pk}/').json()['total_items'], 3)
+    
+    def test_commit_posts_one_transaction(self):
+        """Test that a commit posts all lines in one transaction and closes the draft"""
+        url = self.open_draft('IN')
+        self.client.post(url + 'scans/', {'sku': 'SCAN-101', 'quantity': 2})
+        self.client.post(url + 'scans/', {'sku': 'SCAN-102'})
+        
+        response = self.client.post(url + 'commit/')
+        self.assertEqual(response.status_code, 201)
+        stock_main = StockMain.objects.get()
+        self.assertEqual(response.json()['id'], stock_main.pk)
+        self.assertEqual(dict(stock_main.details.values_list('product__sku', 'quantity')), {'SCAN-101': 2, 'SCAN-102': 1})
+        self.assertEqual((self.widget.get_current_stock(), self.gadget.get_current_stock()), (2, 1))
+        self.assertEqual(self.client.post(url + 'commit/').status_code, 404)
+    
+    def test_out_commit_checks_stock_and_owner(self):
+        """Test that an OUT draft short of stock is refused and kept, and drafts are private"""
+        url = self.open_draft('OUT')
+        self.client.post(url + 'scans/', {'sku': 'SCAN-101', 'quantity': 3})
+        response = self.client.post(url + 'commit/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['shortages'], [
+            {'product': self.widget.pk, 'sku': 'SCAN-101', 'quantity': 3, 'available': 0},
+        ])
+        self.assertFalse(StockMain.objects.exists())
+        self.assertEqual(self.client.post(url + 'commit/').status_code, 400)  # Still open
+        
+        self.client.force_login(User.objects.create_user(username='other', password='testpass123'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.post(url + 'scans/', {'sku': 'SCAN-101'}).status_code, 404)
+    
+    def test_draft_is_posted_once(self):
+        """Test that a draft left behind after its commit cannot be posted again, and busy drafts are refused at once"""
+        url = self.open_draft('IN')
+        self.client.post(url + 'scans/', {'sku': 'SCAN-101', 'quantity': 2})
+        key = f"home:scan-draft:{url.rstrip('/').rsplit('/', 1)[1]}"
+        draft = cache.get(key)
+        
+        with cache_lock(cache, f'{key}:lock', 30):
+            response = self.client.post(url + 'scans/', {'sku': 'SCAN-101'})
+        self.assertEqual(response.json(), {'sku': ['The draft is busy; retry the scan.']})
+        
+        stock_main = StockMain.objects.get(pk=self.client.post(url + 'commit/').json()['id'])
+        self.assertEqual(stock_main.draft_id, draft['id'])
+        # As if the worker died between posting and deleting the draft
+        cache.set(key, draft)
+        response = self.client.post(url + 'commit/')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(f'#{stock_main.pk}', response.json()['detail'])
+        self.assertEqual(StockMain.objects.count(), 1)
+        self.assertEqual(self.widget.get_current_stock(), 2)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+@override_settings(LEDGER_FEED_LAG=0)
+class ChangeFeedTestCase(TestCase):
+    """Tests for the ledger change feed"""
+    
+    def setUp(self):
+        self.widget = ProductMaster.objects.create(name='Feed Widget', sku='FEED-001')
+        self.gadget = ProductMaster.objects.create(name='Feed Gadget', sku='FEED-002')
+    
+    def test_posts_are_logged_and_paged_by_cursor(self):
+        """Test that a bulk post logs its header and lines, read in pages after a cursor"""
+        start = self.client.get('/api/changes/head/').json()['cursor']
+        stock_in = post_transaction('IN', {self.widget.pk: 5, self.gadget.pk: 2}, remarks='Feed')
+        
+        response = self.client.get('/api/changes/', {'after': start, 'limit': 2})
+        page = response.json()
+        self.assertEqual([(row['entity'], row['action']) for row in page['changes']],
+                         [('transaction', 'create'), ('transaction_detail', 'create')])
+        self.assertEqual(page['changes'][0]['data']['remarks'], 'Feed')
+        self.assertTrue(page['has_more'])
+        
+        with self.assertNumQueries(1):
+            page = self.client.get('/api/changes/', {'after': page['next'], 'limit': 2}).json()
+        self.assertEqual(page['changes'][0]['data'], {
+            'transaction': stock_in.pk, 'product': self.gadget.pk, 'quantity': 2, 'unit_cost': None, 'location': None,
+        })
+        self.assertFalse(page['has_more'])
+        self.assertEqual(page['next'], self.client.get('/api/changes/head/').json()['cursor'])
+        self.assertEqual(self.client.get('/api/changes/', {'after': page['next']}).json()['changes'], [])
+    
+    def test_updates_and_deletes_are_logged(self):
+        """Test that edits and cascaded deletes show up after the cursor"""
+        stock_in = StockMain.objects.create(type='IN')
+        line = StockDetail.objects.create(transaction=stock_in, product=self.widget, quantity=3)
+        cursor = self.client.get('/api/changes/head/').json()['cursor']
+        
+        line.quantity = 4
+        line.save()
+        transaction_id = stock_in.pk
+        stock_in.delete()
+        changes = self.client.get('/api/changes/', {'after': cursor}).json()['changes']
+        self.assertEqual([(row['entity'], row['entity_id'], row['action']) for row in changes], [
+            ('transaction_detail', line.pk, 'update'),
+            ('transaction_detail', line.pk, 'delete'),
+            ('transaction', transaction_id, 'delete'),
+        ])
+        self.assertEqual(changes[1]['data']['quantity'], 4)
+    
+    def test_lag_holds_back_recent_changes(self):
+        """Test that unsettled changes are held back and bad parameters are refused"""
+        post_transaction('IN', {self.widget.pk: 1})
+        with override_settings(LEDGER_FEED_LAG=60):
+            page = self.client.get('/api/changes/').json()
+        self.assertEqual((page['changes'], page['next'], page['has_more']), ([], 0, False))
+        self.assertEqual(len(self.client.get('/api/changes/').json()['changes']), 2)
+        self.assertEqual(self.client.get('/api/changes/', {'limit': 0}).status_code, 400)
+
+
+class MonthlyMovementTestCase(TestCase):
+    """Tests for the monthly movement summary"""
+    
+    def setUp(self):
+        self.widget = ProductMaster.objects.create(name='Month Widget', sku='MONTH-001')
+        self.gadget = ProductMaster.objects.create(name='Month Gadget', sku='MONTH-002')
+    
+    def at(self, year, month, day=15):
+        return timezone.make_aware(datetime.datetime(year, month, day, 12))
+    
+    def summary(self):
+        return list(MonthlyMovement.objects.order_by('product_id', 'month')
+                    .values_list('product_id', 'month', 'in_qty', 'out_qty', 'closing'))
+    
+    def test_writes_match_a_rebuild(self):
+        """Test that posts, edits, type and date changes and deletes keep the summary equal to a rebuild"""
+        post_transaction('IN', {self.widget.pk: 10, self.gadget.pk: 4}, date=self.at(2025, 1))
+        stock_out = post_transaction('OUT', {self.widget.pk: 3}, date=self.at(2025, 3))
+        line = StockDetail.objects.create(transaction=stock_out, product=self.gadget, quantity=1)
+        line.quantity = 2
+        line.save()
+        stock_out.date = self.at(2025, 2)
+        stock_out.save()
+        # Posted before the other movements, so every later closing moves
+        post_transaction('IN', {self.widget.pk: 5}, date=self.at(2024, 12))
+        self.assertIn((self.widget.pk, datetime.date(2025, 2, 1), 0, 3, 12), self.summary())
+        
+        adjustment = StockMain.objects.create(type='IN', date=self.at(2025, 2))
+        StockDetail.objects.create(transaction=adjustment, product=self.widget, quantity=1)
+        adjustment.type = 'OUT'
+        adjustment.save()
+        line.delete()
+        
+        incremental = self.summary()
+        self.assertEqual(rebuild_monthly_movements(), len(incremental))
+        self.assertEqual(self.summary(), incremental)
+        self.assertEqual(incremental[:3], [
+            (self.widget.pk, datetime.date(2024, 12, 1), 5, 0, 5),
+            (self.widget.pk, datetime.date(2025, 1, 1), 10, 0, 15),
+            (self.widget.pk, datetime.date(2025, 2, 1), 0, 4, 11),
+        ])
+    
+    def test_report_by_month_and_by_product(self):
+        """Test that the report totals contiguous months and lists product rows, reading only the summary"""
+        post_transaction('IN', {self.widget.pk: 10, self.gadget.pk: 4}, date=self.at(2024, 11))
+        post_transaction('OUT', {self.widget.pk: 3}, date=self.at(2025, 2))
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/inventory/movements/', {'start': '2024-12', 'end': '2025-02'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'stckdetl' in query['sql']])
+        self.assertEqual(response.json()['rows'], [
+            {'month': '2024-12', 'in_qty': 0, 'out_qty': 0, 'opening': 14, 'closing': 14},
+            {'month': '2025-01', 'in_qty': 0, 'out_qty': 0, 'opening': 14, 'closing': 14},
+            {'month': '2025-02', 'in_qty': 0, 'out_qty': 3, 'opening': 14, 'closing': 11},
+        ])
+        
+        rows = self.client.get('/api/inventory/movements/', {
+            'start': '2024-11', 'end': '2025-02', 'by': 'product', 'product': 'month-001',
+        }).json()['rows']
+        self.assertEqual([(row['product_sku'], row['month'], row['closing']) for row in rows],
+                         [('MONTH-001', '2024-11', 10), ('MONTH-001', '2025-02', 7)])
+        
+        # Product rows come a page at a time
+        pages, params = [], {'start': '2024-11', 'end': '2025-02', 'by': 'product', 'limit': 2}
+        while True:
+            page = self.client.get('/api/inventory/movements/', params).json()
+            pages.append([(row['product_sku'], row['month']) for row in page['rows']])
+            if not page['has_more']:
+                break
+            params['after'] = page['next']
+        self.assertEqual(pages, [[('MONTH-001', '2024-11'), ('MONTH-001', '2025-02')], [('MONTH-002', '2024-11')]])
+        self.assertEqual(self.client.get('/api/inventory/movements/', {'by': 'product', 'after': 'soon'}).status_code, 400)
+    
+    def test_report_parameters_are_validated(self):
+        """Test that bad months, reversed ranges and unknown SKUs are refused"""
+        for params in ({'start': '2025-13'}, {'start': '2025-03', 'end': '2025-01'},
+                       {'start': '2000-01', 'end': '2025-01'}, {'product': 'NOPE'}):
+            self.assertEqual(self.client.get('/api/inventory/movements/', params).status_code, 400)
+        self.assertEqual(len(self.client.get('/api/inventory/movements/').json()['rows']), 12)
+
+
+class ExplainQueriesTestCase(TestCase):
+    """Tests for the query plan inspection command"""
+    
+    def drop_index(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP INDEX {name}')
+    
+    def test_check_fails_when_a_hot_query_loses_its_index(self):
+        """Test that --check passes on the migrated schema and fails once an index is dropped"""
+        out = StringIO()
+        call_command('explain_queries', '--check', stdout=out)
+        self.assertIn('Every hot query uses its index', out.getvalue())
+        
+        self.drop_index('stckmain_type_date_idx')
+        with self.assertRaisesMessage(CommandError, '1 hot queries lost their index'):
+            call_command('explain_queries', '--check', stdout=StringIO(), stderr=StringIO())
+    
+    def test_scans_and_sorts_get_index_proposals(self):
+        """Test that a full scan with a temporary sort proposes an index on the filter and order columns"""
+        self.drop_index('stckmain_type_date_idx')
+        self.drop_index('stckmain_date_idx')
+        queryset = StockMain.objects.filter(type='OUT').order_by('-date')
+        steps = explain_queryset(queryset)
+        self.assertTrue(any(step.full_scan and step.table == 'stckmain' for step in steps))
+        self.assertTrue(any(step.temp_sort for step in steps))
+        self.assertEqual(propose_indexes(str(queryset.query), steps), [('stockmain', ['type', 'date'])])
+    
+    def test_endpoint_queries_are_explained(self):
+        """Test that endpoint queries are captured and explained without leaving rows behind"""
+        product = ProductMaster.objects.create(name='Plan Widget', sku='PLAN-001')
+        post_transaction('IN', {product.pk: 5})
+        users = User.objects.count()
+        
+        out = StringIO()
+        call_command('explain_queries', '--all', stdout=out)
+        self.assertIn('transaction list, by product', out.getvalue())
+        self.assertIn('API monthly movements', out.getvalue())
+        self.assertRegex(out.getvalue(), r'\d+ queries explained, \d+ flagged')
+        self.assertEqual(User.objects.count(), users)
+
+
+class RequestProfilerTestCase(TestCase):
+    """Tests for opt-in request profiling"""
+    
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir, True)
+        settings_override = override_settings(REQUEST_PROFILING=True, PROFILE_DIR=self.profile_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.staff = User.objects.create_user(username='profstaff', password='testpass123', is_staff=True)
+        self.user = User.objects.create_user(username='profuser', password='testpass123')
+        ProductMaster.objects.create(name='Profiled Widget', sku='PROF-001')
+    
+    def test_only_opted_in_staff_requests_are_profiled(self):
+        """Test that a staff request with ?profile=1 is captured with its SQL, and nothing else is"""
+        self.client.force_login(self.user)
+        self.assertNotIn('X-Profile-Id', self.client.get('/products/', {'profile': 1}))
+        
+        self.client.force_login(self.staff)
+        self.assertNotIn('X-Profile-Id', self.client.get('/products/'))
+        with override_settings(REQUEST_PROFILING=False):
+            self.assertNotIn('X-Profile-Id', self.client.get('/products/', HTTP_X_PROFILE='1'))
+        self.assertEqual(os.listdir(self.profile_dir), [])
+        
+        response = self.client.get('/products/', {'profile': 'cprofile'})
+        capture_id = response['X-Profile-Id']
+        self.assertEqual(sorted(os.listdir(self.profile_dir)), [f'{capture_id}.json', f'{capture_id}.prof'])
+        with open(os.path.join(self.profile_dir, f'{capture_id}.json')) as f:
+            profile = json.load(f)
+        self.assertEqual((profile['path'], profile['status'], profile['user']), ('/products/?profile=cprofile', 200, 'profstaff'))
+        self.assertTrue(any('prodmast' in query['sql'] for query in profile['queries']))
+        self.assertEqual(profile['query_count'], len(profile['queries']))
+        self.assertTrue(profile['top_functions'])
+    
+    @override_settings(PROFILE_KEEP=2)
+    def test_captures_are_pruned_and_listed(self):
+        """Test that old captures are deleted and staff can list and download the rest"""
+        self.client.force_login(self.staff)
+        captures = [self.client.get('/products/', HTTP_X_PROFILE='cprofile')['X-Profile-Id'] for _ in range(3)]
+        self.assertEqual(len(os.listdir(self.profile_dir)), 4)
+        
+        response = self.client.get(reverse('profile_list'))
+        self.assertEqual([profile['id'] for profile in response.context['profiles']], sorted(captures[1:], reverse=True))
+        self.assertContains(response, 'GET /products/')
+        download = self.client.get(reverse('profile_download', args=[captures[2]]))
+        self.assertEqual(download.status_code, 200)
+        self.assertEqual(self.client.get(reverse('profile_download', args=[captures[0]])).status_code, 404)
+        
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('profile_list')).status_code, 302)
+
+
+class LocationTestCase(TestCase):
+    """Tests for stock per location and transfers between locations"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='storekeeper', password='testpass123')
+        self.client.force_login(self.user)
+        self.widget = ProductMaster.objects.create(name='Located Widget', sku='LOC-001')
+        self.gadget = ProductMaster.objects.create(name='Located Gadget', sku='LOC-002')
+        self.shelf = Location.objects.create(code='SHELF', name='Shelf')
+        self.store = Location.objects.create(code='STORE', name='Back Store')
+        post_transaction('IN', {self.widget.pk: 10, self.gadget.pk: 4},
+                         locations={self.widget.pk: self.store.pk, self.gadget.pk: self.store.pk})
+    
+    def balances(self):
+        return sorted(LocationBalance.objects.values_list('location__code', 'product__sku', 'quantity'))
+    
+    def transfer(self, from_code, to_code, details):
+        return self.client.post('/api/transactions/transfer/', {
+            'from_location': from_code, 'to_location': to_code, 'details': details,
+        }, content_type='application/json')
+    
+    def test_transfer_moves_stock_between_locations(self):
+        """Test that a transfer moves stock without changing product totals, and shortages are refused"""
+        response = self.transfer('STORE', 'SHELF', [{'product': self.widget.pk, 'quantity': 6}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['type'], response.json()['to_location']), ('TRF', 'SHELF'))
+        self.assertEqual(self.balances(), [('SHELF', 'LOC-001', 6), ('STORE', 'LOC-001', 4), ('STORE', 'LOC-002', 4)])
+        self.assertEqual(self.widget.get_current_stock(), 10)
+        self.assertEqual(StockBalance.objects.get(product=self.widget).quantity, 10)
+        
+        response = self.transfer('SHELF', 'STORE', [{'product': self.widget.pk, 'quantity': 2},
+                                                    {'product': self.gadget.pk, 'quantity': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['shortages'], [
+            {'product': self.gadget.pk, 'sku': 'LOC-002', 'quantity': 1, 'available': 0},
+        ])
+        self.assertEqual(self.transfer('SHELF', 'SHELF', [{'product': self.widget.pk, 'quantity': 1}]).status_code, 400)
+        self.assertEqual(StockMain.objects.filter(type='TRF').count(), 1)
+        
+        stock = self.client.get('/api/locations/SHELF/stock/').json()
+        self.assertEqual(stock['products'], [
+            {'product_id': self.widget.pk, 'product_sku': 'LOC-001', 'product_name': 'Located Widget', 'quantity': 6},
+        ])
+    
+    def test_reversing_a_transfer_moves_the_stock_back(self):
+        """Test that a transfer is reversed by a transfer back, refused once the stock has moved on"""
+        transfer = self.transfer('STORE', 'SHELF', [{'product': self.widget.pk, 'quantity': 6}]).json()
+        reversal = self.client.post(f"/api/transactions/{transfer['id']}/reverse/").json()
+        self.assertEqual((reversal['type'], reversal['to_location'], reversal['reversal_of']), ('TRF', 'STORE', transfer['id']))
+        self.assertEqual(self.balances(), [('STORE', 'LOC-001', 10), ('STORE', 'LOC-002', 4)])
+        
+        transfer = self.transfer('STORE', 'SHELF', [{'product': self.gadget.pk, 'quantity': 4}]).json()
+        issue = self.client.post('/api/transactions/', {
+            'type': 'OUT', 'details': [{'product': self.gadget.pk, 'quantity': 3, 'location': 'SHELF'}],
+        }, content_type='application/json')
+        self.assertEqual(issue.status_code, 201)
+        response = self.client.post(f"/api/transactions/{transfer['id']}/reverse/")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['shortages'][0]['available'], 1)
+    
+    def test_line_and_header_edits_match_a_rebuild(self):
+        """Test that edits, type and destination changes and deletes keep the location balances equal to a rebuild"""
+        stock_out = StockMain.objects.create(type='OUT')
+        line = StockDetail.objects.create(transaction=stock_out, product=self.widget, quantity=2, location=self.store)
+        line.quantity = 3
+        line.save()
+        stock_out.type = 'TRF'
+        stock_out.to_location = self.shelf
+        stock_out.save()
+        self.assertEqual(self.balances(), [('SHELF', 'LOC-001', 3), ('STORE', 'LOC-001', 7), ('STORE', 'LOC-002', 4)])
+        stock_out = StockMain.objects.get(pk=stock_out.pk)
+        stock_out.to_location = None
+        stock_out.save()
+        StockDetail.objects.filter(product=self.gadget).first().delete()
+        
+        incremental = self.balances()
+        self.assertEqual(incremental, [('STORE', 'LOC-001', 7)])
+        self.assertEqual(rebuild_location_balances(), len(incremental))
+        self.assertEqual(self.balances(), incremental)
+        
+        response = self.client.post('/api/transactions/', {
+            'type': 'OUT', 'details': [{'product': self.widget.pk, 'quantity': 11, 'location': 'STORE'}],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ReservationTestCase(TestCase):
+    """Tests for stock reservations and available to promise"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='salesdesk', password='testpass123')
+        self.client.force_login(self.user)
+        self.widget = ProductMaster.objects.create(name='Held Widget', sku='HOLD-001')
+        self.gadget = ProductMaster.objects.create(name='Held Gadget', sku='HOLD-002')
+        post_transaction('IN', {self.widget.pk: 10, self.gadget.pk: 3})
+    
+    def issue(self, quantities, **extra):
+        return self.client.post('/api/transactions/', {
+            'type': 'OUT', 'details': [{'product': product.pk, 'quantity': quantity} for product, quantity in quantities],
+            **extra,
+        }, content_type='application/json')
+    
+    def test_reservations_hold_stock_until_shipped(self):
+        """Test that holds reduce what can be promised or issued, and shipping an order releases its holds"""
+        response = self.client.post('/api/reservations/', {'product': self.widget.pk, 'quantity': 6, 'reference': 'SO-1'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['product_sku'], 'HOLD-001')
+        response = self.client.post('/api/reservations/', {'product': self.widget.pk, 'quantity': 5})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['shortages'], [{'product': self.widget.pk, 'sku': 'HOLD-001', 'quantity': 5, 'available': 4}])
+        
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.issue([(self.widget, 5), (self.gadget, 1)]).status_code, 400)
+        self.assertEqual(len([query for query in queries if '"reservation"' in query['sql']]), 1)
+        self.client.post('/api/reservations/', {'product': self.widget.pk, 'quantity': 4, 'reference': 'SO-3'})
+        self.assertEqual(self.issue([(self.widget, 7)], reservation='SO-1').status_code, 400)
+        self.assertEqual(self.issue([(self.widget, 6)], reservation='SO-1').status_code, 201)
+        self.assertEqual(list(Reservation.objects.values_list('reference', flat=True)), ['SO-3'])
+        
+        rows = self.client.get('/api/inventory/available/').json()
+        self.assertEqual([(row['product_sku'], row['on_hand'], row['reserved'], row['available']) for row in rows],
+                         [('HOLD-001', 4, 4, 0), ('HOLD-002', 3, 0, 3)])
+    
+    def test_expired_reservations_stop_counting_and_are_swept(self):
+        """Test that expired holds no longer reduce available to promise and are deleted in batches"""
+        past = timezone.now() - datetime.timedelta(hours=1)
+        Reservation.objects.bulk_create([Reservation(product=self.widget, quantity=3, expires_at=past) for _ in range(5)])
+        self.client.post('/api/reservations/', {'product': self.gadget.pk, 'quantity': 2, 'reference': 'SO-2'})
+        
+        rows = self.client.get('/api/inventory/available/', {'product': 'hold-002'}).json()
+        self.assertEqual([(row['reserved'], row['available']) for row in rows], [(2, 1)])
+        self.assertEqual(self.client.get('/api/inventory/available/', {'product': 'HOLD-001'}).json()[0]['available'], 10)
+        self.assertEqual([row['reference'] for row in self.client.get('/api/reservations/').json()], ['SO-2'])
+        
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('sweep_reservations', '--batch-size', '2', stdout=out)
+        self.assertIn('5 expired reservations deleted', out.getvalue())
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('DELETE')]), 3)
+        self.assertEqual(list(Reservation.objects.values_list('reference', flat=True)), ['SO-2'])
+    
+    def test_issue_posts_in_constant_queries(self):
+        """Test that an issue runs as many queries for twenty lines as for one"""
+        products = ProductMaster.objects.bulk_create(
+            [ProductMaster(name=f'Bulk Widget {number}', sku=f'BULK-{number:03d}') for number in range(20)]
+        )
+        post_transaction('IN', {product.pk: 5 for product in products})
+        with self.captureOnCommitCallbacks(execute=True):
+            for product in products:
+                product_cache.get(product.pk)
+        counts = []
+        for lines in (products[:1], products[1:]):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.issue([(product, 2) for product in lines]).status_code, 201)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual([balance.quantity for balance in StockBalance.objects.filter(product__in=products)],
+                         [3] * 20)
+        response = self.issue([(products[0], 2), (products[1], 4)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Only 3 available to promise', str(response.json()))
+    
+    def test_form_checks_available_to_promise_in_one_query(self):
+        """Test that the transaction form refuses issues beyond available to promise without a query per line"""
+        Reservation.objects.create(product=self.gadget, quantity=2, expires_at=timezone.now() + datetime.timedelta(hours=1))
+        data = {'details-TOTAL_FORMS': '2', 'details-INITIAL_FORMS': '0', 'details-MIN_NUM_FORMS': '1',
+                'details-MAX_NUM_FORMS': '1000',
+                'details-0-product': str(self.widget.pk), 'details-0-quantity': '10',
+                'details-1-product': str(self.gadget.pk), 'details-1-quantity': '2'}
+        formset = CustomStockDetailFormSet(data, instance=StockMain(type='OUT'), transaction_type='OUT')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(formset.is_valid())
+        self.assertEqual(len([query for query in queries if '"reservation"' in query['sql']]), 1)
+        self.assertEqual(formset.forms[0].non_field_errors(), [])
+        self.assertIn('Only 1 units available to promise', formset.forms[1].non_field_errors()[0])
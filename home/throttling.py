@@ -0,0 +1,192 @@
+# Rate limiting and load shedding for the API. All state lives in the
+# 'throttle' cache, so limits hold across workers when that cache is shared
+# (Redis in production, see settings.CACHES).
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+THROTTLE_CACHE = 'throttle'
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# In-flight counters expire after this long, so a worker killed mid-request
+# cannot hold a slot forever
+SLOT_TIMEOUT = 300
+
+# Seconds a client is asked to wait when every slot is taken
+CONCURRENCY_RETRY_AFTER = 5
+
+
+def throttle_cache():
+    return caches[THROTTLE_CACHE]
+
+
+def parse_rate(rate):
+    """'<tokens>/<period>' (as DRF rates, e.g. '600/min') to (capacity, period in seconds)"""
+    tokens, period = rate.split('/')
+    return int(tokens), PERIODS[period[0]]
+
+
+def client_key(request):
+    """Identify the client: the user when authenticated, else the remote address"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user-{user.pk}'
+    return f'ip-{BaseThrottle().get_ident(request)}'
+
+
+def request_cost(view):
+    """Tokens charged for a request; views weight expensive actions with ``throttle_costs``"""
+    return getattr(view, 'throttle_costs', {}).get(getattr(view, 'action', None), 1)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket per client and scope, charged the request's cost in tokens.
+
+    A rate of ``N/period`` allows N tokens per period, so a client may burst
+    up to N tokens and then sustain the rate. Spending is counted per fixed
+    window of one period, and the previous window's count is weighted by
+    the share of it still inside the sliding period. The request is charged
+    with one atomic cache.incr() and judged on the total it returns, so
+    concurrent requests from one client can never overspend; a rejected
+    request takes its charge back. Nothing waits or retries.
+    """
+
+    def get_scope(self, request, view):
+        raise NotImplementedError('TokenBucketThrottle subclasses must implement get_scope()')
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        scope = self.get_scope(request, view)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope) if scope else None
+        if rate is None:
+            return True
+
+        capacity, period = parse_rate(rate)
+        cost = min(request_cost(view), capacity)
+        key = f'home:bucket:{scope}:{client_key(request)}'
+        cache = throttle_cache()
+
+        now = time.time()
+        window, elapsed = divmod(now, period)
+        current = f'{key}:{int(window)}'
+        # Windows are kept for two periods, while they still weigh on the next one
+        cache.add(current, 0, timeout=2 * period)
+        try:
+            spent = cache.incr(current, cost)
+        except ValueError:  # Expired between add() and incr()
+            cache.add(current, cost, timeout=2 * period)
+            spent = cost
+        previous = cache.get(f'{key}:{int(window) - 1}', 0)
+        over = previous * (1 - elapsed / period) + spent - capacity
+        if over <= 0:
+            return True
+
+        try:
+            cache.decr(current, cost)
+        except ValueError:  # The window expired meanwhile
+            pass
+        self.wait_seconds = self._refill_seconds(capacity, period, cost, elapsed, previous, spent - cost, over)
+        return False
+
+    @staticmethod
+    def _refill_seconds(capacity, period, cost, elapsed, previous, spent, over):
+        """Seconds until ``cost`` tokens fit, assuming the client sends nothing meanwhile"""
+        remaining = period - elapsed
+        # The previous window's weight fades by previous/period tokens a second
+        if previous and over * period / previous <= remaining:
+            return over * period / previous
+        # Else wait for this window's tokens to fade in turn during the next one
+        if not spent:
+            return remaining
+        return remaining + max(0, period * (1 - (capacity - cost) / spent))
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ClientRateThrottle(TokenBucketThrottle):
+    """Budget per client across the whole API: the 'user' rate, or 'anon' for anonymous clients"""
+
+    def get_scope(self, request, view):
+        user = getattr(request, 'user', None)
+        return 'user' if user is not None and user.is_authenticated else 'anon'
+
+
+class ScopedRateThrottle(TokenBucketThrottle):
+    """Separate budget per client for the endpoints of a view's ``throttle_scope``"""
+
+    def get_scope(self, request, view):
+        return getattr(view, 'throttle_scope', None)
+
+
+class ServiceBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The server is busy with other reports; retry shortly.'
+    default_code = 'service_busy'
+
+    def __init__(self, wait=CONCURRENCY_RETRY_AFTER):
+        super().__init__()
+        # Rendered as Retry-After by DRF's exception handler
+        self.wait = wait
+
+
+class ConcurrencyLimitMixin:
+    """
+    Caps in-flight requests to a view across all workers.
+
+    Limits come from ``settings.API_CONCURRENCY_LIMITS[concurrency_scope]``:
+    ``per_client`` in-flight requests per client (429 beyond it) and
+    ``total`` across all clients (503 beyond it), both with Retry-After.
+    Slots are taken after authentication and rate limits, so rejected
+    requests never hold one.
+    """
+    concurrency_scope = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        limits = getattr(settings, 'API_CONCURRENCY_LIMITS', {}).get(self.concurrency_scope)
+        if not limits:
+            return
+        scope = f'home:inflight:{self.concurrency_scope}'
+        for key, limit, error in (
+            (f'{scope}:{client_key(request)}', limits.get('per_client'),
+             Throttled(wait=CONCURRENCY_RETRY_AFTER, detail='Too many concurrent requests from this client.')),
+            (scope, limits.get('total'), ServiceBusy()),
+        ):
+            if limit is None:
+                continue
+            if not self._acquire_slot(key, limit):
+                raise error
+
+    def dispatch(self, request, *args, **kwargs):
+        self._held_slots = []
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            cache = throttle_cache()
+            for key in self._held_slots:
+                try:
+                    cache.decr(key)
+                except ValueError:  # The counter expired meanwhile
+                    pass
+
+    def _acquire_slot(self, key, limit):
+        cache = throttle_cache()
+        cache.add(key, 0, timeout=SLOT_TIMEOUT)
+        try:
+            in_flight = cache.incr(key)
+        except ValueError:  # Expired between add() and incr()
+            cache.add(key, 1, timeout=SLOT_TIMEOUT)
+            in_flight = 1
+        if in_flight > limit:
+            cache.decr(key)
+            return False
+        self._held_slots.append(key)
+        return True
@@ -14,6 +14,9 @@ urlpatterns = [
     path('transactions/', views.transaction_list, name='transaction_list'),
     path('transactions/add/', views.add_transaction, name='add_transaction'),
     path('transactions/<int:pk>/', views.transaction_detail, name='transaction_detail'),
+    path('transactions/<int:pk>/reverse/', views.reverse_transaction, name='reverse_transaction'),
     path('inventory/', views.inventory_report, name='inventory_report'),
     path('api/product-stock/<int:product_id>/', views.get_product_stock, name='get_product_stock'),
+    path('profiles/', views.profile_list, name='profile_list'),
+    path('profiles/<str:capture_id>/download/', views.profile_download, name='profile_download'),
 ]
@@ -0,0 +1,273 @@
+# Inventory valuation is maintained alongside the ledger: every IN line opens
+# a FIFO cost layer, every OUT line consumes the oldest layers, and
+# ProductValuation keeps the FIFO and weighted-average value on hand. Posting
+# only touches the products in the batch, so no history is replayed. Editing,
+# deleting or re-typing posted lines cannot be applied incrementally: each
+# affected product's whole ledger is replayed in the writer's transaction, so
+# those writes cost O(product history). Writers changing many lines at once
+# run inside deferred_revaluation(), which replays each product only once.
+import contextlib
+import threading
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, models, transaction
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .bulk import update_by_pk
+from .models import CostLayer, ProductMaster, ProductValuation, StockDetail
+
+COST_PLACES = Decimal('0.0001')
+ZERO = Decimal('0')
+
+# Products loaded per query
+VALUATION_CHUNK_SIZE = 500
+
+# Products to rebuild at the end of the open deferred_revaluation() block, per thread
+_pending = threading.local()
+
+
+def _money(value):
+    return Decimal(value).quantize(COST_PLACES)
+
+
+class _Book:
+    """In-memory valuation state of a set of products while lines are applied"""
+
+    def __init__(self, valuations, layers):
+        self.valuations = valuations
+        self.layers = layers
+        self.changed_layers = set()
+        self.new_layers = []
+
+    def valuation(self, product_id):
+        if product_id not in self.valuations:
+            self.valuations[product_id] = ProductValuation(
+                product_id=product_id, quantity=0, fifo_value=ZERO, average_value=ZERO
+            )
+        return self.valuations[product_id]
+
+    def average_unit_cost(self, valuation):
+        if valuation.quantity <= 0:
+            return ZERO
+        return _money(valuation.average_value / valuation.quantity)
+
+    def receive(self, line, transaction_id):
+        """Open a layer for an IN line and set its extended costs"""
+        valuation = self.valuation(line.product_id)
+        if line.fifo_amount is not None:
+            # Costs carried over from the issue being reversed
+            unit_cost = _money(line.fifo_amount / line.quantity)
+        else:
+            unit_cost = line.unit_cost if line.unit_cost is not None else self.average_unit_cost(valuation)
+            line.fifo_amount = line.average_amount = _money(unit_cost * line.quantity)
+
+        layer = CostLayer(transaction_id=transaction_id, product_id=line.product_id, unit_cost=unit_cost,
+                          quantity=line.quantity, remaining=line.quantity)
+        self.layers[line.product_id].append(layer)
+        self.new_layers.append(layer)
+
+        valuation.quantity += line.quantity
+        valuation.fifo_value += line.fifo_amount
+        valuation.average_value += line.average_amount
+
+    def issue(self, line):
+        """Consume the oldest layers for an OUT line and set its extended costs"""
+        valuation = self.valuation(line.product_id)
+        quantity = line.quantity
+
+        if valuation.quantity <= 0:
+            average_amount = ZERO
+        elif quantity >= valuation.quantity:
+            average_amount = valuation.average_value + self.average_unit_cost(valuation) * (quantity - valuation.quantity)
+        else:
+            average_amount = valuation.average_value * quantity / valuation.quantity
+
+        fifo_amount, needed = ZERO, quantity
+        for layer in self.layers[line.product_id]:
+            if not needed:
+                break
+            if not layer.remaining:
+                continue
+            taken = min(layer.remaining, needed)
+            layer.remaining -= taken
+            fifo_amount += layer.unit_cost * taken
+            needed -= taken
+            if layer.pk is not None:
+                self.changed_layers.add(layer)
+        # Issues beyond the valued stock are costed at the average
+        fifo_amount += self.average_unit_cost(valuation) * needed
+
+        line.fifo_amount = _money(fifo_amount)
+        line.average_amount = _money(average_amount)
+
+        valuation.quantity -= quantity
+        if valuation.quantity > 0:
+            valuation.fifo_value -= line.fifo_amount
+            valuation.average_value -= line.average_amount
+        else:
+            valuation.fifo_value = valuation.average_value = ZERO
+
+    def apply(self, transaction_type, transaction_id, line):
+        if transaction_type == 'IN':
+            self.receive(line, transaction_id)
+        elif transaction_type == 'OUT':
+            self.issue(line)
+
+    def save(self):
+        CostLayer.objects.bulk_create(self.new_layers, batch_size=VALUATION_CHUNK_SIZE)
+        if self.changed_layers:
+            update_by_pk(CostLayer, ['remaining'], {layer.pk: (layer.remaining,) for layer in self.changed_layers})
+        if self.valuations:
+            # MySQL upserts on any unique key and rejects an explicit conflict target
+            unique_fields = ['product'] if connection.features.supports_update_conflicts_with_target else None
+            ProductValuation.objects.bulk_create(
+                list(self.valuations.values()),
+                update_conflicts=True,
+                unique_fields=unique_fields,
+                update_fields=['quantity', 'fifo_value', 'average_value', 'updated_at'],
+                batch_size=VALUATION_CHUNK_SIZE,
+            )
+
+
+def _load_book(product_ids, with_layers):
+    valuations, layers = {}, defaultdict(list)
+    product_ids = sorted(product_ids)
+    for start in range(0, len(product_ids), VALUATION_CHUNK_SIZE):
+        chunk = product_ids[start:start + VALUATION_CHUNK_SIZE]
+        valuations.update(
+            (valuation.product_id, valuation)
+            for valuation in ProductValuation.objects.select_for_update().filter(product_id__in=chunk)
+        )
+        if with_layers:
+            for layer in CostLayer.objects.filter(product_id__in=chunk, remaining__gt=0).order_by('product_id', 'id'):
+                layers[layer.product_id].append(layer)
+    return _Book(valuations, layers)
+
+
+def value_lines(transaction_type, transaction_id, lines):
+    """
+    Cost a batch of new ledger lines of one transaction and update the valuation.
+
+    Loads the valuation (and, for OUT, the open layers) of the products in
+    the batch, sets ``fifo_amount`` and ``average_amount`` on each line and
+    writes the layer and valuation changes. Saving the line costs is left
+    to the caller, so bulk posting can insert lines already costed.
+    """
+    if transaction_type not in ('IN', 'OUT') or not lines:
+        return
+    with transaction.atomic():
+        book = _load_book({line.product_id for line in lines}, with_layers=transaction_type == 'OUT')
+        for line in lines:
+            book.apply(transaction_type, transaction_id, line)
+        book.save()
+
+
+def rebuild_valuations(product_ids):
+    """
+    Recompute the layers, valuation and line costs of products from their ledger.
+
+    Used when posted lines are edited, deleted or re-typed, which cannot be
+    applied incrementally.
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+    with transaction.atomic():
+        # Concurrent postings of these products wait for the rebuild (value_lines() locks the same rows)
+        list(ProductValuation.objects.select_for_update().filter(product_id__in=product_ids).values_list('pk'))
+        CostLayer.objects.filter(product_id__in=product_ids).delete()
+        ProductValuation.objects.filter(product_id__in=product_ids).delete()
+
+        book = _Book({}, defaultdict(list))
+        lines = (
+            StockDetail.objects.filter(product_id__in=product_ids)
+            .select_related('transaction')
+            .only('transaction', 'transaction__type', 'transaction__reversal_of', 'product', 'quantity', 'unit_cost')
+            .order_by('id')
+        )
+        costs = {}
+        for line in lines.iterator(chunk_size=2000):
+            header = line.transaction
+            line.fifo_amount, line.average_amount = costs.get((header.reversal_of_id, line.product_id), (None, None))
+            book.apply(header.type, line.transaction_id, line)
+            costs[line.pk] = costs[line.transaction_id, line.product_id] = (line.fifo_amount, line.average_amount)
+        for product_id in product_ids:
+            book.valuation(product_id)
+        book.save()
+        update_by_pk(StockDetail, ['fifo_amount', 'average_amount'],
+                     {pk: amounts for pk, amounts in costs.items() if not isinstance(pk, tuple)})
+
+
+def revalue(product_ids):
+    """Rebuild the valuations of products now, or at the end of the open deferred_revaluation() block"""
+    if hasattr(_pending, 'product_ids'):
+        _pending.product_ids.update(product_ids)
+    else:
+        rebuild_valuations(product_ids)
+
+
+@contextlib.contextmanager
+def deferred_revaluation():
+    """
+    Run the block in a DB transaction and rebuild the products whose posted
+    lines it edited, deleted or re-typed once, at its end and still inside
+    that transaction.
+
+    Deleting a transaction with N lines then replays each product once, not
+    N times, and a failing rebuild rolls the ledger change back with it.
+    Nested blocks join the outermost one.
+    """
+    if hasattr(_pending, 'product_ids'):
+        yield
+        return
+    _pending.product_ids = set()
+    try:
+        with transaction.atomic():
+            yield
+            # Products deleted in the block have no valuation to rebuild
+            rebuild_valuations(ProductMaster.objects.filter(pk__in=_pending.product_ids).values_list('pk', flat=True))
+    finally:
+        del _pending.product_ids
+
+
+def inventory_valuation():
+    """Maintained FIFO and weighted-average value per product, in one query"""
+    return ProductValuation.objects.annotate(
+        average_unit_cost=Case(
+            When(quantity__gt=0, then=F('average_value') / F('quantity')),
+            default=Value(ZERO),
+            output_field=models.DecimalField(max_digits=16, decimal_places=4),
+        )
+    ).order_by('product_id')
+
+
+def cost_of_goods(start=None, end=None):
+    """
+    Cost of goods sold per product between two dates, in one grouped query.
+
+    Issues count at the costs stored on their lines when they were posted.
+    Reversed issues are netted out and returns to suppliers (reversals of
+    receipts) are not cost of goods sold.
+    """
+    sold = Q(transaction__type='OUT', transaction__reversal_of__isnull=True)
+    returned = Q(transaction__type='IN', transaction__reversal_of__type='OUT')
+    lines = StockDetail.objects.filter(sold | returned)
+    if start is not None:
+        lines = lines.filter(transaction__date__date__gte=start)
+    if end is not None:
+        lines = lines.filter(transaction__date__date__lte=end)
+
+    def net(field, output_field):
+        return (
+            Coalesce(Sum(field, filter=sold), Value(0), output_field=output_field)
+            - Coalesce(Sum(field, filter=returned), Value(0), output_field=output_field)
+        )
+
+    amount = models.DecimalField(max_digits=16, decimal_places=4)
+    return lines.values('product_id').annotate(
+        quantity=net('quantity', models.IntegerField()),
+        fifo_cogs=net('fifo_amount', amount),
+        average_cogs=net('average_amount', amount),
+    ).order_by('product_id')
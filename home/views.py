@@ -1,47 +1,138 @@
+import datetime
+from decimal import Decimal
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.db import transaction
-from django.core.exceptions import ValidationError
-from django.http import JsonResponse
+from django.db import IntegrityError, transaction
+from django.core.paginator import Paginator
+from django.db.models import Count, DecimalField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.http import FileResponse, Http404, JsonResponse
+from django.views.decorators.http import require_POST
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from django.conf import settings
+from .caching import get_inventory_version, product_cache
+from .ledger import ReversalError, post_reversal, post_transaction
+from .profiling import get_profile, list_profiles, profile_dir, pyinstrument
 from .models import ProductMaster, StockMain, StockDetail
-from .forms import ProductForm, StockMainForm, CustomStockDetailFormSet
+from .forms import ProductForm, StockMainForm, CustomStockDetailFormSet, TransactionFilterForm
+
+TRANSACTIONS_PER_PAGE = 50
+
+# Lines named in each row of the transaction list
+LINES_PER_TRANSACTION = 5
+
+def filter_transactions(transactions, filters):
+    """
+    Narrow transactions by the cleaned fields of a TransactionFilterForm.
+    
+    Dates become a half-open range on the indexed ``date`` column, in the
+    current time zone, and a product is matched through its lines with a
+    subquery so a transaction is never listed twice.
+    """
+    if filters.get('type'):
+        transactions = transactions.filter(type=filters['type'])
+    if filters.get('date_from'):
+        transactions = transactions.filter(date__gte=start_of_day(filters['date_from']))
+    if filters.get('date_to'):
+        transactions = transactions.filter(date__lt=start_of_day(filters['date_to'] + datetime.timedelta(days=1)))
+    if filters.get('product'):
+        transactions = transactions.filter(
+            pk__in=StockDetail.objects.filter(product__sku=filters['product']).values('transaction_id')
+        )
+    return transactions
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+def with_line_previews(transactions):
+    """
+    Fetch a page of transactions with their line totals and first lines.
+    
+    Each transaction gets ``total_items``, ``preview_lines`` (its first
+    LINES_PER_TRANSACTION lines with their products) and ``more_lines``.
+    The id of each transaction's last previewed line is found with an index
+    seek, so a page reads only the lines it shows however long its
+    transactions are: three queries in all.
+    """
+    transactions = list(transactions.annotate(preview_end=Subquery(
+        StockDetail.objects.filter(transaction=OuterRef('pk')).order_by('pk').values('pk')[LINES_PER_TRANSACTION - 1:LINES_PER_TRANSACTION]
+    )))
+    if not transactions:
+        return transactions
+    
+    lines = Q()
+    for stock_main in transactions:
+        stock_main.preview_lines, stock_main.total_items, stock_main.more_lines = [], 0, 0
+        if stock_main.preview_end is None:  # Fewer lines than the preview holds
+            lines |= Q(transaction_id=stock_main.pk)
+        else:
+            lines |= Q(transaction_id=stock_main.pk, pk__lte=stock_main.preview_end)
+    by_pk = {stock_main.pk: stock_main for stock_main in transactions}
+    for detail in StockDetail.objects.filter(lines).select_related('product').order_by('pk'):
+        by_pk[detail.transaction_id].preview_lines.append(detail)
+    
+    totals = StockDetail.objects.filter(transaction__in=by_pk).values('transaction_id').annotate(
+        total_items=Sum('quantity'), line_count=Count('pk')
+    )
+    for row in totals:
+        stock_main = by_pk[row['transaction_id']]
+        stock_main.total_items = row['total_items']
+        stock_main.more_lines = row['line_count'] - len(stock_main.preview_lines)
+    return transactions
+
+def stock_summary(stock_levels):
+    """Count products per stock status for the summary cards"""
+    summary = {'total': 0, 'in_stock': 0, 'low_stock': 0, 'out_of_stock': 0}
+    for stock in stock_levels:
+        summary['total'] += 1
+        if stock <= 0:
+            summary['out_of_stock'] += 1
+        elif stock <= 5:
+            summary['low_stock'] += 1
+        else:
+            summary['in_stock'] += 1
+    return summary
 
 @login_required
 def dashboard(request):
     """Main dashboard showing inventory overview"""
-    products = ProductMaster.objects.all()
+    products = ProductMaster.objects.with_current_stock().order_by('id')
     recent_transactions = StockMain.objects.all()[:10]
     
-    # Calculate inventory summary
-    total_products = products.count()
-    total_transactions = StockMain.objects.count()
-    low_stock_products = [p for p in products if p.get_current_stock() <= 5]
+    # Summary cards are fragment-cached per inventory version, so these
+    # counts only hit the database when the cached cards are stale
+    summary = SimpleLazyObject(lambda: {
+        'total_products': ProductMaster.objects.count(),
+        'total_transactions': StockMain.objects.count(),
+        'low_stock_count': ProductMaster.objects.with_current_stock().filter(current_stock__lte=5).count(),
+    })
     
     context = {
         'products': products,
         'recent_transactions': recent_transactions,
-        'total_products': total_products,
-        'total_transactions': total_transactions,
-        'low_stock_count': len(low_stock_products),
-        'low_stock_products': low_stock_products,
+        'summary': summary,
+        'inventory_version': get_inventory_version(),
+        'low_stock_products': [p for p in products if p.current_stock <= 5],
     }
     return render(request, 'home/dashboard.html', context)
 
 @login_required
 def product_list(request):
     """Display all products with current stock levels"""
-    products = ProductMaster.objects.all()
-    products_with_stock = []
-    
-    for product in products:
-        products_with_stock.append({
-            'product': product,
-            'current_stock': product.get_current_stock()
-        })
+    products = ProductMaster.objects.with_current_stock().order_by('id')
+    products_with_stock = [
+        {'product': product, 'current_stock': product.current_stock}
+        for product in products
+    ]
     
     context = {
         'products_with_stock': products_with_stock,
+        'summary': stock_summary(item['current_stock'] for item in products_with_stock),
+        'inventory_version': get_inventory_version(),
     }
     return render(request, 'home/product_list.html', context)
 
@@ -51,9 +142,14 @@ def add_product(request):
     if request.method == 'POST':
         form = ProductForm(request.POST)
         if form.is_valid():
-            form.save()
-            messages.success(request, 'Product added successfully!')
-            return redirect('product_list')
+            try:
+                with transaction.atomic():
+                    form.save()
+            except IntegrityError:
+                form.add_error('sku', 'A product with this SKU already exists.')
+            else:
+                messages.success(request, 'Product added successfully!')
+                return redirect('product_list')
     else:
         form = ProductForm()
     
@@ -61,34 +157,61 @@ def add_product(request):
 
 @login_required
 def transaction_list(request):
-    """Display all stock transactions"""
+    """Display stock transactions a page at a time, with filters and per-type counts"""
+    form = TransactionFilterForm(request.GET)
     transactions = StockMain.objects.all()
-    return render(request, 'home/transaction_list.html', {'transactions': transactions})
+    if form.is_valid():
+        transactions = filter_transactions(transactions, form.cleaned_data)
+    
+    # One grouped query counts the filtered transactions per type; the total
+    # also serves as the paginator's count, saving a separate COUNT query
+    counts = dict(transactions.order_by().values_list('type').annotate(count=Count('pk')))
+    summary = {'total': sum(counts.values()), 'in': counts.get('IN', 0), 'out': counts.get('OUT', 0),
+               'trf': counts.get('TRF', 0)}
+    
+    paginator = Paginator(transactions.order_by('-date', '-pk'), TRANSACTIONS_PER_PAGE)
+    paginator.count = summary['total']
+    page = paginator.get_page(request.GET.get('page'))
+    page.object_list = with_line_previews(page.object_list)
+    
+    query = request.GET.copy()
+    query.pop('page', None)
+    context = {
+        'form': form,
+        'page': page,
+        'transactions': page.object_list,
+        'summary': summary,
+        'filtered': bool(query),
+        'querystring': query.urlencode(),
+    }
+    return render(request, 'home/transaction_list.html', context)
 
 @login_required
 def add_transaction(request):
     """Add new stock transaction"""
     if request.method == 'POST':
         main_form = StockMainForm(request.POST)
+        # The lines are validated against an unsaved header, then posted with it in bulk
+        transaction_type = main_form.data.get('type')
+        formset = CustomStockDetailFormSet(
+            request.POST,
+            instance=StockMain(type=transaction_type),
+            transaction_type=transaction_type
+        )
         if main_form.is_valid():
-            try:
-                with transaction.atomic():
-                    stock_main = main_form.save()
-                    formset = CustomStockDetailFormSet(
-                        request.POST, 
-                        instance=stock_main,
-                        transaction_type=stock_main.type
+            with transaction.atomic():
+                if formset.is_valid():
+                    lines = [form.cleaned_data for form in formset.forms
+                             if form.cleaned_data and not form.cleaned_data.get('DELETE', False)]
+                    post_transaction(
+                        transaction_type,
+                        {line['product'].pk: line['quantity'] for line in lines},
+                        remarks=main_form.cleaned_data.get('remarks'),
+                        unit_costs={line['product'].pk: line['unit_cost'] for line in lines
+                                    if line.get('unit_cost') is not None},
                     )
-                    
-                    if formset.is_valid():
-                        formset.save()
-                        messages.success(request, 'Transaction added successfully!')
-                        return redirect('transaction_list')
-                    else:
-                        # If formset is invalid, delete the main transaction
-                        stock_main.delete()
-            except ValidationError as e:
-                messages.error(request, str(e))
+                    messages.success(request, 'Transaction added successfully!')
+                    return redirect('transaction_list')
     else:
         main_form = StockMainForm()
         formset = CustomStockDetailFormSet()
@@ -102,24 +225,43 @@ def add_transaction(request):
 @login_required
 def transaction_detail(request, pk):
     """View details of a specific transaction"""
-    stock_transaction = get_object_or_404(StockMain, pk=pk)
-    details = stock_transaction.details.all()
+    stock_transaction = get_object_or_404(StockMain.objects.select_related('to_location'), pk=pk)
+    details = stock_transaction.details.select_related('location')
     
     context = {
         'transaction': stock_transaction,
         'details': details,
+        'reversal': StockMain.objects.filter(reversal_of=stock_transaction).first(),
     }
     return render(request, 'home/transaction_detail.html', context)
 
+@login_required
+@require_POST
+def reverse_transaction(request, pk):
+    """Post an offsetting transaction for a mistaken one"""
+    stock_transaction = get_object_or_404(StockMain, pk=pk)
+    try:
+        reversal = post_reversal(stock_transaction.pk)
+    except ReversalError as e:
+        shortages = ', '.join(f"{row['sku']} ({row['available']} available)" for row in e.shortages)
+        messages.error(request, f"{e} {shortages}".strip())
+        return redirect('transaction_detail', pk=stock_transaction.pk)
+    
+    messages.success(request, f'Transaction #{stock_transaction.pk} reversed.')
+    return redirect('transaction_detail', pk=reversal.pk)
+
 @login_required
 def inventory_report(request):
     """Generate inventory report"""
-    products = ProductMaster.objects.all()
+    products = ProductMaster.objects.with_current_stock().annotate(
+        fifo_value=Coalesce('valuation__fifo_value', Value(Decimal('0')), output_field=DecimalField(max_digits=16, decimal_places=4))
+    ).order_by('id')
     inventory_data = []
     
     total_value = 0
     for product in products:
-        current_stock = product.get_current_stock()
+        total_value += product.fifo_value
+        current_stock = product.current_stock
         inventory_data.append({
             'product': product,
             'current_stock': current_stock,
@@ -128,25 +270,45 @@ def inventory_report(request):
     
     context = {
         'inventory_data': inventory_data,
+        'summary': stock_summary(item['current_stock'] for item in inventory_data),
+        'total_value': total_value,
+        'inventory_version': get_inventory_version(),
     }
     return render(request, 'home/inventory_report.html', context)
 
 @login_required
 def get_product_stock(request, product_id):
     """AJAX endpoint to get current stock of a product"""
-    try:
-        product = ProductMaster.objects.get(id=product_id)
-        current_stock = product.get_current_stock()
-        return JsonResponse({
-            'success': True,
-            'current_stock': current_stock,
-            'product_name': product.name
-        })
-    except ProductMaster.DoesNotExist:
+    product = product_cache.get(product_id)
+    if product is None:
         return JsonResponse({
             'success': False,
             'error': 'Product not found'
         })
+    return JsonResponse({
+        'success': True,
+        'current_stock': product.get_current_stock(),
+        'product_name': product.name
+    })
+
+@staff_member_required
+def profile_list(request):
+    """Request profiles captured with ?profile=1, newest first, with their top functions"""
+    context = {
+        'profiles': list_profiles(),
+        'enabled': getattr(settings, 'REQUEST_PROFILING', False),
+        'sampling': pyinstrument is not None,
+    }
+    return render(request, 'home/profile_list.html', context)
+
+@staff_member_required
+def profile_download(request, capture_id):
+    """The raw profile of a capture: pstats data for cProfile, an HTML report for sampling"""
+    profile = get_profile(capture_id)
+    if profile is None:
+        raise Http404('No such profile')
+    return FileResponse(open(profile_dir() / profile['profile_file'], 'rb'), as_attachment=True,
+                        filename=profile['profile_file'])
 
 def home(request):
     return redirect('dashboard')
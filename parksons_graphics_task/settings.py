@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # Base directory of the project
@@ -25,6 +26,8 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    # Templates and static files of the API docs pages; drf_yasg itself is imported on first use
+    'drf_yasg',
     'home',
 ]
 
@@ -35,6 +38,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'home.middleware.RequestProfilerMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -99,6 +103,84 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Django REST Framework
+# Inventory versions, rate limits and concurrency slots must be shared by all
+# workers: set REDIS_URL in production (requires the redis package). Without
+# it each process keeps its own counters, which is fine for development.
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        'throttle': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'throttle',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'throttle': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'throttle',
+        },
+    }
+
+REST_FRAMEWORK = {
+    # orjson-backed JSON output, byte-identical to JSONRenderer
+    'DEFAULT_RENDERER_CLASSES': [
+        'home.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # Token buckets: 'N/min' allows bursts of N tokens, refilled at N per minute.
+    # Views charge heavier actions more tokens through throttle_costs.
+    'DEFAULT_THROTTLE_CLASSES': [
+        'home.throttling.ClientRateThrottle',
+        'home.throttling.ScopedRateThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': '600/min',
+        'user': '1200/min',
+        'reports': '300/min',
+    },
+}
+
+# OpenAPI schema artifacts written by `manage.py generate_schema` at deploy time
+API_SCHEMA_DIR = BASE_DIR / 'schema'
+
+# In-flight request caps for heavy endpoints, per client (429) and in total (503)
+API_CONCURRENCY_LIMITS = {
+    'reports': {'per_client': 2, 'total': 4},
+}
+
+# Products kept in each worker's lookup cache, and how often (seconds) a
+# worker checks the shared version for product writes made by other workers
+PRODUCT_CACHE_SIZE = 10000
+PRODUCT_CACHE_CHECK_INTERVAL = 1
+
+# Seconds the ledger change feed holds back new changes. With concurrent
+# writers ids may commit out of order; the lag must exceed the longest
+# transaction that writes to the ledger, or readers can skip its changes
+LEDGER_FEED_LAG = 5
+
+# Seconds a reservation holds stock when no expiry is given; expired holds stop
+# counting against available to promise and are deleted by sweep_reservations
+RESERVATION_TTL = 24 * 3600
+
+# Staff requests with ?profile=1 or an X-Profile header are profiled while this
+# is on; captures are written to PROFILE_DIR, keeping the newest PROFILE_KEEP
+# for at most PROFILE_MAX_AGE seconds, and listed at /profiles/
+REQUEST_PROFILING = os.environ.get('REQUEST_PROFILING', '') == '1'
+PROFILE_DIR = BASE_DIR / 'profiles'
+PROFILE_KEEP = 50
+PROFILE_MAX_AGE = 7 * 86400
+
 # Authentication URLs
 LOGIN_URL = '/login/'
 LOGOUT_URL = '/logout/'